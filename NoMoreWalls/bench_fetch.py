@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""fetch.py 的端到端基准测试
+
+在子进程中启动本地 HTTP 服务，提供生成的订阅：Base64 V2Ray 订阅、原始分享链接、
+带和不带 `proxy-groups` 的 Clash 配置，节点覆盖 `Node.load_url` 支持的所有协议，
+不同订阅之间有一定比例的重复节点。可以为订阅设置响应延迟、错误状态码和慢速分块
+发送。之后在临时目录中复制配置、写出指向本地服务的 sources.list，运行
+`fetch.main()`，以 JSON 报告总耗时、各阶段耗时、吞吐量和峰值 RSS，例如：
+
+    python bench_fetch.py --sources 40 --nodes 500 --output /tmp/bench.json
+
+动态节点插件不会运行；默认不探测节点（生成的服务器地址是随机 IP），需要时加 `--probe`。
+"""
+import argparse
+import base64
+import contextlib
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, NamedTuple, Tuple
+from urllib.parse import quote
+
+import yaml
+
+try:
+    import resource
+except ImportError:
+    resource = None  # type: ignore
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# 复制到临时目录的配置文件
+CONFIG_FILES = ("config.yml", "filter.yml", "abpwhite.txt")
+
+FORMATS = ("base64", "raw", "clash", "clash-groups")
+NODE_TYPES = ("ss", "ssr", "vmess", "trojan", "vless", "hysteria2")
+REGIONS = ("🇭🇰 HK", "🇯🇵 JP", "🇺🇸 US", "SG 新加坡", "台湾", "未知", "中转->HK")
+ERROR_CODES = (403, 404, 500, 502, 503)
+
+
+class SubSpec(NamedTuple):
+    format: str
+    # 节点在共享节点池中的序号
+    nodes: List[int]
+    latency: float
+    status: int
+    # 慢速发送：每块字节数和块间间隔（秒），块大小为 0 表示一次发送
+    drip_chunk: int
+    drip_delay: float
+
+
+def make_specs(args: argparse.Namespace) -> List[SubSpec]:
+    rng = random.Random(args.seed)
+    # 共享节点池越小，订阅之间重复的节点越多
+    pool = max(int(args.sources * args.nodes * (1 - args.duplicates)), args.nodes)
+    specs: List[SubSpec] = []
+    for i in range(args.sources):
+        status = rng.choice(ERROR_CODES) if rng.random() < args.error_rate else 200
+        drip = rng.random() < args.drip_rate
+        specs.append(
+            SubSpec(
+                format=args.formats[i % len(args.formats)],
+                nodes=rng.sample(range(pool), args.nodes),
+                latency=rng.uniform(0, args.latency),
+                status=status,
+                drip_chunk=args.drip_chunk if drip else 0,
+                drip_delay=args.drip_delay,
+            )
+        )
+    return specs
+
+
+def _b64(s: str) -> str:
+    return base64.urlsafe_b64encode(s.encode("utf-8")).decode()
+
+
+def make_node(seed: int, index: int) -> Tuple[str, Dict[str, Any]]:
+    """生成第 `index` 个节点，返回 (分享链接, Clash 数据)"""
+    rng = random.Random(seed * 1000003 + index)
+    kind = NODE_TYPES[index % len(NODE_TYPES)]
+    name = f"{rng.choice(REGIONS)} {index}"
+    server = ".".join(str(rng.randint(1, 254)) for _ in range(4))
+    port = rng.choice([443, 8443, 80, 2053, rng.randint(1000, 60000)])
+    password = f"pw{index}"
+    uid = str(uuid.UUID(int=rng.getrandbits(128)))
+    data: Dict[str, Any] = {"name": name, "type": kind, "server": server, "port": port}
+    if kind == "ss":
+        data.update(cipher="aes-256-gcm", password=password)
+        userinfo = base64.b64encode(f"aes-256-gcm:{password}".encode()).decode()
+        link = f"ss://{userinfo}@{server}:{port}#{quote(name)}"
+    elif kind == "ssr":
+        data.update(
+            cipher="aes-256-cfb", password=password, protocol="origin", obfs="plain"
+        )
+        body = f"{server}:{port}:origin:aes-256-cfb:plain:{_b64(password)}/?remarks={_b64(name)}"
+        link = "ssr://" + _b64(body)
+    elif kind == "vmess":
+        tls = rng.random() < 0.5
+        data.update(uuid=uid, alterId=0, cipher="auto", tls=tls, network="ws")
+        data["ws-opts"] = {"path": "/ws", "headers": {"Host": "a.example.com"}}
+        v = {
+            "v": "2",
+            "ps": name,
+            "add": server,
+            "port": str(port),
+            "id": uid,
+            "aid": "0",
+            "scy": "auto",
+            "net": "ws",
+            "type": "none",
+            "host": "a.example.com",
+            "path": "/ws",
+            "tls": "tls" if tls else "",
+        }
+        link = "vmess://" + base64.b64encode(json.dumps(v).encode()).decode()
+    elif kind == "trojan":
+        data.update(password=password, sni="b.example.com")
+        link = f"trojan://{password}@{server}:{port}?security=tls&sni=b.example.com#{quote(name)}"
+    elif kind == "vless":
+        data.update(uuid=uid, tls=True, servername="c.example.com", network="ws")
+        data["ws-opts"] = {"path": "/ws", "headers": {"Host": "c.example.com"}}
+        link = (
+            f"vless://{uid}@{server}:{port}?encryption=none&security=tls"
+            f"&sni=c.example.com&type=ws&host=c.example.com&path=%2Fws#{quote(name)}"
+        )
+    else:
+        data.update(password=password, sni="d.example.com")
+        # 一部分使用 hy2:// 简写
+        scheme = "hy2" if index % 12 == 5 else "hysteria2"
+        link = f"{scheme}://{password}@{server}:{port}?sni=d.example.com&insecure=1#{quote(name)}"
+    return link, data
+
+
+def make_body(seed: int, spec: SubSpec) -> bytes:
+    nodes = [make_node(seed, i) for i in spec.nodes]
+    if spec.format in ("base64", "raw"):
+        text = "\n".join(link for link, _ in nodes)
+        if spec.format == "raw":
+            return text.encode("utf-8")
+        return base64.b64encode(text.encode("utf-8"))
+    # 像常见的 Clash 订阅一样以 `mixed-port:` 开头，fetch.py 据第一行识别 Clash 配置
+    conf: Dict[str, Any] = {"mixed-port": 7890, "proxies": [data for _, data in nodes]}
+    if spec.format == "clash-groups":
+        names = [data["name"] for _, data in nodes]
+        conf["proxy-groups"] = [{"name": "PROXY", "type": "select", "proxies": names}]
+        conf["rules"] = ["MATCH,PROXY"]
+    return yaml.dump(conf, allow_unicode=True, sort_keys=False).encode("utf-8")
+
+
+def serve(specs: List[SubSpec], seed: int, queue: Any) -> None:
+    """在子进程中生成订阅并提供服务，就绪后把端口和订阅大小放入 `queue`"""
+    bodies = [make_body(seed, spec) for spec in specs]
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            try:
+                i = int(self.path.strip("/"))
+                spec, body = specs[i], bodies[i]
+            except (ValueError, IndexError):
+                self.send_error(404)
+                return
+            time.sleep(spec.latency)
+            if spec.status != 200:
+                self.send_error(spec.status)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            try:
+                if not spec.drip_chunk:
+                    self.wfile.write(body)
+                    return
+                for start in range(0, len(body), spec.drip_chunk):
+                    self.wfile.write(body[start : start + spec.drip_chunk])
+                    self.wfile.flush()
+                    time.sleep(spec.drip_delay)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    queue.put({"port": server.server_address[1], "sizes": [len(b) for b in bodies]})
+    server.serve_forever()
+
+
+def prepare(workdir: str, port: int, count: int) -> None:
+    """在 `workdir` 中准备配置和指向本地服务的 sources.list"""
+    for name in CONFIG_FILES:
+        if os.path.exists(os.path.join(HERE, name)):
+            shutil.copy(os.path.join(HERE, name), workdir)
+    os.makedirs(os.path.join(workdir, "snippets"))
+    with open(os.path.join(HERE, "snippets", "_config.yml"), encoding="utf-8") as f:
+        snip_conf: Dict[str, Any] = yaml.full_load(f)
+    # 地区表等路径相对于 NoMoreWalls 目录；基准测试不访问外部网络，去掉 URL
+    geo_conf = snip_conf.get("geoip") or {}
+    tables: Dict[str, str] = geo_conf.get("tables") or {}
+    for key, path in list(tables.items()):
+        if "://" in path:
+            del tables[key]
+        else:
+            tables[key] = os.path.normpath(os.path.join(HERE, path))
+    mmdb = geo_conf.pop("mmdb", None)
+    if mmdb and "://" not in mmdb:
+        geo_conf["mmdb"] = os.path.normpath(os.path.join(HERE, mmdb))
+    with open(os.path.join(workdir, "snippets", "_config.yml"), "w", encoding="utf-8") as f:
+        yaml.dump(snip_conf, f, allow_unicode=True)
+    with open(os.path.join(workdir, "sources.list"), "w", encoding="utf-8") as f:
+        for i in range(count):
+            f.write(f"http://127.0.0.1:{port}/{i}\n")
+
+
+def peak_rss() -> Any:
+    """本进程的峰值 RSS（MiB），不支持的平台上为 None"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 上单位为 KiB，macOS 上为字节
+    return round(rss / (1048576 if sys.platform == "darwin" else 1024), 1)
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    specs = make_specs(args)
+    queue: Any = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(specs, args.seed, queue), daemon=True)
+    server.start()
+    workdir = tempfile.mkdtemp(prefix="bench_fetch_")
+    cwd = os.getcwd()
+    try:
+        info = queue.get(timeout=300)
+        prepare(workdir, info["port"], len(specs))
+        if not args.probe:
+            open(os.path.join(workdir, "local_NO_PROBE"), "w").close()
+        if args.trace:
+            open(os.path.join(workdir, "local_MEMORY_REPORT"), "w").close()
+        # fetch.py 导入时读取当前目录下的 local_* 文件
+        os.chdir(workdir)
+        sys.path.insert(0, HERE)
+        import fetch
+
+        fetch.AUTOURLS = fetch.AUTOFETCH = []
+        out = sys.stdout if args.verbose else open(os.devnull, "w", encoding="utf-8")
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(out):
+            report = fetch.main()
+        wall = time.perf_counter() - start
+        if out is not sys.stdout:
+            out.close()
+    finally:
+        os.chdir(cwd)
+        server.terminate()
+        if args.keep:
+            print(f"临时目录：{workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    stages = {stage["stage"]: stage["seconds"] for stage in report.stages}
+    served = [s for s, spec in zip(info["sizes"], specs) if spec.status == 200]
+    nodes_served = sum(len(spec.nodes) for spec in specs if spec.status == 200)
+    fetch_seconds = stages.get("fetch") or wall
+    result: Dict[str, Any] = {
+        "config": {
+            "sources": args.sources,
+            "nodes": args.nodes,
+            "formats": list(args.formats),
+            "duplicates": args.duplicates,
+            "latency": args.latency,
+            "error_rate": args.error_rate,
+            "drip_rate": args.drip_rate,
+            "seed": args.seed,
+        },
+        "sources_ok": len(served),
+        "sources_failed": len(specs) - len(served),
+        "sources_drip": sum(1 for spec in specs if spec.drip_chunk and spec.status == 200),
+        "bytes_served": sum(served),
+        "nodes_served": nodes_served,
+        "nodes_merged": len(fetch.merged),
+        "wall_seconds": round(wall, 3),
+        "stages": stages,
+        "throughput": {
+            "nodes_per_second": round(nodes_served / wall, 1) if wall else None,
+            "fetch_mib_per_second": round(sum(served) / 1048576 / fetch_seconds, 2)
+            if fetch_seconds
+            else None,
+        },
+        "peak_rss_mib": peak_rss(),
+    }
+    if args.trace:
+        result["memory"] = report.stages
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sources", type=int, default=40, help="订阅数")
+    parser.add_argument("--nodes", type=int, default=500, help="每个订阅的节点数")
+    parser.add_argument(
+        "--formats",
+        type=lambda s: s.split(","),
+        default=list(FORMATS),
+        help=f"订阅格式，逗号分隔，按顺序轮流使用（{','.join(FORMATS)}）",
+    )
+    parser.add_argument("--duplicates", type=float, default=0.3, help="订阅间重复节点的大致比例")
+    parser.add_argument("--latency", type=float, default=0.2, help="响应延迟上限（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.05, help="返回错误状态码的订阅比例")
+    parser.add_argument("--drip-rate", type=float, default=0.05, help="慢速发送的订阅比例")
+    parser.add_argument("--drip-chunk", type=int, default=4096, help="慢速发送的块大小（字节）")
+    parser.add_argument("--drip-delay", type=float, default=0.01, help="慢速发送的块间间隔（秒）")
+    parser.add_argument("--seed", type=int, default=1, help="随机种子")
+    parser.add_argument("--probe", action="store_true", help="探测节点")
+    parser.add_argument("--trace", action="store_true", help="用 tracemalloc 记录各阶段内存")
+    parser.add_argument("--keep", action="store_true", help="保留临时目录")
+    parser.add_argument("-v", "--verbose", action="store_true", help="显示 fetch.py 的输出")
+    parser.add_argument("--output", help="把 JSON 报告写入文件，默认输出到标准输出")
+    args = parser.parse_args()
+    unknown = set(args.formats) - set(FORMATS)
+    if unknown:
+        parser.error(f"未知的订阅格式：{','.join(sorted(unknown))}")
+
+    text = json.dumps(run(args), ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
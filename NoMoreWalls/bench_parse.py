@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""节点链接解析的微基准测试
+
+把语料（默认 ../erm/lines.txt）重复放大后逐条构造 Node，按协议统计每秒解析的节点数
+和失败数；再把语料编码为 Base64 订阅，测量 `Source._download` 加 `Source.parse`
+的吞吐量，并用 tracemalloc 记录峰值内存和分配块数。`--compare` 可以指定另一份
+fetch.py 做对比，例如：
+
+    git show HEAD~1:NoMoreWalls/fetch.py > /tmp/fetch_old.py
+    python bench_parse.py --scale 2000 --compare /tmp/fetch_old.py
+"""
+import argparse
+import base64
+import importlib.util
+import os
+import sys
+import time
+import tracemalloc
+from types import ModuleType
+from typing import Dict, List, Tuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CORPUS = os.path.join(HERE, "..", "erm", "lines.txt")
+
+
+def load_module(path: str, name: str) -> ModuleType:
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)  # type: ignore
+    spec.loader.exec_module(module)  # type: ignore
+    return module
+
+
+def bench(module: ModuleType, lines: List[str], scale: int) -> Dict[str, Tuple[int, int, float]]:
+    """返回 {协议: (节点数, 失败数, 耗时)}"""
+    by_scheme: Dict[str, List[str]] = {}
+    for line in lines:
+        by_scheme.setdefault(line.split("://", 1)[0], []).append(line)
+    ret: Dict[str, Tuple[int, int, float]] = {}
+    for scheme, urls in sorted(by_scheme.items()):
+        urls = urls * scale
+        failed = 0
+        start = time.perf_counter()
+        for url in urls:
+            try:
+                module.Node(url)
+            except Exception:
+                failed += 1
+        ret[scheme] = (len(urls), failed, time.perf_counter() - start)
+    return ret
+
+
+class FakeResponse:
+    """只实现 `iter_content` 的响应对象，按调用方要求的块大小返回内容"""
+
+    def __init__(self, body: bytes) -> None:
+        self.body = body
+
+    def iter_content(self, chunk_size: int = 1):
+        view = memoryview(self.body)
+        for i in range(0, len(self.body), chunk_size):
+            yield bytes(view[i : i + chunk_size])
+
+
+def bench_pipeline(module: ModuleType, body: bytes) -> Tuple[int, float, int, int]:
+    """返回 (节点数, 耗时, tracemalloc 峰值字节数, 分配块数)"""
+    source = module.Source("bench://")
+    start = time.perf_counter()
+    source.content = source._download(FakeResponse(body))
+    source.parse()
+    elapsed = time.perf_counter() - start
+
+    source = module.Source("bench://")
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    source.content = source._download(FakeResponse(body))
+    source.parse()
+    peak = tracemalloc.get_traced_memory()[1]
+    stats = tracemalloc.take_snapshot().compare_to(before, "filename")
+    tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in stats if stat.count_diff > 0)
+    return len(source.sub or []), elapsed, peak, blocks
+
+
+def report_pipeline(title: str, body: bytes, result: Tuple[int, float, int, int]) -> float:
+    count, elapsed, peak, blocks = result
+    print(
+        f"{title}：{count} 个节点，{len(body) / elapsed / 1024 / 1024:.1f} MiB/秒，"
+        f"峰值 {peak / 1024 / 1024:.2f} MiB（订阅 {len(body) / 1024 / 1024:.2f} MiB），"
+        f"保留 {blocks} 个内存块"
+    )
+    return elapsed
+
+
+def report(title: str, result: Dict[str, Tuple[int, int, float]]) -> float:
+    print(title)
+    total = 0
+    elapsed = 0.0
+    for scheme, (count, failed, seconds) in result.items():
+        print(f"  {scheme:<10} {count / seconds:>12,.0f} 个/秒  失败 {failed}/{count}")
+        total += count
+        elapsed += seconds
+    print(f"  {'总计':<8} {total / elapsed:>12,.0f} 个/秒")
+    return total / elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("corpus", nargs="?", default=DEFAULT_CORPUS, help="每行一个节点链接")
+    parser.add_argument("--scale", type=int, default=1000, help="语料重复次数")
+    parser.add_argument("--pipeline-scale", type=int, default=200, help="订阅测试中语料重复次数")
+    parser.add_argument("--compare", metavar="FETCH_PY", help="与另一份 fetch.py 对比")
+    args = parser.parse_args()
+
+    with open(args.corpus, encoding="utf-8") as f:
+        lines = [line.strip() for line in f if "://" in line]
+    # fetch.py 会读取当前目录下的 local_* 文件
+    os.chdir(HERE)
+    sys.path.insert(0, HERE)
+    modules = [("当前", load_module(os.path.join(HERE, "fetch.py"), "fetch"))]
+    if args.compare:
+        modules.append(("对比", load_module(args.compare, "fetch_compare")))
+
+    speeds = [report(title, bench(module, lines, args.scale)) for title, module in modules]
+    if args.compare:
+        print(f"加速比：{speeds[0] / speeds[1]:.2f}x")
+
+    body = base64.b64encode("\n".join(lines * args.pipeline_scale).encode("utf-8"))
+    print("\nBase64 订阅下载与解析")
+    times = [report_pipeline(title, body, bench_pipeline(module, body)) for title, module in modules]
+    if args.compare:
+        print(f"加速比：{times[1] / times[0]:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""相邻两次运行之间的节点差异
+
+每个节点用不含节点名的去重标识计算 blake2b 指纹，跨运行稳定；节点名中的来源序号
+变化不算作变更。每次运行写出：
+- list.ids.txt：本次 list.meta.yml 中各节点的指纹，每行一个，顺序与 proxies 一致，
+  也是下次运行比较的基准；
+- delta.json：本次节点集的标识 `id`、最近几次运行的差异链 `chain` 和变动统计 `stats`。
+
+差异链中每一项为 {"from", "to", "time", "added": {指纹: 节点}, "removed": [指纹]}，
+`from`/`to` 是前后两次节点集的标识。使用者记下已同步到的标识，在链中从该标识开始
+依次应用之后的各项即可；标识不在链中时重新下载完整的 list.meta.yml 和 list.ids.txt。
+"""
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+ids_file = "list.ids.txt"
+delta_file = "delta.json"
+
+DELTA_VERSION = 1
+# 差异链保留的运行次数
+DELTA_CHAIN_LENGTH = 8
+FINGERPRINT_SIZE = 8
+# fetch.py 给纯数字密码加的 YAML 标记，写入 JSON 前去掉
+STR_TAG = "!!str "
+
+
+class Delta(NamedTuple):
+    # 上次节点集的标识，没有上次的指纹时为 None
+    base: Optional[str]
+    id: str
+    added: List[str]
+    removed: List[str]
+    stats: Dict[str, Any]
+
+
+def fingerprint(key: str) -> str:
+    return hashlib.blake2b(key.encode(), digest_size=FINGERPRINT_SIZE).hexdigest()
+
+
+def set_id(ids: Iterable[str]) -> str:
+    """节点集的标识，与节点顺序无关"""
+    return fingerprint("\n".join(sorted(set(ids))))
+
+
+def _without_str_tag(node: Dict[str, Any]) -> Dict[str, Any]:
+    password = node.get("password")
+    if isinstance(password, str) and password.startswith(STR_TAG):
+        node = dict(node)
+        node["password"] = password[len(STR_TAG) :]
+    return node
+
+
+def read_ids(path: str = ids_file) -> Optional[List[str]]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip()]
+    except OSError:
+        return None
+
+
+def _write_atomic(path: str, text: str) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def update(
+    ids: List[str],
+    nodes: List[Dict[str, Any]],
+    path: str = delta_file,
+    ids_path: str = ids_file,
+    chain_length: int = DELTA_CHAIN_LENGTH,
+) -> Delta:
+    """与上次的指纹比较，写出 delta.json 和 list.ids.txt；`nodes` 与 `ids` 一一对应"""
+    prev = read_ids(ids_path)
+    current = set(ids)
+    new_id = set_id(current)
+    chain: List[Dict[str, Any]] = []
+    try:
+        with open(path, encoding="utf-8") as f:
+            doc: Dict[str, Any] = json.load(f)
+    except (OSError, ValueError):
+        doc = {}
+
+    base: Optional[str] = None
+    added: List[str] = []
+    removed: List[str] = []
+    if prev is not None:
+        base = set_id(prev)
+        previous = set(prev)
+        added = [i for i in dict.fromkeys(ids) if i not in previous]
+        removed = sorted(previous - current)
+        # 基准与上次的 delta.json 不符时（如手动修改过文件），差异链从头开始
+        if doc.get("version") == DELTA_VERSION and doc.get("id") == base:
+            chain = doc.get("chain", [])
+    if base is not None and base != new_id:
+        by_id = dict(zip(ids, nodes))
+        chain.append(
+            {
+                "from": base,
+                "to": new_id,
+                "time": int(time.time()),
+                "added": {i: _without_str_tag(by_id[i]) for i in added},
+                "removed": removed,
+            }
+        )
+    chain = chain[-chain_length:]
+
+    stats: Dict[str, Any] = {
+        "previous": None,
+        "current": len(current),
+        "added": len(added),
+        "removed": len(removed),
+        "churn": None,
+    }
+    if prev is not None:
+        union = len(current | previous)
+        stats["previous"] = len(previous)
+        # 变动的节点数占两次节点集并集的比例
+        stats["churn"] = round((len(added) + len(removed)) / union, 4) if union else 0.0
+    _write_atomic(
+        path,
+        json.dumps(
+            {"version": DELTA_VERSION, "id": new_id, "chain": chain, "stats": stats},
+            ensure_ascii=False,
+            separators=(",", ":"),
+            default=str,
+        )
+        + "\n",
+    )
+    _write_atomic(ids_path, "".join(i + "\n" for i in ids))
+    return Delta(base, new_id, added, removed, stats)
+
+
+def summary(d: Delta) -> str:
+    if d.base is None:
+        return f"没有上次的节点指纹，记录 {d.stats['current']} 个节点"
+    if d.base == d.id:
+        return "节点集未变化"
+    return (
+        f"新增 {len(d.added)} 个，消失 {len(d.removed)} 个，"
+        f"变动率 {d.stats['churn']:.1%}"
+    )
@@ -1,10 +1,143 @@
 #!/usr/bin/env python3
 import re
+import os
+import json
+import time
 import datetime
+import functools
 import requests
 import threading
-from typing import Set
+from typing import Any, Callable, List, Optional, Set, Tuple
 from fetch import raw2fastly, session, LOCAL
+from ghclient import GitHubClient, RateLimitExhausted
+
+# 动态抓取结果的缓存目录，被 .gitignore 中的 local* 忽略
+CACHE_DIR = os.path.join("local_cache", "dynamic")
+
+PLUGINS: List[Callable[[], Any]] = []
+_local = threading.local()
+
+
+def http_get(url: str, **kwargs: Any) -> requests.Response:
+    """GET 请求，默认使用当前插件声明的超时"""
+    kwargs.setdefault("timeout", getattr(_local, "timeout", None))
+    return session.get(url, **kwargs)
+
+
+github = GitHubClient(os.path.join("local_cache", "github"), session=session)
+
+
+def github_json(url: str) -> Any:
+    """通过共享的 GitHub 客户端请求 API，额度不足时使用缓存"""
+    return github.get_json(url, timeout=getattr(_local, "timeout", None))
+
+
+def plugin(
+    kind: str,
+    ttl: int = 3600,
+    timeout: float = 30,
+    enabled: bool = True,
+    github_calls: int = 0,
+):
+    """注册动态抓取函数
+
+    kind 为 "urls" 时返回订阅链接，为 "nodes" 时返回订阅内容或节点列表。
+    结果在磁盘上缓存 ttl 秒；抓取失败或超过 timeout 秒时，退回到过期的缓存。
+    github_calls 是每次运行发出的 GitHub API 请求数，剩余额度不够时推迟到额度恢复后，
+    期间使用过期的缓存。
+    """
+    if kind not in ("urls", "nodes"):
+        raise ValueError(f"未知的插件类型：{kind}")
+
+    def decorator(func: Callable[[], Any]) -> Callable[[], Any]:
+        @functools.wraps(func)
+        def wrapper() -> Any:
+            return _run(func, ttl, timeout, github_calls)
+
+        wrapper.kind = kind  # type: ignore
+        wrapper.ttl = ttl  # type: ignore
+        wrapper.timeout = timeout  # type: ignore
+        wrapper.enabled = enabled  # type: ignore
+        wrapper.github_calls = github_calls  # type: ignore
+        PLUGINS.append(wrapper)
+        return wrapper
+
+    return decorator
+
+
+def _load_cache(path: str) -> Optional[Tuple[float, Any]]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            cache = json.load(f)
+        return cache["time"], cache["result"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _save_cache(path: str, result: Any) -> None:
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"time": time.time(), "result": result}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def _call(func: Callable[[], Any], timeout: float) -> Any:
+    """在独立线程中运行插件，超时则抛出 TimeoutError"""
+    ret: List[Any] = [None, None]
+
+    def target() -> None:
+        _local.timeout = timeout
+        try:
+            ret[0] = func()
+        except BaseException as e:
+            ret[1] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        raise TimeoutError(f"'{func.__name__}' 超过 {timeout}s 未完成")
+    if ret[1] is not None:
+        raise ret[1]
+    return ret[0]
+
+
+def _run(
+    func: Callable[[], Any], ttl: int, timeout: float, github_calls: int = 0
+) -> Any:
+    path = os.path.join(CACHE_DIR, func.__name__ + ".json")
+    cached = _load_cache(path)
+    if cached and time.time() - cached[0] < ttl:
+        return cached[1]
+    budget = github.budget() if github_calls else None
+    if budget is not None and budget < github_calls:
+        if not cached:
+            raise RateLimitExhausted("dynamic://" + func.__name__, github.reset)
+        age = int(time.time() - cached[0])
+        print(
+            f"'{func.__name__}' 需要 {github_calls} 次 GitHub API 请求，剩余额度 {budget}，"
+            f"使用 {age}s 前的缓存",
+            flush=True,
+        )
+        return cached[1]
+    try:
+        result = _call(func, timeout)
+    except Exception as e:
+        if not cached:
+            raise
+        age = int(time.time() - cached[0])
+        print(f"'{func.__name__}' 失败（{e!r}），使用 {age}s 前的缓存", flush=True)
+        return cached[1]
+    # 集合等转为列表，使缓存前后的结果一致
+    if isinstance(result, (set, tuple)):
+        result = sorted(result)
+    if result:
+        try:
+            _save_cache(path, result)
+        except (OSError, TypeError):
+            pass
+    return result
 
 
 # def kkzui():
@@ -23,20 +156,22 @@ from fetch import raw2fastly, session, LOCAL
 #         sub = sub.split('>')[-1]
 #     return sub
 
+@plugin("nodes", ttl=6 * 3600, enabled=False, github_calls=1)
 def sharkdoor():
-    res_json = session.get(datetime.datetime.now().strftime(
-        'https://api.github.com/repos/sharkDoor/vpn-free-nodes/contents/node-list/%Y-%m?ref=master')).json()
-    res = session.get(raw2fastly(res_json[-1]['download_url']))
+    res_json = github_json(datetime.datetime.now().strftime(
+        'https://api.github.com/repos/sharkDoor/vpn-free-nodes/contents/node-list/%Y-%m?ref=master'))
+    res = http_get(raw2fastly(res_json[-1]['download_url']))
     nodes: Set[str] = set()
     for line in res.text.split('\n'):
         if '://' in line:
             nodes.add(line.split('|')[-2])
     return nodes
 
+@plugin("urls", ttl=6 * 3600, enabled=False, github_calls=1)
 def changfengoss():
     # Unused
-    res = session.get(datetime.datetime.now().strftime(
-        "https://api.github.com/repos/changfengoss/pub/contents/data/%Y_%m_%d?ref=main")).json()
+    res = github_json(datetime.datetime.now().strftime(
+        "https://api.github.com/repos/changfengoss/pub/contents/data/%Y_%m_%d?ref=main"))
     return [_['download_url'] for _ in res]
 
 # def vpn_fail():
@@ -61,9 +196,10 @@ def changfengoss():
 #     for thread in threads: thread.join()
 #     return links
 
+@plugin("urls", ttl=6 * 3600, enabled=False)
 def w1770946466():
     if LOCAL: return
-    res = session.get(raw2fastly("https://raw.githubusercontent.com/w1770946466/Auto_proxy/main/README.md")).text
+    res = http_get(raw2fastly("https://raw.githubusercontent.com/w1770946466/Auto_proxy/main/README.md")).text
     subs: Set[str] = set()
     for line in res.strip().split('\n'):
         if line.startswith("`http"):
@@ -72,11 +208,13 @@ def w1770946466():
                 subs.add(sub)
     return subs
 
+@plugin("nodes", ttl=24 * 3600)
 def peasoft():
-    return session.get("https://gist.githubusercontent.com/peasoft/8a0613b7a2be881d1b793a6bb7536281/raw/417c1d6a75a53d6c197448762e7c97852d34787f/-").text
+    # 固定版本的 Gist，内容不会变化
+    return http_get("https://gist.githubusercontent.com/peasoft/8a0613b7a2be881d1b793a6bb7536281/raw/417c1d6a75a53d6c197448762e7c97852d34787f/-").text
 
-AUTOURLS = []
-AUTOFETCH = [peasoft]
+AUTOURLS = [_ for _ in PLUGINS if _.enabled and _.kind == "urls"]
+AUTOFETCH = [_ for _ in PLUGINS if _.enabled and _.kind == "nodes"]
 
 if __name__ == '__main__':
     print("URL 抓取："+', '.join([_.__name__ for _ in AUTOURLS]))
@@ -10,21 +10,34 @@
 # pyright: reportArgumentType = none
 # pyright: reportAttributeAccessIssue = none
 # pyright: reportGeneralTypeIssues = none
+import argparse
+import cProfile
 import yaml
 import json
 import base64
-from urllib.parse import quote, unquote, urlparse
+import hashlib
+from urllib.parse import quote, unquote, urlsplit
 import requests
 from requests_file import FileAdapter
 import datetime
 import traceback
 import binascii
 import threading
+import time
 import sys
 import os
-import copy
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from types import FunctionType as function
-from typing import Set, List, Dict, Tuple, Union, Callable, Any, Optional, no_type_check
+from filter import FilterEngine, filtered_file, rules_file
+from probe import Prober
+from geoip import RegionIndex, MMDB_SUPPORTED, DATA_ERRORS, check_mmdb, check_table
+from resolve import Resolver, RESOLVE_CONCURRENCY, RESOLVE_DEADLINE
+import delta
+import snapshot
+from snapshot import snapshot_file
+from precompress import precompress, summary as precompress_summary
+from typing import Set, List, Dict, Tuple, Union, Callable, Any, Optional, Iterator, Iterable, TextIO, no_type_check
 
 try:
     PROXY = open("local_proxy.conf").read().strip()
@@ -45,24 +58,82 @@ def b64encodes_safe(s: str):
     return base64.urlsafe_b64encode(s.encode("utf-8")).decode("utf-8")
 
 
-def b64decodes(s: str):
-    ss = s + "=" * ((4 - len(s) % 4) % 4)
-    try:
-        return base64.b64decode(ss.encode("utf-8")).decode("utf-8")
-    except UnicodeDecodeError:
-        raise
-    except binascii.Error:
-        raise
+class Base64Writer:
+    """把写入的文本以 Base64 编码写到 `f`，结果与一次性编码整个文本相同"""
 
+    def __init__(self, f: TextIO) -> None:
+        self.f = f
+        self.rest = b""
 
-def b64decodes_safe(s: str):
-    ss = s + "=" * ((4 - len(s) % 4) % 4)
-    try:
-        return base64.urlsafe_b64decode(ss.encode("utf-8")).decode("utf-8")
-    except UnicodeDecodeError:
-        raise
-    except binascii.Error:
-        raise
+    def write(self, s: str) -> None:
+        data = self.rest + s.encode("utf-8")
+        cut = len(data) - len(data) % 3
+        self.rest = data[cut:]
+        self.f.write(base64.b64encode(data[:cut]).decode("utf-8"))
+
+    def close(self) -> None:
+        self.f.write(base64.b64encode(self.rest).decode("utf-8"))
+        self.rest = b""
+
+
+class StrTagFilter:
+    """去掉写入内容中的 '!!str ' 标记，供 yaml.dump 直接写文件使用
+
+    标记可能被拆在两次写入之间，因此保留可能是标记开头的结尾部分，留到下次处理。
+    """
+
+    TAG = "!!str "
+
+    def __init__(self, f: TextIO) -> None:
+        self.f = f
+        self.tail = ""
+
+    def write(self, s: str) -> None:
+        data = self.tail + s
+        keep = 0
+        for n in range(min(len(self.TAG) - 1, len(data)), 0, -1):
+            if self.TAG.startswith(data[-n:]):
+                keep = n
+                break
+        self.tail = data[len(data) - keep :]
+        self.f.write(data[: len(data) - keep].replace(self.TAG, ""))
+
+    def flush(self) -> None:
+        self.f.write(self.tail)
+        self.tail = ""
+
+
+URLSAFE_TO_STD = bytes.maketrans(b"-_", b"+/")
+
+
+def b64decodeb(s: Union[str, bytes, bytearray], urlsafe: bool = False) -> bytes:
+    """解码 Base64，自动补齐填充，忽略非 Base64 字符"""
+    if isinstance(s, str):
+        s = s.encode("utf-8")
+    if urlsafe:
+        s = s.translate(URLSAFE_TO_STD)
+    pad = -len(s) % 4
+    if pad:
+        s = b"".join((s, b"=" * pad))
+    return binascii.a2b_base64(s)
+
+
+def strip_view(b: Union[bytes, bytearray]) -> memoryview:
+    """去掉首尾空白，返回原缓冲区的视图而不复制"""
+    start, end = 0, len(b)
+    while start < end and b[start] in b" \t\r\n":
+        start += 1
+    while end > start and b[end - 1] in b" \t\r\n":
+        end -= 1
+    return memoryview(b)[start:end]
+
+
+def b64decodes(s: Union[str, bytes, bytearray]) -> str:
+    return b64decodeb(s).decode("utf-8")
+
+
+def b64decodes_safe(s: Union[str, bytes, bytearray]) -> str:
+    return b64decodeb(s, urlsafe=True).decode("utf-8")
 
 
 DEFAULT_UUID = "8" * 8 + "-8888" * 3 + "-" + "8" * 12
@@ -132,6 +203,20 @@ FAKE_IPS = (
 FAKE_DOMAINS = ".google.com .github.com".split()
 
 FETCH_TIMEOUT = (6, 5)
+# 下载订阅时每次读取的字节数
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# 节点数达到此值时用多进程批量生成链接
+SERIALIZE_PARALLEL_THRESHOLD = 20000
+# 机场列表的最大嵌套层数，以及同时下载的列表数
+AIRPORT_MAX_DEPTH = 2
+AIRPORT_CONCURRENCY = 8
+# 合并服务器解析到同一 IP、且端口、协议、凭据都相同的节点
+DEDUP_RESOLVED = False
+# 域名解析结果的磁盘缓存，被 .gitignore 中的 local* 忽略
+RESOLVE_CACHE = os.path.join("local_cache", "dns.json")
+# geoip 的地区表或 mmdb 为 URL 时，下载到此目录，有效期内不重新下载
+GEOIP_CACHE = os.path.join("local_cache", "geoip")
+GEOIP_CACHE_TTL = 7 * 24 * 3600
 
 BANNED_WORDS = b64decodes(
     "5rOV6L2uIOi9ruWtkCDova4g57uDIOawlCDlip8gb25ndGFpd2Fu"
@@ -140,8 +225,26 @@ BANNED_WORDS = b64decodes(
 # !!! JUST FOR DEBUGING !!!
 DEBUG_NO_NODES = os.path.exists("local_NO_NODES")
 DEBUG_NO_DYNAMIC = os.path.exists("local_NO_DYNAMIC")
+DEBUG_NO_PROBE = os.path.exists("local_NO_PROBE")
 # DEBUG_NO_ADBLOCK = os.path.exists("local_NO_ADBLOCK")
 DEBUG_NO_ADBLOCK = True
+# 低内存模式：订阅解析后即丢弃原始内容，输出时不缓存节点链接
+LOW_MEMORY = os.path.exists("local_LOW_MEMORY")
+# 用 tracemalloc 记录各阶段的内存，结果写入 STAGE_REPORT_FILE
+MEMORY_REPORT = os.path.exists("local_MEMORY_REPORT")
+STAGE_REPORT_FILE = "local_stage_report.json"
+# 按阶段保存主线程 cProfile 结果的目录、Chrome trace 格式的时间线文件，由命令行设置
+PROFILE_DIR: Optional[str] = None
+TRACE_FILE: Optional[str] = None
+# 可选的阶段；不含 fetch 时从快照载入节点，不含 emit 时只抓取和处理节点，不写出任何文件
+STAGES = ("fetch", "merge", "adblock", "emit")
+# 输出文件所在的目录；config.yml、sources.list 等输入文件仍从当前目录读取
+OUTPUT_DIR = "."
+# 传给 Prober 的参数，未指定的沿用 probe.py 中的默认值
+PROBE_OPTIONS: Dict[str, Any] = {}
+# 为发布的文件写出 .gz / .zst 副本，清单记录各文件的摘要、压缩率和耗时
+PRECOMPRESS = True
+PRECOMPRESS_MANIFEST = "list.precompress.json"
 STOP = False
 STOP_FAKE_NODES = """vmess://ew0KICAidiI6ICIyIiwNCiAgInBzIjogIlx1RDgzQ1x1RERFOFx1RDgzQ1x1RERGMyBcdTcwRURcdTcwQzhcdTVFODZcdTc5NURcdTRFMkRcdTUzNEVcdTRFQkFcdTZDMTFcdTUxNzFcdTU0OENcdTU2RkRcdTYyMTBcdTdBQ0IgNzUgXHU1NDY4XHU1RTc0IiwNCiAgImFkZCI6ICJ3ZWIuNTEubGEiLA0KICAicG9ydCI6ICI0NDMiLA0KICAiaWQiOiAiODg4ODg4ODgtODg4OC04ODg4LTg4ODgtODg4ODg4ODg4ODg4IiwNCiAgImFpZCI6ICIwIiwNCiAgInNjeSI6ICJhdXRvIiwNCiAgIm5ldCI6ICJ0Y3AiLA0KICAidHlwZSI6ICJodHRwIiwNCiAgImhvc3QiOiAid2ViLjUxLmxhIiwNCiAgInBhdGgiOiAiL2ltYWdlcy9pbmRleC9zZXJ2aWNlLXBpYy5wbmciLA0KICAidGxzIjogInRscyIsDQogICJzbmkiOiAid2ViLjUxLmxhIiwNCiAgImFscG4iOiAiaHR0cC8xLjEiLA0KICAiZnAiOiAiY2hyb21lIg0KfQ==
 vmess://ew0KICAidiI6ICIyIiwNCiAgInBzIjogIlx1NUU4Nlx1Nzk1RFx1NTZGRFx1NUU4Nlx1RkYwQ1x1NjZGNFx1NjVCMFx1NjY4Mlx1NTA1QyIsDQogICJhZGQiOiAid2ViLjUxLmxhIiwNCiAgInBvcnQiOiAiNDQzIiwNCiAgImlkIjogImM2ZTg0MDcyLTJlNjktNDkyOC05MGFmLTQzNmIzZmNkMDY2MyIsDQogICJhaWQiOiAiMCIsDQogICJzY3kiOiAiYXV0byIsDQogICJuZXQiOiAidGNwIiwNCiAgInR5cGUiOiAiaHR0cCIsDQogICJob3N0IjogIndlYi41MS5sYSIsDQogICJwYXRoIjogIi9pbWFnZXMvaW5kZXgvc2VydmljZS1waWMucG5nIiwNCiAgInRscyI6ICJ0bHMiLA0KICAic25pIjogIndlYi41MS5sYSIsDQogICJhbHBuIjogImh0dHAvMS4xIiwNCiAgImZwIjogImNocm9tZSINCn0=
@@ -173,13 +276,503 @@ if STOP or (d.month, d.day) in ((6, 4), (7, 1), (10, 1)):
     DEBUG_NO_NODES = DEBUG_NO_DYNAMIC = STOP = True
 
 
+QueryHandler = Callable[[Dict[str, Any], str], None]
+UrlParser = Callable[[str], Dict[str, Any]]
+URL_PARSERS: Dict[str, UrlParser] = {}
+
+VMESS_DEFAULTS: Dict[str, Any] = {
+    VMESS2CLASH[key]: val for key, val in VMESS_EXAMPLE.items() if key in VMESS2CLASH
+}
+
+
+def url_parser(*schemes: str) -> Callable[[UrlParser], UrlParser]:
+    """注册解析 `scheme://` 之后部分的函数，返回 Clash 格式的节点数据"""
+
+    def decorator(func: UrlParser) -> UrlParser:
+        for scheme in schemes:
+            URL_PARSERS[scheme] = func
+        return func
+
+    return decorator
+
+
+def split_url(dt: str) -> Tuple[Optional[str], Optional[str], str, str, str]:
+    """把 `scheme://` 之后的部分拆为 (用户名, 主机, 端口, 查询, 名称)
+
+    与 urlparse 的 username、hostname、port、query、fragment 一致，名称已解码。
+    """
+    rest, _, fragment = dt.partition("#")
+    end = len(rest)
+    for ch in "/?":
+        i = rest.find(ch, 0, end)
+        if i >= 0:
+            end = i
+    query = rest[end:].partition("?")[2]
+    userinfo, at, hostinfo = rest[:end].rpartition("@")
+    username = userinfo.partition(":")[0] if at else None
+    if "[" in hostinfo:
+        host, _, port = hostinfo.partition("[")[2].partition("]")
+        port = port.partition(":")[2]
+    else:
+        host, _, port = hostinfo.partition(":")
+    return username, host.lower() or None, port, query, unquote(fragment)
+
+
+def parse_port(port: str) -> Optional[int]:
+    if not port:
+        return None
+    if not (port.isdigit() and port.isascii()) or int(port) > 65535:
+        raise ValueError(f"端口无效：{port!r}")
+    return int(port)
+
+
+def parse_query(
+    data: Dict[str, Any], query: str, table: Dict[str, QueryHandler]
+) -> None:
+    """单遍解析查询字符串，按 `table` 把各参数写入节点数据，未知参数忽略"""
+    if not query:
+        return
+    for kv in query.split("&"):
+        k, _, v = kv.partition("=")
+        handler = table.get(k)
+        if handler is not None:
+            handler(data, v)
+
+
+def _set(key: str) -> QueryHandler:
+    def handler(data: Dict[str, Any], v: str) -> None:
+        data[key] = v
+
+    return handler
+
+
+def _set_opt(opts: str, key: str) -> QueryHandler:
+    def handler(data: Dict[str, Any], v: str) -> None:
+        data.setdefault(opts, {})[key] = v
+
+    return handler
+
+
+def _set_b64(key: str) -> QueryHandler:
+    def handler(data: Dict[str, Any], v: str) -> None:
+        try:
+            data[key] = b64decodes_safe(v)
+        except (binascii.Error, UnicodeDecodeError):
+            data[key] = v
+
+    return handler
+
+
+def _set_insecure(data: Dict[str, Any], v: str) -> None:
+    data["skip-cert-verify"] = v != "0"
+
+
+def _set_alpn(data: Dict[str, Any], v: str) -> None:
+    data["alpn"] = unquote(v).split(",")
+
+
+def _set_ws_host(data: Dict[str, Any], v: str) -> None:
+    data.setdefault("ws-opts", {}).setdefault("headers", {})["Host"] = v
+
+
+def _set_flow(data: Dict[str, Any], v: str) -> None:
+    data["flow"] = v if v.endswith("-udp443") else v + "!"
+
+
+def _set_security(data: Dict[str, Any], v: str) -> None:
+    if v == "tls":
+        data["tls"] = True
+
+
+TRANSPORT_QUERY: Dict[str, QueryHandler] = {
+    "allowInsecure": _set_insecure,
+    "insecure": _set_insecure,
+    "alpn": _set_alpn,
+    "type": _set("network"),
+    "serviceName": _set_opt("grpc-opts", "grpc-service-name"),
+    "host": _set_ws_host,
+    "path": _set_opt("ws-opts", "path"),
+}
+TROJAN_QUERY: Dict[str, QueryHandler] = {**TRANSPORT_QUERY, "sni": _set("sni")}
+VLESS_QUERY: Dict[str, QueryHandler] = {
+    **TRANSPORT_QUERY,
+    "sni": _set("servername"),
+    "flow": _set_flow,
+    "fp": _set("client-fingerprint"),
+    "security": _set_security,
+    "pbk": _set_opt("reality-opts", "public-key"),
+    "sid": _set_opt("reality-opts", "short-id"),
+    # TODO: Unused key encryption
+}
+HYSTERIA2_QUERY: Dict[str, QueryHandler] = {
+    "insecure": _set_insecure,
+    "alpn": _set_alpn,
+    "sni": _set("sni"),
+    "obfs": _set("obfs"),
+    "obfs-password": _set("obfs-password"),
+    "fp": _set("fingerprint"),
+}
+SSR_QUERY: Dict[str, QueryHandler] = {
+    "remarks": _set_b64("name"),
+    "group": _set_b64("group"),
+    "obfsparam": _set_b64("obfs-param"),
+    "protoparam": _set_b64("protocol-param"),
+}
+
+
+@url_parser("vmess")
+def parse_vmess(dt: str) -> Dict[str, Any]:
+    try:
+        v = json.loads(b64decodes(dt))
+        if not isinstance(v, dict):
+            raise ValueError
+    except Exception:
+        raise UnsupportedType("vmess", "SP")
+    data = VMESS_DEFAULTS.copy()
+    for key, clash_key in VMESS2CLASH.items():
+        if key in v:
+            data[clash_key] = v[key]
+    data["tls"] = v.get("tls") == "tls"
+    data["alterId"] = int(data["alterId"] or 0)
+    net = v.get("net")
+    if net == "ws":
+        opts = {}
+        if "path" in v:
+            opts["path"] = v["path"]
+        if "host" in v:
+            opts["headers"] = {"Host": v["host"]}
+        data["ws-opts"] = opts
+    elif net == "h2":
+        opts = {}
+        if "path" in v:
+            opts["path"] = v["path"]
+        if "host" in v:
+            opts["host"] = v["host"].split(",")
+        data["h2-opts"] = opts
+    elif net == "grpc" and "path" in v:
+        data["grpc-opts"] = {"grpc-service-name": v["path"]}
+    return data
+
+
+@url_parser("ss")
+def parse_ss(dt: str) -> Dict[str, Any]:
+    body, _, name = dt.partition("#")
+    if "@" not in body:
+        # 旧格式：整个 `method:password@server:port` 都经过 base64 编码
+        body = b64decodes_safe(body)
+    info, _, srv = body.rpartition("@")
+    server, _, port = srv.rpartition(":")
+    try:
+        port = int(port)
+    except ValueError:
+        raise UnsupportedType("ss", "SP")
+    info = unquote(info)
+    if not ":" in info:
+        info = b64decodes_safe(info)
+    cipher, _, passwd = info.partition(":")
+    return {
+        "name": unquote(name),
+        "server": server.strip("[]"),
+        "port": port,
+        "type": "ss",
+        "password": passwd,
+        "cipher": cipher,
+    }
+
+
+@url_parser("ssr")
+def parse_ssr(dt: str) -> Dict[str, Any]:
+    if "?" in dt:
+        parts = dt.split(":")
+    else:
+        parts = b64decodes_safe(dt).split(":")
+    passwd, info = parts[-1].split("/?")
+    data = {
+        "type": "ssr",
+        "server": parts[0],
+        "port": parts[1],
+        "protocol": parts[2],
+        "cipher": parts[3],
+        "obfs": parts[4],
+        "password": b64decodes_safe(passwd),
+        "name": "",
+    }
+    parse_query(data, info, SSR_QUERY)
+    return data
+
+
+@url_parser("trojan")
+def parse_trojan(dt: str) -> Dict[str, Any]:
+    username, server, port, query, name = split_url(dt)
+    data = {
+        "name": name,
+        "server": server,
+        "port": parse_port(port),
+        "type": "trojan",
+        "password": unquote(username),
+    }
+    parse_query(data, query, TROJAN_QUERY)
+    return data
+
+
+@url_parser("vless")
+def parse_vless(dt: str) -> Dict[str, Any]:
+    username, server, port, query, name = split_url(dt)
+    data = {
+        "name": name,
+        "server": server,
+        "port": parse_port(port),
+        "type": "vless",
+        "uuid": unquote(username),
+        "tls": False,
+    }
+    parse_query(data, query, VLESS_QUERY)
+    return data
+
+
+@url_parser("hysteria2")
+def parse_hysteria2(dt: str) -> Dict[str, Any]:
+    username, server, port, query, name = split_url(dt)
+    data: Dict[str, Any] = {
+        "name": name,
+        "server": server,
+        "type": "hysteria2",
+        "password": unquote(username),
+    }
+    if "," in port:
+        port, data["ports"] = port.split(",", 1)
+    try:
+        data["port"] = int(port)
+    except ValueError:
+        data["port"] = 443
+    data["tls"] = False
+    parse_query(data, query, HYSTERIA2_QUERY)
+    return data
+
+
+def node_url(node_type: str, data: Dict[str, Any]) -> str:
+    """生成节点的分享链接"""
+    if node_type == "vmess":
+        v = VMESS_EXAMPLE.copy()
+        for key, val in data.items():
+            if key in CLASH2VMESS:
+                v[CLASH2VMESS[key]] = val
+        if v["net"] == "ws":
+            if "ws-opts" in data:
+                try:
+                    v["host"] = data["ws-opts"]["headers"]["Host"]
+                except KeyError:
+                    pass
+                if "path" in data["ws-opts"]:
+                    v["path"] = data["ws-opts"]["path"]
+        elif v["net"] == "h2":
+            if "h2-opts" in data:
+                if "host" in data["h2-opts"]:
+                    v["host"] = ",".join(data["h2-opts"]["host"])
+                if "path" in data["h2-opts"]:
+                    v["path"] = data["h2-opts"]["path"]
+        elif v["net"] == "grpc":
+            if "grpc-opts" in data:
+                if "grpc-service-name" in data["grpc-opts"]:
+                    v["path"] = data["grpc-opts"]["grpc-service-name"]
+        if ("tls" in data) and data["tls"]:
+            v["tls"] = "tls"
+        return "vmess://" + b64encodes(json.dumps(v, ensure_ascii=False))
+
+    if node_type == "ss":
+        passwd = b64encodes_safe(data["cipher"] + ":" + data["password"])
+        return (
+            f"ss://{passwd}@{data['server']}:{data['port']}#{quote(data['name'])}"
+        )
+    if node_type == "ssr":
+        ret = (
+            ":".join(
+                [
+                    str(data[_])
+                    for _ in ("server", "port", "protocol", "cipher", "obfs")
+                ]
+            )
+            + b64encodes_safe(data["password"])
+            + f"remarks={b64encodes_safe(data['name'])}"
+        )
+        for k, urlk in (
+            ("obfs-param", "obfsparam"),
+            ("protocol-param", "protoparam"),
+            ("group", "group"),
+        ):
+            if k in data:
+                ret += "&" + urlk + "=" + b64encodes_safe(data[k])
+        return "ssr://" + ret
+
+    if node_type == "trojan":
+        passwd = quote(data["password"])
+        name = quote(data["name"])
+        ret = f"trojan://{passwd}@{data['server']}:{data['port']}?"
+        if "skip-cert-verify" in data:
+            ret += f"allowInsecure={int(data['skip-cert-verify'])}&"
+        if "sni" in data:
+            ret += f"sni={data['sni']}&"
+        if "alpn" in data:
+            ret += f"alpn={quote(','.join(data['alpn']))}&"
+        if "network" in data:
+            if data["network"] == "grpc":
+                ret += f"type=grpc&serviceName={data['grpc-opts']['grpc-service-name']}"
+            elif data["network"] == "ws":
+                ret += f"type=ws&"
+                if "ws-opts" in data:
+                    try:
+                        ret += f"host={data['ws-opts']['headers']['Host']}&"
+                    except KeyError:
+                        pass
+                    if "path" in data["ws-opts"]:
+                        ret += f"path={data['ws-opts']['path']}"
+        ret = ret.rstrip("&") + "#" + name
+        return ret
+
+    if node_type == "vless":
+        passwd = quote(data["uuid"])
+        name = quote(data["name"])
+        ret = f"vless://{passwd}@{data['server']}:{data['port']}?"
+        if "skip-cert-verify" in data:
+            ret += f"allowInsecure={int(data['skip-cert-verify'])}&"
+        if "servername" in data:
+            ret += f"sni={data['servername']}&"
+        if "alpn" in data:
+            ret += f"alpn={quote(','.join(data['alpn']))}&"
+        if "network" in data:
+            if data["network"] == "grpc":
+                ret += f"type=grpc&serviceName={data['grpc-opts']['grpc-service-name']}"
+            elif data["network"] == "ws":
+                ret += f"type=ws&"
+                if "ws-opts" in data:
+                    try:
+                        ret += f"host={data['ws-opts']['headers']['Host']}&"
+                    except KeyError:
+                        pass
+                    if "path" in data["ws-opts"]:
+                        ret += f"path={data['ws-opts']['path']}"
+        if "flow" in data:
+            flow: str = data["flow"]
+            if flow.endswith("!"):
+                ret += f"flow={flow[:-1]}&"
+            else:
+                ret += f"flow={flow}-udp443&"
+        if "client-fingerprint" in data:
+            ret += f"fp={data['client-fingerprint']}&"
+        if "tls" in data and data["tls"]:
+            ret += f"security=tls&"
+        elif "reality-opts" in data:
+            opts: Dict[str, str] = data["reality-opts"]
+            ret += f"security=reality&pbk={opts.get('public-key','')}&sid={opts.get('short-id','')}&"
+        ret = ret.rstrip("&") + "#" + name
+        return ret
+
+    if node_type == "hysteria2":
+        passwd = quote(data["password"])
+        name = quote(data["name"])
+        ret = f"hysteria2://{passwd}@{data['server']}:{data['port']}"
+        if "ports" in data:
+            ret += "," + data["ports"]
+        ret += "?"
+        if "skip-cert-verify" in data:
+            ret += f"insecure={int(data['skip-cert-verify'])}&"
+        if "alpn" in data:
+            ret += f"alpn={quote(','.join(data['alpn']))}&"
+        if "fingerprint" in data:
+            ret += f"fp={data['fingerprint']}&"
+        for k in ("sni", "obfs", "obfs-password"):
+            if k in data:
+                ret += f"{k}={data[k]}&"
+        ret = ret.rstrip("&") + "#" + name
+        return ret
+
+    raise UnsupportedType(node_type)
+
+
+def node_clash_data(node_type: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    """生成 Clash 格式的节点数据"""
+    ret = dict(data)
+    if "password" in ret and ret["password"].isdigit():
+        ret["password"] = "!!str " + ret["password"]
+    if "uuid" in ret and len(ret["uuid"]) != len(DEFAULT_UUID):
+        ret["uuid"] = DEFAULT_UUID
+    if "group" in ret:
+        del ret["group"]
+    if "cipher" in ret and not ret["cipher"]:
+        ret["cipher"] = "auto"
+    if node_type == "vless" and "flow" in ret:
+        if ret["flow"].endswith("-udp443"):
+            ret["flow"] = ret["flow"][:-7]
+        elif ret["flow"].endswith("!"):
+            ret["flow"] = ret["flow"][:-1]
+    if "alpn" in ret and isinstance(ret["alpn"], str):
+        # 'alpn' is not a slice
+        ret["alpn"] = ret["alpn"].replace(" ", "").split(",")
+    return ret
+
+
+def _try_node_url(item: Tuple[str, Dict[str, Any]]) -> Optional[str]:
+    try:
+        return node_url(*item)
+    except UnsupportedType:
+        return None
+
+
+class NodeData(dict):
+    """节点数据，顶层字段改变时递增 `version`，用于使 Node 的序列化缓存失效
+
+    嵌套字典（如 `ws-opts`）中的修改不会被记录，需要时请重新赋值整个字段。
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.version = 0
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key in self:
+            old = super().__getitem__(key)
+            changed = old is not value and (type(old) is not type(value) or old != value)
+        else:
+            changed = True
+        super().__setitem__(key, value)
+        if changed:
+            self.version += 1
+
+    def __delitem__(self, key: str) -> None:
+        super().__delitem__(key)
+        self.version += 1
+
+    def update(self, *args: Any, **kwargs: Any) -> None:
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def setdefault(self, key: str, default: Any = None) -> Any:
+        if key not in self:
+            self[key] = default
+        return super().__getitem__(key)
+
+    def pop(self, *args: Any) -> Any:
+        self.version += 1
+        return super().pop(*args)
+
+    def popitem(self) -> Tuple[str, Any]:
+        self.version += 1
+        return super().popitem()
+
+    def clear(self) -> None:
+        self.version += 1
+        super().clear()
+
+
 class Node:
     names: Set[str] = set()
     DATA_TYPE = Dict[str, Any]
 
     def __init__(self, data: Union[DATA_TYPE, str]) -> None:
+        self._url: Optional[Tuple[int, str]] = None
+        self._clash: Optional[Tuple[int, Node.DATA_TYPE]] = None
         if isinstance(data, dict):
-            self.data: __class__.DATA_TYPE = data
+            self.data = data
             self.type = data["type"]
         elif isinstance(data, str):
             self.load_url(data)
@@ -191,17 +784,36 @@ class Node:
             self.data["password"] = str(self.data["password"])
         self.data["type"] = self.type
         self.name: str = self.data["name"]
+        # 由 probe_merged() 填写：None 表示未探测
+        self.alive: Optional[bool] = None
+        self.latency: Optional[float] = None
+
+    @property
+    def data(self) -> NodeData:
+        return self._data
+
+    @data.setter
+    def data(self, data: DATA_TYPE) -> None:
+        self._data = data if isinstance(data, NodeData) else NodeData(data)
+        self._url = self._clash = None
 
     def __str__(self):
         return self.url
 
-    def __hash__(self):
+    def hash_key(self, server: Optional[str] = None) -> str:
+        """用于去重的节点标识：类型、服务器、端口、传输路径和凭据，不含节点名
+
+        指定 `server` 时用它代替节点的服务器，如解析出的 IP。
+        """
         data = self.data
         try:
             path = ""
             if self.type == "vmess":
                 net: str = data.get("network", "")
                 path = net + ":"
+                # 只在设置了 SNI 时加入，其他节点的标识保持不变
+                if data.get("servername"):
+                    path = data["servername"] + ":" + path
                 if not net:
                     pass
                 elif net == "ws":
@@ -232,7 +844,8 @@ class Node:
                 elif net == "grpc":
                     path += data.get("grpc-opts", {}).get("grpc-service-name", "")
             elif self.type == "vless":
-                path = data.get("sni", "") + ":"
+                # 链接中的 sni 参数保存为 servername
+                path = (data.get("servername") or data.get("sni", "")) + ":"
                 net: str = data.get("network", "")
                 if not net:
                     pass
@@ -254,12 +867,21 @@ class Node:
                 + data.get("password", "")
                 + data.get("uuid", "")
             )
-            hashstr = f"{self.type}:{data['server']}:{data['port']}:{path}"
-            return hash(hashstr)
+            if server is None:
+                server = data["server"]
+            return f"{self.type}:{server}:{data['port']}:{path}"
         except Exception:
             print("节点 Hash 计算失败！", file=sys.stderr)
             traceback.print_exc(file=sys.stderr)
-            return hash("__ERROR__")
+            return "__ERROR__"
+
+    def __hash__(self):
+        return hash(self.hash_key())
+
+    @property
+    def fingerprint(self) -> str:
+        """跨运行稳定的节点指纹（`hash()` 受 PYTHONHASHSEED 影响）"""
+        return delta.fingerprint(self.hash_key())
 
     def __eq__(self, other: Union["Node", Any]):
         if isinstance(other, self.__class__):
@@ -275,229 +897,13 @@ class Node:
         # === Fix begin ===
         if not self.type.isascii():
             self.type = "".join([_ for _ in self.type if _.isascii()])
-            url = self.type + "://" + url.split("://")[1]
         if self.type == "hy2":
             self.type = "hysteria2"
         # === Fix end ===
-        if self.type == "vmess":
-            v = VMESS_EXAMPLE.copy()
-            try:
-                v.update(json.loads(b64decodes(dt)))
-            except Exception:
-                raise UnsupportedType("vmess", "SP")
-            self.data = {}
-            for key, val in v.items():
-                if key in VMESS2CLASH:
-                    self.data[VMESS2CLASH[key]] = val
-            self.data["tls"] = v["tls"] == "tls"
-            self.data["alterId"] = int(self.data["alterId"])
-            if v["net"] == "ws":
-                opts = {}
-                if "path" in v:
-                    opts["path"] = v["path"]
-                if "host" in v:
-                    opts["headers"] = {"Host": v["host"]}
-                self.data["ws-opts"] = opts
-            elif v["net"] == "h2":
-                opts = {}
-                if "path" in v:
-                    opts["path"] = v["path"]
-                if "host" in v:
-                    opts["host"] = v["host"].split(",")
-                self.data["h2-opts"] = opts
-            elif v["net"] == "grpc" and "path" in v:
-                self.data["grpc-opts"] = {"grpc-service-name": v["path"]}
-
-        elif self.type == "ss":
-            info = url.split("@")
-            srvname = info.pop()
-            if "#" in srvname:
-                srv, name = srvname.split("#")
-            else:
-                srv = srvname
-                name = ""
-            server, port = srv.split(":")
-            try:
-                port = int(port)
-            except ValueError:
-                raise UnsupportedType("ss", "SP")
-            info = "@".join(info)
-            if not ":" in info:
-                info = b64decodes_safe(info)
-            if ":" in info:
-                cipher, passwd = info.split(":")
-            else:
-                cipher = info
-                passwd = ""
-            self.data = {
-                "name": unquote(name),
-                "server": server,
-                "port": port,
-                "type": "ss",
-                "password": passwd,
-                "cipher": cipher,
-            }
-
-        elif self.type == "ssr":
-            if "?" in url:
-                parts = dt.split(":")
-            else:
-                parts = b64decodes_safe(dt).split(":")
-            try:
-                passwd, info = parts[-1].split("/?")
-            except:
-                raise
-            passwd = b64decodes_safe(passwd)
-            self.data = {
-                "type": "ssr",
-                "server": parts[0],
-                "port": parts[1],
-                "protocol": parts[2],
-                "cipher": parts[3],
-                "obfs": parts[4],
-                "password": passwd,
-                "name": "",
-            }
-            for kv in info.split("&"):
-                k_v = kv.split("=")
-                if len(k_v) != 2:
-                    k = k_v[0]
-                    v = ""
-                else:
-                    k, v = k_v
-                if k == "remarks":
-                    self.data["name"] = v
-                elif k == "group":
-                    self.data["group"] = v
-                elif k == "obfsparam":
-                    self.data["obfs-param"] = v
-                elif k == "protoparam":
-                    self.data["protocol-param"] = v
-
-        elif self.type == "trojan":
-            parsed = urlparse(url)
-            self.data = {
-                "name": unquote(parsed.fragment),
-                "server": parsed.hostname,
-                "port": parsed.port,
-                "type": "trojan",
-                "password": unquote(parsed.username),
-            }  # type: ignore
-            if parsed.query:
-                for kv in parsed.query.split("&"):
-                    k, v = kv.split("=")
-                    if k in ("allowInsecure", "insecure"):
-                        self.data["skip-cert-verify"] = v != "0"
-                    elif k == "sni":
-                        self.data["sni"] = v
-                    elif k == "alpn":
-                        self.data["alpn"] = unquote(v).split(",")
-                    elif k == "type":
-                        self.data["network"] = v
-                    elif k == "serviceName":
-                        if "grpc-opts" not in self.data:
-                            self.data["grpc-opts"] = {}
-                        self.data["grpc-opts"]["grpc-service-name"] = v
-                    elif k == "host":
-                        if "ws-opts" not in self.data:
-                            self.data["ws-opts"] = {}
-                        if "headers" not in self.data["ws-opts"]:
-                            self.data["ws-opts"]["headers"] = {}
-                        self.data["ws-opts"]["headers"]["Host"] = v
-                    elif k == "path":
-                        if "ws-opts" not in self.data:
-                            self.data["ws-opts"] = {}
-                        self.data["ws-opts"]["path"] = v
-
-        elif self.type == "vless":
-            parsed = urlparse(url)
-            self.data = {
-                "name": unquote(parsed.fragment),
-                "server": parsed.hostname,
-                "port": parsed.port,
-                "type": "vless",
-                "uuid": unquote(parsed.username),
-            }  # type: ignore
-            self.data["tls"] = False
-            if parsed.query:
-                for kv in parsed.query.split("&"):
-                    k, v = kv.split("=")
-                    if k in ("allowInsecure", "insecure"):
-                        self.data["skip-cert-verify"] = v != "0"
-                    elif k == "sni":
-                        self.data["servername"] = v
-                    elif k == "alpn":
-                        self.data["alpn"] = unquote(v).split(",")
-                    elif k == "type":
-                        self.data["network"] = v
-                    elif k == "serviceName":
-                        if "grpc-opts" not in self.data:
-                            self.data["grpc-opts"] = {}
-                        self.data["grpc-opts"]["grpc-service-name"] = v
-                    elif k == "host":
-                        if "ws-opts" not in self.data:
-                            self.data["ws-opts"] = {}
-                        if "headers" not in self.data["ws-opts"]:
-                            self.data["ws-opts"]["headers"] = {}
-                        self.data["ws-opts"]["headers"]["Host"] = v
-                    elif k == "path":
-                        if "ws-opts" not in self.data:
-                            self.data["ws-opts"] = {}
-                        self.data["ws-opts"]["path"] = v
-                    elif k == "flow":
-                        if v.endswith("-udp443"):
-                            self.data["flow"] = v
-                        else:
-                            self.data["flow"] = v + "!"
-                    elif k == "fp":
-                        self.data["client-fingerprint"] = v
-                    elif k == "security" and v == "tls":
-                        self.data["tls"] = True
-                    elif k == "pbk":
-                        if "reality-opts" not in self.data:
-                            self.data["reality-opts"] = {}
-                        self.data["reality-opts"]["public-key"] = v
-                    elif k == "sid":
-                        if "reality-opts" not in self.data:
-                            self.data["reality-opts"] = {}
-                        self.data["reality-opts"]["short-id"] = v
-                    # TODO: Unused key encryption
-
-        elif self.type == "hysteria2":
-            parsed = urlparse(url)
-            self.data = {
-                "name": unquote(parsed.fragment),
-                "server": parsed.hostname,
-                "type": "hysteria2",
-                "password": unquote(parsed.username),
-            }  # type: ignore
-            if ":" in parsed.netloc:
-                ports = parsed.netloc.split(":")[1]
-                if "," in ports:
-                    self.data["port"], self.data["ports"] = ports.split(",", 1)
-                else:
-                    self.data["port"] = ports
-                try:
-                    self.data["port"] = int(self.data["port"])
-                except ValueError:
-                    self.data["port"] = 443
-            else:
-                self.data["port"] = 443
-            self.data["tls"] = False
-            if parsed.query:
-                for kv in parsed.query.split("&"):
-                    k, v = kv.split("=")
-                    if k == "insecure":
-                        self.data["skip-cert-verify"] = v != "0"
-                    elif k == "alpn":
-                        self.data["alpn"] = unquote(v).split(",")
-                    elif k in ("sni", "obfs", "obfs-password"):
-                        self.data[k] = v
-                    elif k == "fp":
-                        self.data["fingerprint"] = v
-
-        else:
+        parser = URL_PARSERS.get(self.type)
+        if parser is None:
             raise UnsupportedType(self.type)
+        self.data = parser(dt)
 
     def format_name(self, max_len=30) -> None:
         self.data["name"] = self.name
@@ -539,163 +945,40 @@ class Node:
 
     @property
     def url(self) -> str:
-        data = self.data
-        if self.type == "vmess":
-            v = VMESS_EXAMPLE.copy()
-            for key, val in data.items():
-                if key in CLASH2VMESS:
-                    v[CLASH2VMESS[key]] = val
-            if v["net"] == "ws":
-                if "ws-opts" in data:
-                    try:
-                        v["host"] = data["ws-opts"]["headers"]["Host"]
-                    except KeyError:
-                        pass
-                    if "path" in data["ws-opts"]:
-                        v["path"] = data["ws-opts"]["path"]
-            elif v["net"] == "h2":
-                if "h2-opts" in data:
-                    if "host" in data["h2-opts"]:
-                        v["host"] = ",".join(data["h2-opts"]["host"])
-                    if "path" in data["h2-opts"]:
-                        v["path"] = data["h2-opts"]["path"]
-            elif v["net"] == "grpc":
-                if "grpc-opts" in data:
-                    if "grpc-service-name" in data["grpc-opts"]:
-                        v["path"] = data["grpc-opts"]["grpc-service-name"]
-            if ("tls" in data) and data["tls"]:
-                v["tls"] = "tls"
-            return "vmess://" + b64encodes(json.dumps(v, ensure_ascii=False))
-
-        if self.type == "ss":
-            passwd = b64encodes_safe(data["cipher"] + ":" + data["password"])
-            return (
-                f"ss://{passwd}@{data['server']}:{data['port']}#{quote(data['name'])}"
-            )
-        if self.type == "ssr":
-            ret = (
-                ":".join(
-                    [
-                        str(self.data[_])
-                        for _ in ("server", "port", "protocol", "cipher", "obfs")
-                    ]
-                )
-                + b64encodes_safe(self.data["password"])
-                + f"remarks={b64encodes_safe(self.data['name'])}"
-            )
-            for k, urlk in (
-                ("obfs-param", "obfsparam"),
-                ("protocol-param", "protoparam"),
-                ("group", "group"),
-            ):
-                if k in self.data:
-                    ret += "&" + urlk + "=" + b64encodes_safe(self.data[k])
-            return "ssr://" + ret
-
-        if self.type == "trojan":
-            passwd = quote(data["password"])
-            name = quote(data["name"])
-            ret = f"trojan://{passwd}@{data['server']}:{data['port']}?"
-            if "skip-cert-verify" in data:
-                ret += f"allowInsecure={int(data['skip-cert-verify'])}&"
-            if "sni" in data:
-                ret += f"sni={data['sni']}&"
-            if "alpn" in data:
-                ret += f"alpn={quote(','.join(data['alpn']))}&"
-            if "network" in data:
-                if data["network"] == "grpc":
-                    ret += f"type=grpc&serviceName={data['grpc-opts']['grpc-service-name']}"
-                elif data["network"] == "ws":
-                    ret += f"type=ws&"
-                    if "ws-opts" in data:
-                        try:
-                            ret += f"host={data['ws-opts']['headers']['Host']}&"
-                        except KeyError:
-                            pass
-                        if "path" in data["ws-opts"]:
-                            ret += f"path={data['ws-opts']['path']}"
-            ret = ret.rstrip("&") + "#" + name
-            return ret
-
-        if self.type == "vless":
-            passwd = quote(data["uuid"])
-            name = quote(data["name"])
-            ret = f"vless://{passwd}@{data['server']}:{data['port']}?"
-            if "skip-cert-verify" in data:
-                ret += f"allowInsecure={int(data['skip-cert-verify'])}&"
-            if "servername" in data:
-                ret += f"sni={data['servername']}&"
-            if "alpn" in data:
-                ret += f"alpn={quote(','.join(data['alpn']))}&"
-            if "network" in data:
-                if data["network"] == "grpc":
-                    ret += f"type=grpc&serviceName={data['grpc-opts']['grpc-service-name']}"
-                elif data["network"] == "ws":
-                    ret += f"type=ws&"
-                    if "ws-opts" in data:
-                        try:
-                            ret += f"host={data['ws-opts']['headers']['Host']}&"
-                        except KeyError:
-                            pass
-                        if "path" in data["ws-opts"]:
-                            ret += f"path={data['ws-opts']['path']}"
-            if "flow" in data:
-                flow: str = data["flow"]
-                if flow.endswith("!"):
-                    ret += f"flow={flow[:-1]}&"
-                else:
-                    ret += f"flow={flow}-udp443&"
-            if "client-fingerprint" in data:
-                ret += f"fp={data['client-fingerprint']}&"
-            if "tls" in data and data["tls"]:
-                ret += f"security=tls&"
-            elif "reality-opts" in data:
-                opts: Dict[str, str] = data["reality-opts"]
-                ret += f"security=reality&pbk={opts.get('public-key','')}&sid={opts.get('short-id','')}&"
-            ret = ret.rstrip("&") + "#" + name
-            return ret
-
-        if self.type == "hysteria2":
-            passwd = quote(data["password"])
-            name = quote(data["name"])
-            ret = f"hysteria2://{passwd}@{data['server']}:{data['port']}"
-            if "ports" in data:
-                ret += "," + data["ports"]
-            ret += "?"
-            if "skip-cert-verify" in data:
-                ret += f"insecure={int(data['skip-cert-verify'])}&"
-            if "alpn" in data:
-                ret += f"alpn={quote(','.join(data['alpn']))}&"
-            if "fingerprint" in data:
-                ret += f"fp={data['fingerprint']}&"
-            for k in ("sni", "obfs", "obfs-password"):
-                if k in data:
-                    ret += f"{k}={data[k]}&"
-            ret = ret.rstrip("&") + "#" + name
-            return ret
-
-        raise UnsupportedType(self.type)
+        data = self._data
+        if self._url is None or self._url[0] != data.version:
+            self._url = (data.version, node_url(self.type, data))
+        return self._url[1]
 
     @property
     def clash_data(self) -> DATA_TYPE:
-        ret = self.data.copy()
-        if "password" in ret and ret["password"].isdigit():
-            ret["password"] = "!!str " + ret["password"]
-        if "uuid" in ret and len(ret["uuid"]) != len(DEFAULT_UUID):
-            ret["uuid"] = DEFAULT_UUID
-        if "group" in ret:
-            del ret["group"]
-        if "cipher" in ret and not ret["cipher"]:
-            ret["cipher"] = "auto"
-        if self.type == "vless" and "flow" in ret:
-            if ret["flow"].endswith("-udp443"):
-                ret["flow"] = ret["flow"][:-7]
-            elif ret["flow"].endswith("!"):
-                ret["flow"] = ret["flow"][:-1]
-        if "alpn" in ret and isinstance(ret["alpn"], str):
-            # 'alpn' is not a slice
-            ret["alpn"] = ret["alpn"].replace(" ", "").split(",")
-        return ret
+        """Clash 格式的节点数据，各输出共用同一个字典，不要修改"""
+        data = self._data
+        if self._clash is None or self._clash[0] != data.version:
+            self._clash = (data.version, node_clash_data(self.type, data))
+        return self._clash[1]
+
+    @classmethod
+    def warm_urls(cls, nodes: List["Node"]) -> None:
+        """批量生成并缓存节点链接，节点较多时使用多进程"""
+        items = [(n.type, dict(n.data)) for n in nodes]
+        if len(items) >= SERIALIZE_PARALLEL_THRESHOLD and (os.cpu_count() or 1) > 1:
+            with ProcessPoolExecutor() as executor:
+                urls = list(executor.map(_try_node_url, items, chunksize=1024))
+        else:
+            urls = [_try_node_url(item) for item in items]
+        for n, url in zip(nodes, urls):
+            if url is not None:
+                n._url = (n.data.version, url)
+
+    @classmethod
+    def warm_clash_data(cls, nodes: List["Node"]) -> None:
+        """批量生成并缓存 Clash 格式的节点数据
+
+        生成过程只是复制字典，多进程传输的开销比它本身还大，所以直接在本进程中进行。
+        """
+        for n in nodes:
+            n.clash_data
 
     def supports_meta(self, noMeta=False) -> bool:
         if self.isfake:
@@ -772,9 +1055,18 @@ class Source:
         else:
             self.url: str = url
             self.url_source: None = None
-        self.content: Union[str, List[str], int] = None
+        self.content: Union[bytearray, str, List[str], int] = None
         self.sub: Union[List[str], List[Dict[str, str]]] = None
         self.cfg: Dict[str, Any] = {}
+        # 由 merge() 填写：预筛命中的节点数、实际解析的节点数及解析耗时
+        self.hits = 0
+        self.parsed = 0
+        self.parse_time = 0.0
+        # 订阅中的节点数，低内存模式下 sub 被丢弃后仍可用于统计
+        self.count = 0
+        # 下载和合并的起止时间（perf_counter），用于写出时间线
+        self.fetch_span: Optional[Tuple[float, float]] = None
+        self.merge_span: Optional[Tuple[float, float]] = None
 
     def gen_url(self) -> None:
         self.url_source: str
@@ -789,6 +1081,14 @@ class Source:
                 self.date -= datetime.timedelta(days=1)
         self.url = url
 
+    def fetch(self) -> None:
+        """下载线程的入口，记录下载的起止时间"""
+        start = time.perf_counter()
+        try:
+            self.get()
+        finally:
+            self.fetch_span = (start, time.perf_counter())
+
     @no_type_check
     def get(self, depth=2) -> None:
         global exc_queue
@@ -836,69 +1136,80 @@ class Source:
         else:
             self.parse()
 
-    def _download(self, r: requests.Response) -> str:
-        content: str = ""
+    def _download(self, r: requests.Response) -> bytearray:
+        """读取订阅内容
+
+        V2Ray 订阅从第一行有效内容起原样返回；Clash 配置只保留 `proxies` 段，
+        读到其后的顶层字段即停止下载。
+        """
+        buf = bytearray()
+        content = bytearray()
         tp = None
-        pending = None
-        early_stop = False
-        for chunk in r.iter_content():
-            if early_stop:
-                pending = None
-                break
-            chunk: bytes
-            if pending is not None:
-                chunk = pending + chunk
-                pending = None
-            if tp == "sub":
-                content += chunk.decode(errors="ignore")
-                continue
-            lines: List[bytes] = chunk.splitlines()
-            if lines and lines[-1] and chunk and lines[-1][-1] == chunk[-1]:
-                pending = lines.pop()
-            while lines:
-                line = lines.pop(0).rstrip().decode(errors="ignore").replace("\\r", "")
-                if not line:
-                    continue
-                if not tp:
-                    if ": " in line:
-                        kv = line.split(": ")
-                        if len(kv) == 2 and kv[0].isalpha():
-                            tp = "yaml"
-                    elif line[0] == "#":
-                        pass
-                    else:
-                        tp = "sub"
-                if tp == "yaml":
-                    if content:
-                        if line in ("proxy-groups:", "rules:", "script:"):
-                            early_stop = True
-                            break
-                        content += line + "\n"
-                    elif line == "proxies:":
-                        content = line + "\n"
-                elif tp == "sub":
-                    content = chunk.decode(errors="ignore")
-        if pending is not None:
-            content += pending.decode(errors="ignore")
+        pos = 0
+
+        def feed(start: int, end: int) -> bool:
+            """处理一行，返回 True 表示可以停止下载"""
+            nonlocal tp
+            line = bytes(buf[start:end]).rstrip().replace(b"\\r", b"")
+            if not line:
+                return False
+            if not tp:
+                if b": " in line:
+                    kv = line.split(b": ")
+                    # 顶层字段名可能带连字符，如 `mixed-port: 7890`
+                    if len(kv) == 2 and kv[0].replace(b"-", b"").isalpha():
+                        tp = "yaml"
+                elif line[:1] != b"#":
+                    tp = "sub"
+                    return False
+            if tp == "yaml":
+                if content:
+                    if line in (b"proxy-groups:", b"rules:", b"script:"):
+                        return True
+                    content.extend(line + b"\n")
+                elif line == b"proxies:":
+                    content.extend(line + b"\n")
+            return False
+
+        for chunk in r.iter_content(DOWNLOAD_CHUNK_SIZE):
+            buf += chunk
+            while tp != "sub":
+                end = buf.find(b"\n", pos)
+                if end < 0:
+                    break
+                if feed(pos, end):
+                    return content
+                if tp != "sub":
+                    pos = end + 1
+        if tp != "sub" and pos < len(buf):
+            feed(pos, len(buf))
+        if tp == "sub":
+            # 订阅可能很大，直接返回缓冲区，避免再复制一份
+            if pos:
+                del buf[:pos]
+            return buf
         return content
 
     def parse(self) -> None:
         global exc_queue
         try:
-            text = self.content
-            if isinstance(text, str):
-                if "proxies:" in text:
+            content = self.content
+            if isinstance(content, str):
+                content = content.encode("utf-8")
+            if isinstance(content, (bytes, bytearray)):
+                if b"proxies:" in content:
                     # Clash config
+                    text = content.decode(errors="ignore")
                     config = yaml.full_load(text.replace("!<str>", "!!str"))
                     sub = config["proxies"]
-                elif "://" in text:
+                elif b"://" in content:
                     # V2Ray raw list
-                    sub = text.strip().splitlines()
+                    sub = content.decode(errors="ignore").strip().splitlines()
                 else:
-                    # V2Ray Sub
-                    sub = b64decodes(text.strip()).strip().splitlines()
+                    # V2Ray Sub，整体一次解码
+                    sub = b64decodes(strip_view(content)).strip().splitlines()
             else:
-                sub = text  # 动态节点抓取后直接传入列表
+                sub = content  # 动态节点抓取后直接传入列表
 
             if "max" in self.cfg and len(sub) > self.cfg["max"]:
                 exc_queue.append(
@@ -971,21 +1282,130 @@ class DomainTree:
         return ret
 
 
-def extract(url: str) -> Union[Set[str], int]:
+def extract(url: str) -> Union[Tuple[Set[str], Set[str]], int]:
+    """下载机场列表，返回 (订阅链接, 嵌套的机场列表)；失败时返回状态码
+
+    列表每行一个链接，以 '*' 开头的行是另一个机场列表，'#' 开头的行是注释。
+    """
     global session
-    res = session.get(url)
+    res = session.get(url, timeout=FETCH_TIMEOUT[1])
     if res.status_code != 200:
         return res.status_code
     urls: Set[str] = set()
-    for line in res.text:
-        if line.startswith("http"):
-            urls.add(line)
-    return urls
+    lists: Set[str] = set()
+    for line in res.text.splitlines():
+        line = line.strip()
+        if line.startswith("*"):
+            line = line[1:].strip()
+            if line.startswith("http"):
+                lists.add(raw2fastly(line))
+        elif line.startswith("http"):
+            urls.add(raw2fastly(line))
+    return urls, lists
+
+
+class AirportLists:
+    """在后台并发、递归地展开机场列表
+
+    新发现的订阅链接会立即交给 `on_found`，以便与其他订阅同时抓取；
+    `known` 中已有的链接不会重复提交。
+    """
+
+    def __init__(
+        self,
+        known: Set[str],
+        on_found: Callable[[str], None],
+        max_depth: int = AIRPORT_MAX_DEPTH,
+        concurrency: int = AIRPORT_CONCURRENCY,
+    ) -> None:
+        self.known = known
+        self.on_found = on_found
+        self.max_depth = max_depth
+        self.lock = threading.Lock()
+        self.visited: Set[str] = set()
+        self.pending = 0
+        self.done = threading.Event()
+        self.done.set()
+        self.messages: List[str] = []
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    def submit(self, url: str, depth: int = 0) -> None:
+        with self.lock:
+            if url in self.visited:
+                return
+            self.visited.add(url)
+            self.pending += 1
+            self.done.clear()
+        self.executor.submit(self._expand, url, depth)
+
+    def _expand(self, url: str, depth: int) -> None:
+        msg = "合并机场列表 '" + url + "'... "
+        try:
+            res = extract(url)
+            if isinstance(res, int):
+                msg += str(res)
+                return
+            urls, lists = res
+            new = 0
+            with self.lock:
+                for sub in sorted(urls):
+                    if sub not in self.known:
+                        self.known.add(sub)
+                        self.on_found(sub)
+                        new += 1
+            msg += f"完成！新增 {new}/{len(urls)} 个订阅"
+            if lists:
+                if depth < self.max_depth:
+                    for sub in sorted(lists):
+                        self.submit(sub, depth + 1)
+                    msg += f"，{len(lists)} 个嵌套列表"
+                else:
+                    msg += f"，超过最大层数，忽略 {len(lists)} 个嵌套列表"
+        except requests.exceptions.RequestException:
+            msg += "合并失败！"
+        except Exception:
+            msg += "错误：\n" + traceback.format_exc()
+        finally:
+            self.messages.append(msg)
+            with self.lock:
+                self.pending -= 1
+                if not self.pending:
+                    self.done.set()
+
+    def flush(self) -> None:
+        while self.messages:
+            print(self.messages.pop(0), flush=True)
+
+    def indices(self, sources: List[Any]) -> Iterator[int]:
+        """依次产出 `sources` 的下标，列表展开期间会等待新加入的订阅"""
+        i = 0
+        while True:
+            self.flush()
+            if i < len(sources):
+                yield i
+                i += 1
+            elif self.done.wait(0.5) and i >= len(sources):
+                self.flush()
+                self.executor.shutdown(wait=False)
+                return
 
 
 merged: Dict[int, Node] = {}
 unknown: Set[str] = set()
 used: Dict[int, Dict[int, str]] = {}
+# 原始行（或 Clash 节点）指纹 -> (节点 Hash, 节点名)，重复的节点无需再解析
+seen_raw: Dict[int, Tuple[int, str]] = {}
+# 解析失败的原始行指纹 -> 是否为不支持的类型
+failed_raw: Dict[int, bool] = {}
+
+
+def raw_key(p: Union[str, Dict[str, Any]]) -> Tuple[int, Optional[str]]:
+    """计算原始节点的指纹，忽略节点名；返回 (指纹, 可从原始行直接得到的节点名)"""
+    if isinstance(p, str):
+        key, sep, name = p.partition("#")
+        return hash(key), (unquote(name) or "未命名") if sep else None
+    rest = {k: v for k, v in p.items() if k != "name"}
+    return hash(json.dumps(rest, sort_keys=True, default=str)), p.get("name") or "未命名"
 
 
 def merge(source_obj: Source, sourceId=-1) -> None:
@@ -994,6 +1414,7 @@ def merge(source_obj: Source, sourceId=-1) -> None:
     if not sub:
         print("空订阅，跳过！", end="", flush=True)
         return
+    source_obj.count = len(sub)
     for p in sub:
         if isinstance(p, str):
             if "://" not in p:
@@ -1005,6 +1426,18 @@ def merge(source_obj: Source, sourceId=-1) -> None:
                     break
             if not ok:
                 continue
+        key, name = raw_key(p)
+        if key in seen_raw:
+            source_obj.hits += 1
+            hashn, first_name = seen_raw[key]
+            used[hashn][sourceId] = first_name if name is None else name
+            continue
+        if key in failed_raw:
+            source_obj.hits += 1
+            if failed_raw[key]:
+                unknown.add(p)  # type: ignore
+            continue
+        start = time.perf_counter()
         try:
             n = Node(p)
         except KeyboardInterrupt:
@@ -1013,8 +1446,10 @@ def merge(source_obj: Source, sourceId=-1) -> None:
             if len(e.args) == 1:
                 print(f"不支持的类型：{e}")
             unknown.add(p)  # type: ignore
+            failed_raw[key] = True
         except:
             traceback.print_exc()
+            failed_raw[key] = False
         else:
             n.format_name()
             Node.names.add(n.data["name"])
@@ -1026,6 +1461,122 @@ def merge(source_obj: Source, sourceId=-1) -> None:
             if hashn not in used:
                 used[hashn] = {}
             used[hashn][sourceId] = n.name
+            seen_raw[key] = (hashn, n.name)
+        finally:
+            source_obj.parsed += 1
+            source_obj.parse_time += time.perf_counter() - start
+
+
+resolver = Resolver(cache_path=RESOLVE_CACHE)
+
+
+def endpoint_key(node: Node, ip: str) -> Optional[str]:
+    """服务器换成 `ip` 后的去重标识，无法计算时返回 None
+
+    SNI 或 ws/h2 的 Host 缺省为服务器域名时，域名也会发送给服务器（如 CDN 按 Host
+    转发到不同源站），此时保留域名，只合并域名相同的节点。
+    """
+    key = node.hash_key(ip)
+    if key == "__ERROR__":
+        return None
+    data = node.data
+    sends_name = False
+    tls = node.type in ("trojan", "hysteria2") or bool(data.get("tls"))
+    if tls and not (data.get("sni") or data.get("servername")):
+        sends_name = True
+    net = data.get("network")
+    if net == "ws" and not data.get("ws-opts", {}).get("headers", {}).get("Host"):
+        sends_name = True
+    elif net == "h2" and not data.get("h2-opts", {}).get("host"):
+        sends_name = True
+    if sends_name:
+        key += "@" + str(data["server"])
+    return key
+
+
+def resolve_merged() -> None:
+    """解析所有节点的服务器，合并解析后端点相同的节点，来源合并到保留的节点"""
+    global merged
+    ips = resolver.resolve_many(str(n.data.get("server", "")) for n in merged.values())
+    resolver.save()
+    failed = sum(1 for ip in ips.values() if ip is None)
+    seen: Dict[str, int] = {}
+    dup = 0
+    for hashn, n in list(merged.items()):
+        ip = ips.get(str(n.data.get("server", "")))
+        if not ip:
+            continue
+        key = endpoint_key(n, ip)
+        if key is None:
+            continue
+        if key not in seen:
+            seen[key] = hashn
+            continue
+        kept = seen[key]
+        for sourceId, name in used.pop(hashn, {}).items():
+            used.setdefault(kept, {}).setdefault(sourceId, name)
+        del merged[hashn]
+        dup += 1
+    print(
+        f"{len(ips)} 个服务器，{failed} 个无法解析（查询 {resolver.queries} 次，"
+        f"缓存命中 {resolver.hits} 次），合并 {dup} 个重复节点"
+    )
+
+
+def geoip_file(src: str, check: Callable[[str], None]) -> Optional[str]:
+    """地区数据为 URL 时下载到 GEOIP_CACHE，返回本地路径
+
+    下载的文件先用 `check` 校验，通过后才替换缓存。下载失败或校验不通过时使用过期的
+    文件，没有则返回 None，不使用这份数据。
+    """
+    if "://" not in src:
+        return src
+    name = os.path.basename(urlsplit(src).path) or "geoip"
+    key = hashlib.sha256(src.encode("utf-8")).hexdigest()[:8]
+    path = os.path.join(GEOIP_CACHE, key + "_" + name)
+    try:
+        if time.time() - os.path.getmtime(path) < GEOIP_CACHE_TTL:
+            return path
+    except OSError:
+        pass
+    os.makedirs(GEOIP_CACHE, exist_ok=True)
+    tmp = path + ".tmp"
+    try:
+        with session.get(src, stream=True, timeout=FETCH_TIMEOUT[1]) as res:
+            res.raise_for_status()
+            with open(tmp, "wb") as f:
+                for chunk in res.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+        check(tmp)
+        os.replace(tmp, path)
+    except (requests.exceptions.RequestException, *DATA_ERRORS) as e:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        if not os.path.exists(path):
+            print(f"下载 '{src}' 失败（{type(e).__name__}），跳过... ", end="")
+            return None
+        print(f"下载 '{src}' 失败（{type(e).__name__}），使用已有的文件... ", end="")
+    return path
+
+
+def geoip_regions(nodes: List[Node], geo_conf: Dict[str, Any]) -> List[Optional[str]]:
+    """按服务器 IP 查询节点所在地区，结果与输入一一对应"""
+    tables: Dict[str, str] = {}
+    for region, src in (geo_conf.get("tables") or {}).items():
+        path = geoip_file(src, check_table)
+        if path:
+            tables[region] = path
+    mmdb: Optional[str] = geo_conf.get("mmdb")
+    if mmdb and not MMDB_SUPPORTED:
+        print("未安装 maxminddb，不使用 mmdb... ", end="", flush=True)
+        mmdb = None
+    index = RegionIndex.load(tables, geoip_file(mmdb, check_mmdb) if mmdb else None)
+    servers = [str(node.data.get("server", "")) for node in nodes]
+    if geo_conf.get("resolve", True):
+        ips = resolver.resolve_many(servers)
+        resolver.save()
+        servers = [ips.get(server) or "" for server in servers]
+    return index.lookup_many(servers)
 
 
 def raw2fastly(url: str) -> str:
@@ -1137,8 +1688,260 @@ def merge_adblock(adblock_name: str, rules: Dict[str, str]) -> None:
     print(f"共有 {len(rules)} 条规则")
 
 
-def main():
-    global exc_queue, merged, FETCH_TIMEOUT, ABFURLS, AUTOURLS, AUTOFETCH
+def probe_merged() -> None:
+    """探测所有节点，丢弃无法连接的节点，其余按延迟排序，未知的排在最后"""
+    global merged
+    nodes = list(merged.items())
+    results = Prober(**PROBE_OPTIONS).probe([n.data for _, n in nodes])
+    alive: List[Tuple[int, Node]] = []
+    unknowns: List[Tuple[int, Node]] = []
+    dead = 0
+    for (hashn, n), result in zip(nodes, results):
+        n.alive = result.alive
+        n.latency = result.latency
+        if result.alive is None:
+            unknowns.append((hashn, n))
+        elif result.alive:
+            alive.append((hashn, n))
+        else:
+            dead += 1
+    alive.sort(key=lambda x: x[1].latency)
+    merged = dict(alive + unknowns)
+    print(f"{len(alive)} 个存活，{dead} 个无法连接，{len(unknowns)} 个未知。")
+
+
+class StageReport:
+    """按阶段记录耗时
+
+    memory 为 True 时用 tracemalloc 同时记录内存；profile_dir 不为空时用 cProfile 分析
+    主线程，每个阶段结束时保存为 `序号_阶段.prof`；trace_path 不为空时，finish() 把各阶段
+    及各订阅的下载、合并耗时写成 Chrome trace 格式的时间线。
+    """
+
+    def __init__(
+        self,
+        memory: bool = False,
+        profile_dir: Optional[str] = None,
+        trace_path: Optional[str] = None,
+    ) -> None:
+        self.memory = memory
+        self.profile_dir = profile_dir
+        self.trace_path = trace_path
+        self.stages: List[Dict[str, Any]] = []
+        self.events: List[Dict[str, Any]] = []
+        self.snapshot: Optional[tracemalloc.Snapshot] = None
+        self.profiler: Optional[cProfile.Profile] = None
+        if memory:
+            tracemalloc.start()
+            self.snapshot = self._take_snapshot()
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.origin = self.last = time.perf_counter()
+
+    @staticmethod
+    def _take_snapshot() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)]
+        )
+
+    def _event(
+        self, name: str, cat: str, start: float, end: float, tid: int = 0, **args: Any
+    ) -> None:
+        self.events.append(
+            {
+                "name": name,
+                "cat": cat,
+                "ph": "X",
+                "ts": round((start - self.origin) * 1e6),
+                "dur": round((end - start) * 1e6),
+                "pid": 0,
+                "tid": tid,
+                "args": args,
+            }
+        )
+
+    def mark(self, name: str) -> None:
+        """结束名为 `name` 的阶段"""
+        now = time.perf_counter()
+        if self.profiler:
+            self.profiler.disable()
+        stage: Dict[str, Any] = {
+            "stage": name,
+            "seconds": round(now - self.last, 3),
+        }
+        self._event(name, "stage", self.last, now)
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = self._take_snapshot()
+            top = snapshot.compare_to(self.snapshot, "lineno")[:3]
+            stage["current"] = current
+            stage["peak"] = peak
+            stage["growth"] = [str(stat) for stat in top]
+            self.snapshot = snapshot
+            tracemalloc.reset_peak()
+        if self.profiler:
+            assert self.profile_dir
+            prof = f"{len(self.stages):02d}_{name}.prof"
+            self.profiler.dump_stats(os.path.join(self.profile_dir, prof))
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.stages.append(stage)
+        self.last = time.perf_counter()
+
+    def add_sources(self, sources: List[Source]) -> None:
+        """把各订阅的下载（每个订阅一行）和合并（主线程）耗时加入时间线"""
+        for i, source in enumerate(sources, 1):
+            if source.fetch_span:
+                start, end = source.fetch_span
+                self._event("fetch", "source", start, end, tid=i, url=source.url)
+                self.events.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": 0,
+                        "tid": i,
+                        "args": {"name": source.url},
+                    }
+                )
+            if source.merge_span:
+                self._event("merge", "source", *source.merge_span, url=source.url)
+
+    def finish(self, path: str = STAGE_REPORT_FILE) -> None:
+        if self.profiler:
+            self.profiler.disable()
+            self.profiler = None
+        print("各阶段耗时" + ("与内存（MiB，当前/峰值）：" if self.memory else "："))
+        for stage in self.stages:
+            line = f"  {stage['stage']:<12}{stage['seconds']:>9.2f}s"
+            if self.memory:
+                line += f"{stage['current'] / 1048576:>10.1f}"
+                line += f"{stage['peak'] / 1048576:>10.1f}"
+            print(line)
+        if self.memory:
+            tracemalloc.stop()
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(self.stages, f, ensure_ascii=False, indent=2)
+        if self.profile_dir:
+            print(f"各阶段的 cProfile 结果已保存到 {self.profile_dir}")
+        if self.trace_path:
+            with open(self.trace_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    {"traceEvents": self.events, "displayTimeUnit": "ms"},
+                    f,
+                    ensure_ascii=False,
+                )
+            print(f"时间线已保存到 {self.trace_path}")
+
+
+def dump_without_str_tags(data: Any, f: TextIO) -> None:
+    """把 `data` 以 YAML 写入 `f`，去掉纯数字密码等字段的 '!!str ' 标记"""
+    writer = StrTagFilter(f)
+    yaml.dump(data, writer, allow_unicode=True)
+    writer.flush()
+
+
+def copy_conf(conf: Dict[str, Any]) -> Dict[str, Any]:
+    """复制配置中之后会被修改的部分（代理组和 DNS），其余部分共用，代替深复制"""
+    ret = dict(conf)
+    ret["proxy-groups"] = [group.copy() for group in conf["proxy-groups"]]
+    if isinstance(conf.get("dns"), dict):
+        ret["dns"] = conf["dns"].copy()
+    return ret
+
+
+def provider_conf(
+    conf: Dict[str, Any],
+    prov: Dict[str, Any],
+    ctg_nodes: Dict[str, List[Node.DATA_TYPE]],
+    ctg_disp: Dict[str, str],
+    ctg_base: Dict[str, Any],
+    suffix: str,
+) -> Dict[str, Any]:
+    """生成以 proxy-providers 引用 snippets/nodes*.yml 的配置，`conf` 需为未填入节点的模板"""
+    providers: Dict[str, Dict[str, Any]] = {}
+
+    def provider(name: str, file: str) -> str:
+        providers[name] = {
+            "type": "http",
+            "url": prov["base-url"] + file + suffix,
+            "path": prov["path"] + file + suffix,
+            "interval": prov["interval"],
+        }
+        return name
+
+    conf["proxy-providers"] = providers
+    all_nodes = provider("nodes", "nodes")
+    # 与内联节点时一致，最后一个组只包含各地区的组
+    for group in conf["proxy-groups"][:-1]:
+        if not group["proxies"]:
+            del group["proxies"]
+            group["use"] = [all_nodes]
+    conf["proxy-groups"][-1]["proxies"] = []
+    ctg_selects: List[str] = conf["proxy-groups"][-1]["proxies"]
+    for ctg, payload in ctg_nodes.items():
+        if ctg in ctg_disp:
+            disp = ctg_base.copy()
+            disp["name"] = ctg_disp[ctg]
+            if not payload:
+                # 空的 provider 无法加载
+                disp["proxies"] = ["REJECT"]
+            else:
+                del disp["proxies"]
+                disp["use"] = [provider(ctg, "nodes_" + ctg)]
+            conf["proxy-groups"].append(disp)
+            ctg_selects.append(disp["name"])
+    return conf
+
+
+def dump_state(sources_obj: List[Source]) -> Dict[str, Any]:
+    """整理合并后的节点、来源和订阅统计，用于写入快照"""
+    nodes = [
+        (dict(n.data), n.alive, n.latency, used.get(hashn, {}))
+        for hashn, n in merged.items()
+    ]
+    sources = [
+        (
+            s.url,
+            len(s.sub) if isinstance(s.sub, list) else s.count,
+            s.hits,
+            s.parsed,
+            s.parse_time,
+        )
+        for s in sources_obj
+    ]
+    return {"nodes": nodes, "unknown": sorted(unknown), "sources": sources}
+
+
+def load_state(snap: Dict[str, Any]) -> Tuple[Dict[str, Any], List[Source]]:
+    """从快照恢复合并后的节点和来源，返回 (快照中的状态, 订阅对象)"""
+    global merged
+    state: Dict[str, Any] = snap["state"]
+    merged = {}
+    used.clear()
+    for data, alive, latency, sources in state["nodes"]:
+        n = Node(data)
+        n.alive = alive
+        n.latency = latency
+        hashn = hash(n)
+        merged[hashn] = n
+        used[hashn] = dict(sources)
+    unknown.update(state["unknown"])
+    sources_obj: List[Source] = []
+    for url, count, hits, parsed, parse_time in state["sources"]:
+        source = Source(url)
+        source.count = count
+        source.hits = hits
+        source.parsed = parsed
+        source.parse_time = parse_time
+        sources_obj.append(source)
+    return state, sources_obj
+
+
+def fetch_all() -> List[Source]:
+    """生成动态链接、展开机场列表，抓取并合并所有订阅，返回订阅对象"""
+    global exc_queue, FETCH_TIMEOUT, AUTOURLS, AUTOFETCH
     sources = open("sources.list", encoding="utf-8").read().strip().splitlines()
     if DEBUG_NO_NODES:
         # !!! JUST FOR DEBUGING !!!
@@ -1149,10 +1952,13 @@ def main():
         print("!!! 警告：您已选择不抓取动态节点 !!!")
         AUTOURLS = AUTOFETCH = []
     print("正在生成动态链接...")
-    for auto_fun in AUTOURLS:
+    # 各插件自带超时，并发运行后按顺序输出
+    with ThreadPoolExecutor(max_workers=max(len(AUTOURLS), 1)) as executor:
+        auto_futures = [(_, executor.submit(_)) for _ in AUTOURLS]
+    for auto_fun, future in auto_futures:
         print("正在生成 '" + auto_fun.__name__ + "'... ", end="", flush=True)
         try:
-            url = auto_fun()
+            url = future.result()
         except requests.exceptions.RequestException:
             print("失败！")
         except:
@@ -1198,37 +2004,31 @@ def main():
         else:
             sources_final.add(sub)
 
-    if airports:
-        print("正在抓取机场列表...")
-        for sub in airports:
-            print("合并 '" + sub + "'... ", end="", flush=True)
-            try:
-                res = extract(sub)
-            except KeyboardInterrupt:
-                print("正在退出...")
-                break
-            except requests.exceptions.RequestException:
-                print("合并失败！")
-            except:
-                traceback.print_exc()
-            else:
-                if isinstance(res, int):
-                    print(res)
-                else:
-                    for url in res:
-                        sources_final.add(url)
-                    print("完成！")
-
     print("正在整理链接...")
     sources_final = list(sources_final)
     sources_final.sort()
     sources_obj = [Source(url) for url in (sources_final + AUTOFETCH)]
+    threads = [threading.Thread(target=_.fetch, daemon=True) for _ in sources_obj]
+
+    def add_source(url: str) -> None:
+        # 先加线程再加订阅，主线程看到新订阅时线程一定已就绪
+        source = Source(url)
+        thread = threading.Thread(target=source.fetch, daemon=True)
+        threads.append(thread)
+        thread.start()
+        sources_obj.append(source)
 
     print("开始抓取！")
-    threads = [threading.Thread(target=_.get, daemon=True) for _ in sources_obj]
     for thread in threads:
         thread.start()
-    for i in range(len(sources_obj)):
+    airport_lists = AirportLists(
+        set(sources_final), add_source, concurrency=AIRPORT_CONCURRENCY
+    )
+    if airports:
+        print("正在后台展开机场列表...")
+        for sub in sorted(airports):
+            airport_lists.submit(sub)
+    for i in airport_lists.indices(sources_obj):
         try:
             for t in range(1, FETCH_TIMEOUT[0] + 1):
                 print("抓取 '" + sources_obj[i].url + "'... ", end="", flush=True)
@@ -1252,6 +2052,7 @@ def main():
                     print(res)
             else:
                 print("正在合并... ", end="", flush=True)
+                start = time.perf_counter()
                 try:
                     merge(sources_obj[i], sourceId=i)
                 except KeyboardInterrupt:
@@ -1261,21 +2062,83 @@ def main():
                     print("失败！")
                     traceback.print_exc()
                 else:
-                    print("完成！")
+                    source = sources_obj[i]
+                    print(f"完成！重复 {source.hits}/{source.hits + source.parsed}")
+                    if LOW_MEMORY:
+                        source.content = source.sub = None
+                finally:
+                    sources_obj[i].merge_span = (start, time.perf_counter())
         except KeyboardInterrupt:
             print("正在退出...")
             break
         while exc_queue:
             print(exc_queue.pop(0), file=sys.stderr, flush=True)
+    return sources_obj
+
+
+def default_stages() -> List[str]:
+    return [_ for _ in STAGES if _ != "adblock" or not DEBUG_NO_ADBLOCK]
+
+
+def output_path(*parts: str) -> str:
+    return os.path.join(OUTPUT_DIR, *parts)
+
+
+def main(stages: Optional[Iterable[str]] = None) -> StageReport:
+    """运行 `stages` 中的阶段（默认为 default_stages()），返回各阶段的耗时报告"""
+    global exc_queue, merged, FETCH_TIMEOUT, ABFURLS, AUTOURLS, AUTOFETCH
+    stages = set(default_stages() if stages is None else stages)
+    report = StageReport(MEMORY_REPORT, PROFILE_DIR, TRACE_FILE)
+    if "fetch" not in stages:
+        print("正在从快照载入节点... ", end="", flush=True)
+        state, sources_obj = load_state(snapshot.load(snapshot_file))
+        print(f"{len(merged)} 个节点，{len(sources_obj)} 个订阅")
+    else:
+        sources_obj = fetch_all()
+
+    total_hits = sum(_.hits for _ in sources_obj)
+    total_parsed = sum(_.parsed for _ in sources_obj)
+    parse_time = sum(_.parse_time for _ in sources_obj)
+    # 用实际解析的平均耗时估算预筛跳过的解析耗时
+    avg_parse_time = parse_time / total_parsed if total_parsed else 0.0
+    print(
+        f"\n共解析 {total_parsed} 个节点，耗时 {parse_time:.2f}s；"
+        f"跳过 {total_hits} 个重复节点，约节省 {total_hits * avg_parse_time:.2f}s"
+    )
+    if LOW_MEMORY:
+        seen_raw.clear()
+        failed_raw.clear()
+    report.mark("fetch")
 
     if STOP:
         merged = {}
         for nid, nd in enumerate(STOP_FAKE_NODES.splitlines()):
             merged[nid] = Node(nd)
 
-    print("\n正在写出 V2Ray 订阅...")
-    txt = ""
-    unsupports = 0
+    if "merge" in stages and not STOP and DEDUP_RESOLVED:
+        print("\n正在解析节点服务器... ", end="", flush=True)
+        try:
+            resolve_merged()
+        except KeyboardInterrupt:
+            print("已跳过！")
+        except:
+            print("失败！")
+            traceback.print_exc()
+
+    if "merge" in stages and not STOP and not DEBUG_NO_PROBE:
+        print("\n正在探测节点... ", end="", flush=True)
+        try:
+            probe_merged()
+        except KeyboardInterrupt:
+            print("已跳过！")
+        except:
+            print("失败！")
+            traceback.print_exc()
+
+    if "fetch" in stages or "merge" in stages:
+        # 在节点名加上来源序号之前保存，重新生成输出时从这里继续
+        state = dump_state(sources_obj)
+
     for hashp, p in merged.items():
         try:
             if hashp in used:
@@ -1285,38 +2148,83 @@ def main():
                     + "|"
                     + p.data["name"]
                 )
-            if p.supports_ray():
-                try:
-                    txt += p.url + "\n"
-                except UnsupportedType as e:
-                    print(f"不支持的类型：{e}")
-            else:
-                unsupports += 1
         except:
             traceback.print_exc()
-    for p in unknown:
-        txt += p + "\n"
+
+    report.mark("merge")
+    report.add_sources(sources_obj)
+    if "emit" not in stages:
+        print("\n已跳过输出。")
+        report.finish()
+        return report
+
+    os.makedirs(output_path("snippets"), exist_ok=True)
+    print("\n正在写出 V2Ray 订阅...")
+    unsupports = 0
+    if not LOW_MEMORY:
+        Node.warm_urls([p for p in merged.values() if p.supports_ray()])
+    with open(output_path("list_raw.txt"), "w", encoding="utf-8") as f_raw, open(
+        output_path("list.txt"), "w", encoding="utf-8"
+    ) as f_b64:
+        b64_writer = Base64Writer(f_b64)
+        lines: List[str] = []
+
+        def write_lines() -> None:
+            chunk = "".join(lines)
+            f_raw.write(chunk)
+            b64_writer.write(chunk)
+            lines.clear()
+
+        for hashp, p in merged.items():
+            try:
+                if p.supports_ray():
+                    try:
+                        lines.append(p.url + "\n")
+                    except UnsupportedType as e:
+                        print(f"不支持的类型：{e}")
+                    if LOW_MEMORY:
+                        p._url = None
+                else:
+                    unsupports += 1
+            except:
+                traceback.print_exc()
+            if len(lines) >= 1024:
+                write_lines()
+        for p in unknown:
+            lines.append(p + "\n")
+        write_lines()
+        b64_writer.close()
     print(
         f"共有 {len(merged)-unsupports} 个正常节点，{len(unknown)} 个无法解析的节点，共",
         len(merged) + len(unknown),
         f"个。{unsupports} 个节点不被 V2Ray 支持。",
     )
-
-    with open("list_raw.txt", "w", encoding="utf-8") as f:
-        f.write(txt)
-    with open("list.txt", "w", encoding="utf-8") as f:
-        f.write(b64encodes(txt))
     print("写出完成！")
 
     with open("config.yml", encoding="utf-8") as f:
         conf: Dict[str, Any] = yaml.full_load(f)
 
+    # 节点数据到此不再改变，之后各输出共用缓存的 Clash 格式数据
+    global_fp: Optional[str] = conf.get("global-client-fingerprint", None)
+    meta_nodes: List[Node] = []
+    for p in merged.values():
+        if p.supports_meta():
+            if (
+                "client-fingerprint" in p.data
+                and p.data["client-fingerprint"] == global_fp
+            ):
+                del p.data["client-fingerprint"]
+            meta_nodes.append(p)
+    Node.warm_clash_data(meta_nodes)
+    report.mark("serialize")
+
     rules: Dict[str, str] = {}
-    if DEBUG_NO_ADBLOCK:
+    if "adblock" not in stages:
         # !!! JUST FOR DEBUGING !!!
         print("!!! 警告：您已关闭对 Adblock 规则的抓取 !!!")
     else:
         merge_adblock(conf["proxy-groups"][-2]["name"], rules)
+    report.mark("adblock")
 
     snip_conf: Dict[str, Dict[str, Any]] = {}
     ctg_nodes: Dict[str, List[Node.DATA_TYPE]] = {}
@@ -1334,28 +2242,57 @@ def main():
         for ctg in categories:
             ctg_nodes[ctg] = []
             ctg_nodes_meta[ctg] = []
-        for node in merged.values():
-            if node.supports_meta():
-                ctgs: List[str] = []
-                for ctg, keys in categories.items():
-                    for key in keys:
-                        if key in node.name:
-                            ctgs.append(ctg)
-                            break
-                    if ctgs and keys[-1] == "OVERALL":
+        node_ctgs: List[List[str]] = []
+        for node in meta_nodes:
+            ctgs: List[str] = []
+            for ctg, keys in categories.items():
+                for key in keys:
+                    if key in node.name:
+                        ctgs.append(ctg)
                         break
-                if len(ctgs) == 1:
-                    if node.supports_clash():
-                        ctg_nodes[ctgs[0]].append(node.clash_data)
-                    ctg_nodes_meta[ctgs[0]].append(node.clash_data)
+                if ctgs and keys[-1] == "OVERALL":
+                    break
+            node_ctgs.append(ctgs)
+        geo_conf: Optional[Dict[str, Any]] = snip_conf.get("geoip")
+        undecided = [i for i, ctgs in enumerate(node_ctgs) if len(ctgs) != 1]
+        if geo_conf and undecided:
+            print(f"正在按 IP 分类 {len(undecided)} 个节点... ", end="", flush=True)
+            try:
+                regions = geoip_regions([meta_nodes[i] for i in undecided], geo_conf)
+            except DATA_ERRORS:
+                print("失败！")
+                traceback.print_exc()
+            else:
+                found = 0
+                remap: Dict[str, Optional[str]] = geo_conf.get("remap") or {}
+                for i, region in zip(undecided, regions):
+                    if region in remap:
+                        region = remap[region]
+                    # 名称匹配多个地区时，只在其中选择
+                    if region in categories and (
+                        not node_ctgs[i] or region in node_ctgs[i]
+                    ):
+                        node_ctgs[i] = [region]
+                        found += 1
+                print(f"确定了 {found} 个")
+        for node, ctgs in zip(meta_nodes, node_ctgs):
+            if len(ctgs) == 1:
+                if node.supports_clash():
+                    ctg_nodes[ctgs[0]].append(node.clash_data)
+                ctg_nodes_meta[ctgs[0]].append(node.clash_data)
         for ctg, proxies in ctg_nodes.items():
-            with open("snippets/nodes_" + ctg + ".yml", "w", encoding="utf-8") as f:
-                yaml.dump({"proxies": proxies}, f, allow_unicode=True)
+            with open(
+                output_path("snippets", "nodes_" + ctg + ".yml"), "w", encoding="utf-8"
+            ) as f:
+                dump_without_str_tags({"proxies": proxies}, f)
         for ctg, proxies in ctg_nodes_meta.items():
             with open(
-                "snippets/nodes_" + ctg + ".meta.yml", "w", encoding="utf-8"
+                output_path("snippets", "nodes_" + ctg + ".meta.yml"),
+                "w",
+                encoding="utf-8",
             ) as f:
-                yaml.dump({"proxies": proxies}, f, allow_unicode=True)
+                dump_without_str_tags({"proxies": proxies}, f)
+    report.mark("categorize")
 
     print("正在写出 Clash & Meta 订阅...")
     keywords: List[str] = []
@@ -1395,27 +2332,24 @@ def main():
     conf["rules"] = [",".join(_) for _ in rules.items()] + [match_rule]
 
     # Clash & Meta
-    global_fp: Optional[str] = conf.get("global-client-fingerprint", None)
     proxies: List[Node.DATA_TYPE] = []
     proxies_meta: List[Node.DATA_TYPE] = []
     ctg_base: Dict[str, Any] = conf["proxy-groups"][3].copy()
     names_clash: Union[Set[str], List[str]] = set()
     names_clash_meta: Union[Set[str], List[str]] = set()
-    for p in merged.values():
-        if p.supports_meta():
-            if (
-                "client-fingerprint" in p.data
-                and p.data["client-fingerprint"] == global_fp
-            ):
-                del p.data["client-fingerprint"]
-            proxies_meta.append(p.clash_data)
-            names_clash_meta.add(p.data["name"])
-            if p.supports_clash():
-                proxies.append(p.clash_data)
-                names_clash.add(p.data["name"])
+    for p in meta_nodes:
+        proxies_meta.append(p.clash_data)
+        names_clash_meta.add(p.data["name"])
+        if p.supports_clash():
+            proxies.append(p.clash_data)
+            names_clash.add(p.data["name"])
     names_clash = list(names_clash)
     names_clash_meta = list(names_clash_meta)
-    conf_meta = copy.deepcopy(conf)
+    conf_meta = copy_conf(conf)
+    prov: Optional[Dict[str, Any]] = snip_conf.get("providers")
+    if prov:
+        conf_prov = copy_conf(conf)
+        conf_prov_meta = copy_conf(conf)
 
     # Clash
     conf["proxies"] = proxies
@@ -1442,13 +2376,11 @@ def main():
         dns_mode: Optional[str] = None
     else:
         conf["dns"]["enhanced-mode"] = "fake-ip"
-    with open("list.yml", "w", encoding="utf-8") as f:
+    with open(output_path("list.yml"), "w", encoding="utf-8") as f:
         f.write(datetime.datetime.now().strftime("# Update: %Y-%m-%d %H:%M\n"))
-        f.write(yaml.dump(conf, allow_unicode=True).replace("!!str ", ""))
-    with open("snippets/nodes.yml", "w", encoding="utf-8") as f:
-        f.write(
-            yaml.dump({"proxies": proxies}, allow_unicode=True).replace("!!str ", "")
-        )
+        dump_without_str_tags(conf, f)
+    with open(output_path("snippets", "nodes.yml"), "w", encoding="utf-8") as f:
+        dump_without_str_tags({"proxies": proxies}, f)
 
     # Meta
     conf = conf_meta
@@ -1472,15 +2404,64 @@ def main():
                 ctg_selects.append(disp["name"])
     if dns_mode:
         conf["dns"]["enhanced-mode"] = dns_mode
-    with open("list.meta.yml", "w", encoding="utf-8") as f:
+    with open(output_path("list.meta.yml"), "w", encoding="utf-8") as f:
         f.write(datetime.datetime.now().strftime("# Update: %Y-%m-%d %H:%M\n"))
-        f.write(yaml.dump(conf, allow_unicode=True).replace("!!str ", ""))
-    with open("snippets/nodes.meta.yml", "w", encoding="utf-8") as f:
-        f.write(
-            yaml.dump({"proxies": proxies_meta}, allow_unicode=True).replace(
-                "!!str ", ""
-            )
+        dump_without_str_tags(conf, f)
+    with open(output_path("snippets", "nodes.meta.yml"), "w", encoding="utf-8") as f:
+        dump_without_str_tags({"proxies": proxies_meta}, f)
+
+    if prov:
+        print("正在写出 Proxy Providers 订阅...")
+        ctg_disp = snip_conf["categories_disp"]
+        conf_prov = provider_conf(conf_prov, prov, ctg_nodes, ctg_disp, ctg_base, ".yml")
+        if dns_mode:
+            conf_prov["dns"]["enhanced-mode"] = "fake-ip"
+        with open(output_path("list.provider.yml"), "w", encoding="utf-8") as f:
+            f.write(datetime.datetime.now().strftime("# Update: %Y-%m-%d %H:%M\n"))
+            yaml.dump(conf_prov, f, allow_unicode=True)
+        conf_prov_meta = provider_conf(
+            conf_prov_meta, prov, ctg_nodes_meta, ctg_disp, ctg_base, ".meta.yml"
+        )
+        with open(output_path("list.provider.meta.yml"), "w", encoding="utf-8") as f:
+            f.write(datetime.datetime.now().strftime("# Update: %Y-%m-%d %H:%M\n"))
+            yaml.dump(conf_prov_meta, f, allow_unicode=True)
+
+    if os.path.exists(rules_file):
+        print("正在写出筛选后的 Meta 订阅... ", end="", flush=True)
+        with open(output_path(filtered_file), "w", encoding="utf-8") as f:
+            f.write(datetime.datetime.now().strftime("# Update: %Y-%m-%d %H:%M\n"))
+            kept = FilterEngine.load(rules_file).write_config(f, conf)
+        print(f"保留 {kept} 个节点")
+
+    print("正在写出节点快照... ", end="", flush=True)
+    try:
+        size = snapshot.save(snapshot_file, state, proxies_meta)
+    except (OSError, ValueError) as e:
+        print(f"失败：{e}")
+    else:
+        print(f"{size / 1024:.0f} KiB")
+
+    print("正在写出节点差异... ", end="", flush=True)
+    added_by_source: Dict[int, int] = {}
+    total_added = 0
+    try:
+        fingerprints = [p.fingerprint for p in meta_nodes]
+        node_delta = delta.update(
+            fingerprints,
+            proxies_meta,
+            path=output_path(delta.delta_file),
+            ids_path=output_path(delta.ids_file),
         )
+    except (OSError, ValueError) as e:
+        print(f"失败：{e}")
+    else:
+        print(delta.summary(node_delta))
+        added = set(node_delta.added)
+        total_added = len(added)
+        for p, fp in zip(meta_nodes, fingerprints):
+            if fp in added:
+                for sourceId in used.get(hash(p), ()):
+                    added_by_source[sourceId] = added_by_source.get(sourceId, 0) + 1
 
     if snip_conf:
         print("正在写出配置片段...")
@@ -1494,31 +2475,284 @@ def main():
             if rpolicy in name_map:
                 snippets[name_map[rpolicy]].append(rule)
         for name, payload in snippets.items():
-            with open("snippets/" + name + ".yml", "w", encoding="utf-8") as f:
+            path = output_path("snippets", name + ".yml")
+            with open(path, "w", encoding="utf-8") as f:
                 yaml.dump({"payload": payload}, f, allow_unicode=True)
 
     print("正在写出统计信息...")
-    out = "序号,链接,节点数\n"
+    out = "序号,链接,节点数,重复节点数,解析耗时(ms),预筛节省(ms),新增节点数\n"
     for i, source in enumerate(sources_obj):
         out += f"{i},{source.url},"
         try:
             out += f"{len(source.sub)}"
         except:
-            out += "0"
-        out += "\n"
-    out += f"\n总计,,{len(merged)}\n"
-    open("list_result.csv", "w").write(out)
+            out += f"{source.count}"
+        out += f",{source.hits},{source.parse_time * 1000:.1f}"
+        out += f",{source.hits * avg_parse_time * 1000:.1f}"
+        out += f",{added_by_source.get(i, 0)}\n"
+    out += f"\n总计,,{len(merged)},{total_hits},{parse_time * 1000:.1f}"
+    out += f",{total_hits * avg_parse_time * 1000:.1f},{total_added}\n"
+    open(output_path("list_result.csv"), "w").write(out)
 
     print("写出完成！")
+    report.mark("emit")
+
+    if PRECOMPRESS:
+        print("正在压缩输出文件... ", end="", flush=True)
+        published = [
+            output_path(name)
+            for name in (
+                "list.txt",
+                "list_raw.txt",
+                "list.yml",
+                "list.meta.yml",
+                "list.provider.yml",
+                "list.provider.meta.yml",
+                filtered_file,
+                delta.ids_file,
+                delta.delta_file,
+            )
+        ]
+        published += [
+            output_path("snippets", name)
+            for name in os.listdir(output_path("snippets"))
+            if name.endswith(".yml") and not name.startswith("_")
+        ]
+        manifest = output_path(PRECOMPRESS_MANIFEST)
+        try:
+            print(precompress_summary(precompress(published, manifest)))
+        except OSError:
+            print("失败！")
+            traceback.print_exc()
+        report.mark("compress")
+    report.finish()
+    return report
+
+
+def parse_stages(value: str) -> List[str]:
+    stages = [_.strip() for _ in value.split(",") if _.strip()]
+    for stage in stages:
+        if stage not in STAGES:
+            raise argparse.ArgumentTypeError(
+                f"未知的阶段 '{stage}'，可选：{','.join(STAGES)}"
+            )
+    return stages
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """命令行选项；未指定的选项沿用 local_* 标记文件和文件开头的常量"""
+    parser = argparse.ArgumentParser(
+        description="抓取、合并订阅并生成 V2Ray、Clash 及 Meta 订阅。"
+        "未指定的选项沿用 local_* 标记文件和文件开头的常量。"
+    )
+    bool_action = argparse.BooleanOptionalAction
+
+    group = parser.add_argument_group("阶段")
+    group.add_argument(
+        "--stages",
+        type=parse_stages,
+        default=",".join(default_stages()),
+        help=f"逗号分隔的阶段，可选 {','.join(STAGES)}；不含 fetch 时从快照载入节点，"
+        "不含 merge 时不解析、探测节点，不含 emit 时不写出任何文件"
+        "（默认：%(default)s）",
+    )
+    group.add_argument(
+        "--render-only",
+        action="store_true",
+        help="从快照重新生成所有输出，等同于从 --stages 中去掉 fetch 和 merge",
+    )
+
+    group = parser.add_argument_group("输入与输出")
+    group.add_argument(
+        "--output-dir", default=OUTPUT_DIR, help="输出文件所在的目录（默认：%(default)s）"
+    )
+    group.add_argument(
+        "--cache-dir",
+        default="local_cache",
+        help="域名解析、地区数据、动态链接和 GitHub API 的缓存（默认：%(default)s）",
+    )
+    group.add_argument(
+        "--snapshot", default=snapshot_file, help="节点快照文件（默认：%(default)s）"
+    )
+    group.add_argument(
+        "--proxy", default=PROXY, help="抓取时使用的代理（默认读取 local_proxy.conf）"
+    )
+    group.add_argument(
+        "--local",
+        action=bool_action,
+        default=LOCAL,
+        help="跳过 sources.list 中以 ! 开头的订阅（local_proxy.conf 为空时默认开启）",
+    )
+    group.add_argument(
+        "--subscriptions",
+        action=bool_action,
+        default=not DEBUG_NO_NODES,
+        help="抓取 sources.list 中的订阅（存在 local_NO_NODES 时默认关闭）",
+    )
+    group.add_argument(
+        "--dynamic",
+        action=bool_action,
+        default=not DEBUG_NO_DYNAMIC,
+        help="抓取动态节点（存在 local_NO_DYNAMIC 时默认关闭）",
+    )
+
+    group = parser.add_argument_group("并发与时限")
+    group.add_argument(
+        "--fetch-timeout",
+        type=float,
+        default=FETCH_TIMEOUT[1],
+        help="下载订阅的超时，以及等待每个订阅的间隔，秒（默认：%(default)s）",
+    )
+    group.add_argument(
+        "--fetch-tries",
+        type=int,
+        default=FETCH_TIMEOUT[0],
+        help="等待每个订阅的次数，超过后跳过（默认：%(default)s）",
+    )
+    group.add_argument(
+        "--airport-concurrency",
+        type=int,
+        default=AIRPORT_CONCURRENCY,
+        help="同时下载的机场列表数（默认：%(default)s）",
+    )
+    group.add_argument(
+        "--serialize-threshold",
+        type=int,
+        default=SERIALIZE_PARALLEL_THRESHOLD,
+        help="节点数达到此值时用多进程生成链接（默认：%(default)s）",
+    )
+    group.add_argument(
+        "--dedup-resolved",
+        action=bool_action,
+        default=DEDUP_RESOLVED,
+        help="合并服务器解析到同一 IP 的重复节点",
+    )
+    group.add_argument(
+        "--resolve-concurrency",
+        type=int,
+        default=RESOLVE_CONCURRENCY,
+        help="同时解析的域名数（默认：%(default)s）",
+    )
+    group.add_argument(
+        "--resolve-deadline",
+        type=float,
+        default=RESOLVE_DEADLINE,
+        help="解析所有域名的总时限，秒（默认：%(default)s）",
+    )
+    group.add_argument(
+        "--probe",
+        action=bool_action,
+        default=not DEBUG_NO_PROBE,
+        help="探测节点并丢弃无法连接的节点（存在 local_NO_PROBE 时默认关闭）",
+    )
+    group.add_argument(
+        "--probe-concurrency", type=int, help="同时探测的节点数（默认见 probe.py）"
+    )
+    group.add_argument(
+        "--probe-timeout", type=float, help="单个节点的探测超时，秒（默认见 probe.py）"
+    )
+    group.add_argument(
+        "--probe-deadline", type=float, help="探测所有节点的总时限，秒（默认见 probe.py）"
+    )
+    group.add_argument(
+        "--low-memory",
+        action=bool_action,
+        default=LOW_MEMORY,
+        help="解析后即丢弃订阅原文（存在 local_LOW_MEMORY 时默认开启）",
+    )
+
+    group = parser.add_argument_group("诊断")
+    group.add_argument(
+        "--memory-report",
+        action=bool_action,
+        default=MEMORY_REPORT,
+        help=f"用 tracemalloc 记录各阶段的内存并写入 {STAGE_REPORT_FILE}"
+        "（存在 local_MEMORY_REPORT 时默认开启）",
+    )
+    group.add_argument(
+        "--profile",
+        metavar="DIR",
+        default=PROFILE_DIR,
+        help="用 cProfile 分析主线程，每个阶段结束时保存为 DIR/序号_阶段.prof",
+    )
+    group.add_argument(
+        "--trace",
+        metavar="FILE",
+        default=TRACE_FILE,
+        help="把各阶段及各订阅的下载、合并耗时写成 Chrome trace 格式的时间线",
+    )
+    group.add_argument(
+        "--precompress",
+        action=bool_action,
+        default=PRECOMPRESS,
+        help="为发布的文件写出 .gz / .zst 副本",
+    )
+    return parser
+
+
+def apply_args(args: argparse.Namespace) -> List[str]:
+    """按命令行选项修改模块中的设置，返回要运行的阶段"""
+    global PROXY, LOCAL, DEBUG_NO_NODES, DEBUG_NO_DYNAMIC, DEBUG_NO_PROBE
+    global FETCH_TIMEOUT, AIRPORT_CONCURRENCY, SERIALIZE_PARALLEL_THRESHOLD
+    global DEDUP_RESOLVED, RESOLVE_CACHE, GEOIP_CACHE, LOW_MEMORY, MEMORY_REPORT
+    global PRECOMPRESS
+    global PROFILE_DIR, TRACE_FILE, OUTPUT_DIR, PROBE_OPTIONS, resolver, snapshot_file
+    PROXY = args.proxy or None
+    LOCAL = args.local
+    session.proxies = {"http": PROXY, "https": PROXY} if PROXY else {}
+    DEBUG_NO_NODES = not args.subscriptions
+    DEBUG_NO_DYNAMIC = not args.dynamic
+    DEBUG_NO_PROBE = not args.probe
+    FETCH_TIMEOUT = (args.fetch_tries, args.fetch_timeout)
+    AIRPORT_CONCURRENCY = args.airport_concurrency
+    SERIALIZE_PARALLEL_THRESHOLD = args.serialize_threshold
+    DEDUP_RESOLVED = args.dedup_resolved
+    LOW_MEMORY = args.low_memory
+    MEMORY_REPORT = args.memory_report
+    PRECOMPRESS = args.precompress
+    PROFILE_DIR = args.profile
+    TRACE_FILE = args.trace
+    OUTPUT_DIR = args.output_dir
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    snapshot_file = args.snapshot
+    RESOLVE_CACHE = os.path.join(args.cache_dir, "dns.json")
+    GEOIP_CACHE = os.path.join(args.cache_dir, "geoip")
+    resolver = Resolver(
+        concurrency=args.resolve_concurrency,
+        deadline=args.resolve_deadline,
+        cache_path=RESOLVE_CACHE,
+    )
+    PROBE_OPTIONS = {}
+    for key in ("concurrency", "timeout", "deadline"):
+        value = getattr(args, "probe_" + key)
+        if value is not None:
+            PROBE_OPTIONS[key] = value
+    stages: List[str] = args.stages
+    if args.render_only:
+        stages = [_ for _ in stages if _ not in ("fetch", "merge")]
+    return stages
 
 
 if __name__ == "__main__":
+    args = build_parser().parse_args()
+    stages = apply_args(args)
+    import dynamic  # type: ignore
     from dynamic import AUTOURLS, AUTOFETCH  # type: ignore
 
+    # dynamic.py 导入的是另一份 fetch 模块，需要同样应用命令行选项
+    dynamic.session.proxies = session.proxies
+    dynamic.LOCAL = LOCAL
+    dynamic.CACHE_DIR = os.path.join(args.cache_dir, "dynamic")
+    dynamic.github = dynamic.GitHubClient(
+        os.path.join(args.cache_dir, "github"), session=dynamic.session
+    )
+
     AUTOFUNTYPE = Callable[[], Union[str, List[str], Tuple[str], Set[str], None]]
     AUTOURL: List[AUTOFUNTYPE]
     AUTOFETCH: List[AUTOFUNTYPE]
-    main()
+    main(stages)
+    if dynamic.github.requests or dynamic.github.degraded:
+        print(dynamic.github.summary())
 
 
 """python
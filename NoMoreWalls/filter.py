@@ -1,123 +1,230 @@
+#!/usr/bin/env python3
+import os
+import re
 import yaml
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, TextIO, Tuple
+from snapshot import SnapshotError, load_proxies, snapshot_file
+
+try:
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper  # type: ignore
 
 source_file = "list.meta.yml"
 filtered_file = "list.filtered.meta.yaml"
+rules_file = "filter.yml"
+
+# 每次交给 YAML 解析/输出的节点数
+BATCH_SIZE = 512
+
+Proxy = Dict[str, Any]
+Predicate = Callable[[Proxy], bool]
+
+TOP_LEVEL_KEY = re.compile(r"^([^\s#'\"-][^:]*):(\s|$)")
 
-# 定义需要过滤掉的端口号列表
-# ports_to_filter = {
-#     443,
-#     2053,
-#     2083,
-#     2087,
-#     2096,
-#     8443,
-#     80,
-#     8080,
-#     8880,
-#     2052,
-#     2082,
-#     2086,
-#     2095,
-# }
-
-# 读取 YAML 文件
-with open(source_file, "r") as f:
-    data = yaml.safe_load(f)
-
-# 用于存储已出现的 (server, port) 和 (server, type) 组合
-seen_combinations = set()
-seen_server_type_combinations = set()
-
-# 遍历 proxies 数组，删除 port 属于 ports_to_filter 的项，同时去重
-filtered_proxies = []
-for proxy in data.get("proxies", []):
-    server = proxy.get("server")
-    port = proxy.get("port")
-    proxy_type = proxy.get("type")
-    network = proxy.get("network")
-
-    # 将 port 转换为整数进行比较（避免字符串 '2095' 和数字 2095 不匹配）
+
+def _as_int(value: Any) -> Optional[int]:
     try:
-        port = int(port)
+        return int(value)
     except (ValueError, TypeError):
-        continue  # 如果端口无法转换为数字，则跳过
-
-    # # 跳过要过滤的端口
-    # if port in ports_to_filter and proxy.get("network") == "ws":
-    #     continue
-
-    if proxy_type == "trojan":
-        continue
-
-    if network == "ws" and proxy_type == "vmess":
-        continue
-
-    if network == "ws" and proxy_type == "vless":
-        continue
-
-    # 去重 (server, port) 组合
-    if (server, port) in seen_combinations:
-        continue
-
-    if proxy.get("obfs") == "none":
-        continue
-
-    # # 去重 (server, type) 组合
-    # if (server, proxy_type) in seen_server_type_combinations:
-    #     continue
-
-    # 添加当前组合到对应的去重集合
-    seen_combinations.add((server, port))
-    # seen_server_type_combinations.add((server, proxy_type))
-
-    # 保留当前 proxy
-    filtered_proxies.append(proxy)
-
-# 将过滤和去重后的数据重新赋值给 data['proxies']
-data["proxies"] = filtered_proxies
-
-# 按照英文字母表顺序排序
-data["proxies"].sort(key=lambda x: x.get("type", ""))
-
-
-# 删除 proxy-groups 字段
-if "proxy-groups" in data:
-    del data["proxy-groups"]
-
-# 将处理后的数据写入新的文件，确保字符不被转义
-with open(filtered_file, "w") as f:
-    yaml.safe_dump(data, f, default_flow_style=False, allow_unicode=True)
-    # 追加内容到文件末尾
-    additional_content = """
-204Set: &204Set
-  url: "https://www.youtube.com/generate_204"
-  expected-status: 204
-  interval: 450
-  timeout: 10000
-  lazy: true
-
-groupsSet: &groupsSet
-  tfo: true
-  mptcp: true
-  tolerance: 40
-  max-failed-times: 2
-  <<: *204Set
-
-proxy-groups:
-  - name: PROXY
-    type: select
-    proxies:
-        - 🚀自动选择
-    include-all-proxies: true
-    <<: *groupsSet
-
-  - name: 🚀自动选择
-    type: url-test
-    include-all-proxies: true
-    <<: *groupsSet
+        return None
+
+
+def compile_condition(cond: Dict[str, Any]) -> Predicate:
+    """把 `{字段: 值或值列表}` 编译为判断函数，所有字段都匹配时返回 True"""
+    checks: List[Tuple[str, Set[Any]]] = []
+    for key, value in cond.items():
+        values = value if isinstance(value, list) else [value]
+        checks.append((key, set(values)))
+    if len(checks) == 1:
+        key, values = checks[0]
+        return lambda proxy: proxy.get(key) in values
+    return lambda proxy: all(proxy.get(k) in v for k, v in checks)
+
+
+class FilterEngine:
+    def __init__(self, rules: Dict[str, Any]) -> None:
+        self.exclude: List[Predicate] = [
+            compile_condition(cond) for cond in rules.get("exclude", [])
+        ]
+        self.require_int: List[str] = list(rules.get("require-int", []))
+        self.dedup: List[str] = list(rules.get("dedup", []))
+        self.sort: List[str] = list(rules.get("sort", []))
+        self.drop: Set[str] = set(rules.get("drop", []))
+        self.append: str = rules.get("append", "")
+
+    @classmethod
+    def load(cls, path: str = rules_file) -> "FilterEngine":
+        with open(path, encoding="utf-8") as f:
+            return cls(yaml.load(f, Loader=SafeLoader) or {})
+
+    def accepts(self, proxy: Proxy) -> bool:
+        for key in self.require_int:
+            if _as_int(proxy.get(key)) is None:
+                return False
+        for excluded in self.exclude:
+            if excluded(proxy):
+                return False
+        return True
+
+    def _dedup_key(self, proxy: Proxy) -> Tuple[Any, ...]:
+        key: List[Any] = []
+        for field in self.dedup:
+            value = proxy.get(field)
+            if field in self.require_int:
+                value = _as_int(value)
+            key.append(value)
+        return tuple(key)
+
+    def apply(self, proxies: Iterable[Proxy]) -> List[Proxy]:
+        """筛选、去重并排序节点"""
+        seen: Set[Tuple[Any, ...]] = set()
+        ret: List[Proxy] = []
+        for proxy in proxies:
+            if not self.accepts(proxy):
+                continue
+            if self.dedup:
+                key = self._dedup_key(proxy)
+                if key in seen:
+                    continue
+                seen.add(key)
+            ret.append(proxy)
+        if self.sort:
+            ret.sort(key=lambda p: tuple(str(p.get(k, "")) for k in self.sort))
+        return ret
+
+    def write_proxies(self, f: TextIO, proxies: List[Proxy]) -> None:
+        """分批写出 `proxies` 字段"""
+        if not proxies:
+            f.write("proxies: []\n")
+            return
+        f.write("proxies:\n")
+        for i in range(0, len(proxies), BATCH_SIZE):
+            # fetch.py 用 '!!str ' 前缀标记纯数字密码，与其输出保持一致
+            f.write(_dump(proxies[i : i + BATCH_SIZE]).replace("!!str ", ""))
+
+    def write_config(self, f: TextIO, conf: Dict[str, Any]) -> int:
+        """把内存中的配置筛选后写出，供 fetch.py 直接调用，返回保留的节点数"""
+        kept = 0
+        for key, value in conf.items():
+            if key in self.drop:
+                continue
+            if key == "proxies":
+                proxies = self.apply(value)
+                kept = len(proxies)
+                self.write_proxies(f, proxies)
+            else:
+                f.write(_dump({key: value}))
+        f.write(self.append)
+        return kept
+
+    def filter_file(
+        self, src: str, dst: str, proxies: Optional[List[Proxy]] = None
+    ) -> Tuple[int, int]:
+        """流式筛选 Clash 配置文件，只解析 `proxies` 字段，返回筛选前后的节点数
+
+        给出 `proxies`（如来自节点快照）时使用它代替文件中的节点，不再解析 YAML。
+        """
+        total = 0
+        kept = 0
+        with open(src, encoding="utf-8") as fin, open(dst, "w", encoding="utf-8") as fout:
+            for key, lines in iter_sections(fin):
+                if key in self.drop:
+                    for _ in lines:
+                        pass
+                    continue
+                if key != "proxies":
+                    fout.writelines(lines)
+                    continue
+                if proxies is None:
+                    parsed = list(iter_proxies(lines))
+                else:
+                    for _ in lines:
+                        pass
+                    parsed = proxies
+                total = len(parsed)
+                parsed = self.apply(parsed)
+                kept = len(parsed)
+                self.write_proxies(fout, parsed)
+            fout.write(self.append)
+        return total, kept
+
+
+def _dump(data: Any) -> str:
+    return yaml.dump(data, Dumper=SafeDumper, default_flow_style=False, allow_unicode=True)
+
+
+def iter_sections(f: Iterable[str]) -> Iterator[Tuple[Optional[str], Iterator[str]]]:
+    """按顶层字段切分 YAML 文件，产出 (字段名, 该字段的行)；字段名为 None 表示文件头部
+
+    每段的行必须在取下一段前消费完。
     """
+    lines = iter(f)
+    pending: List[Optional[str]] = [None]
+
+    def section(first_line: Optional[str]) -> Iterator[str]:
+        if first_line is not None:
+            yield first_line
+        for line in lines:
+            match = TOP_LEVEL_KEY.match(line)
+            if match:
+                pending[0] = line
+                return
+            yield line
+        pending[0] = None
+
+    yield None, section(None)
+    while pending[0] is not None:
+        first = pending[0]
+        pending[0] = None
+        match = TOP_LEVEL_KEY.match(first)
+        key = match.group(1).strip() if match else None
+        yield key, section(first)
+
+
+def iter_proxies(lines: Iterable[str]) -> Iterator[Proxy]:
+    """逐批解析 `proxies` 字段中的节点"""
+    lines = iter(lines)
+    head = next(lines, "")
+    inline = head.split(":", 1)[1].strip()
+    if inline:
+        # 'proxies: []' 或流式写法
+        yield from yaml.load(inline, Loader=SafeLoader) or []
+        return
+
+    batch: List[str] = []
+    count = 0
+    for line in lines:
+        if line.startswith("-"):
+            if count >= BATCH_SIZE:
+                yield from yaml.load("".join(batch), Loader=SafeLoader) or []
+                batch = []
+                count = 0
+            count += 1
+        batch.append(line)
+    if batch:
+        yield from yaml.load("".join(batch), Loader=SafeLoader) or []
+
+
+def snapshot_proxies() -> Optional[List[Proxy]]:
+    """节点快照不比 source_file 旧时，返回其中的节点"""
+    try:
+        if os.path.getmtime(snapshot_file) < os.path.getmtime(source_file):
+            return None
+        return load_proxies(snapshot_file)
+    except (OSError, SnapshotError):
+        return None
+
+
+def main() -> None:
+    engine = FilterEngine.load(rules_file)
+    proxies = snapshot_proxies()
+    if proxies is not None:
+        print("使用节点快照，不再解析 " + source_file)
+    total, kept = engine.filter_file(source_file, filtered_file, proxies)
+    print(f"共 {total} 个节点，保留 {kept} 个。")
+    print("过滤、去重、保存到新文件 完成！")
 
-    with open(filtered_file, "a") as f:
-        f.write(additional_content)
 
-print("过滤、去重、保存到新文件 完成！")
+if __name__ == "__main__":
+    main()
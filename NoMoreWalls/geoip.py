@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""离线的 IP 地区查询
+
+从每行一个 CIDR 的地区表（如 ../mrs/cnIP.text）构建有序的区间索引，
+用二分查找得到 IP 所属地区；安装了 NumPy 时 IPv4 批量查询使用 `searchsorted`。
+可选地用 maxminddb 读取 mmdb 数据库（如 MetaCubeX 的 country.mmdb），作为地区表
+未覆盖时的后备。
+"""
+import bisect
+import ipaddress
+import socket
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # type: ignore
+
+try:
+    import maxminddb
+except ImportError:
+    maxminddb = None  # type: ignore
+
+MMDB_SUPPORTED = maxminddb is not None
+
+# 地区数据损坏（如下载到了错误页面）时可能抛出的异常
+DATA_ERRORS: Tuple[type, ...] = (OSError, ValueError)
+if maxminddb is not None:
+    DATA_ERRORS += (maxminddb.InvalidDatabaseError,)
+
+Interval = Tuple[int, int, str]
+
+
+def parse_ip(ip: str) -> Optional[Tuple[int, int]]:
+    """把 IP 字符串转换为 (版本, 整数)，不是 IP 时返回 None"""
+    ip = ip.strip("[]")
+    try:
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big")
+    except OSError:
+        pass
+    try:
+        return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), "big")
+    except OSError:
+        return None
+
+
+def read_table(path: str, region: str) -> Iterable[Tuple[int, Interval]]:
+    """读取地区表，产出 (IP 版本, (起始, 结束, 地区))，无法解析的行被忽略"""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            try:
+                net = ipaddress.ip_network(line, strict=False)
+            except ValueError:
+                continue
+            yield net.version, (
+                int(net.network_address),
+                int(net.broadcast_address),
+                region,
+            )
+
+
+def check_table(path: str) -> None:
+    """地区表中没有一行 CIDR 时抛出 ValueError"""
+    if next(iter(read_table(path, "")), None) is None:
+        raise ValueError(f"{path} 不是地区表")
+
+
+def check_mmdb(path: str) -> None:
+    """打开一次 mmdb，无效时抛出 DATA_ERRORS 中的异常；未安装 maxminddb 时不检查"""
+    if maxminddb is not None:
+        maxminddb.open_database(path).close()
+
+
+class RegionIndex:
+    def __init__(self, mmdb: Optional[str] = None) -> None:
+        self.intervals: Dict[int, List[Interval]] = {4: [], 6: []}
+        self.starts: Dict[int, List[int]] = {4: [], 6: []}
+        self.ends: Dict[int, List[int]] = {4: [], 6: []}
+        self.regions: Dict[int, List[str]] = {4: [], 6: []}
+        self._np: Dict[str, Any] = {}
+        self.reader: Any = None
+        if mmdb and maxminddb is not None:
+            self.reader = maxminddb.open_database(mmdb)
+
+    @classmethod
+    def load(cls, tables: Dict[str, str], mmdb: Optional[str] = None) -> "RegionIndex":
+        """从 {地区: 地区表路径} 构建索引"""
+        index = cls(mmdb)
+        for region, path in tables.items():
+            for version, interval in read_table(path, region):
+                index.intervals[version].append(interval)
+        index.build()
+        return index
+
+    def build(self) -> None:
+        """排序并消除重叠：区间重叠时，起始地址较小的区间优先"""
+        for version, intervals in self.intervals.items():
+            intervals.sort()
+            starts: List[int] = []
+            ends: List[int] = []
+            regions: List[str] = []
+            for start, end, region in intervals:
+                if ends and start <= ends[-1]:
+                    start = ends[-1] + 1
+                    if start > end:
+                        continue
+                if ends and regions[-1] == region and start == ends[-1] + 1:
+                    ends[-1] = end
+                    continue
+                starts.append(start)
+                ends.append(end)
+                regions.append(region)
+            self.starts[version] = starts
+            self.ends[version] = ends
+            self.regions[version] = regions
+        if np is not None:
+            self._np = {
+                "starts": np.array(self.starts[4], dtype=np.uint32),
+                "ends": np.array(self.ends[4], dtype=np.uint32),
+                "regions": np.array(self.regions[4] + [""], dtype=object),
+            }
+
+    def __len__(self) -> int:
+        return len(self.starts[4]) + len(self.starts[6])
+
+    def _lookup_int(self, version: int, value: int) -> Optional[str]:
+        i = bisect.bisect_right(self.starts[version], value) - 1
+        if i >= 0 and value <= self.ends[version][i]:
+            return self.regions[version][i]
+        return None
+
+    def _lookup_mmdb(self, ip: str) -> Optional[str]:
+        if self.reader is None:
+            return None
+        try:
+            record = self.reader.get(ip)
+        except ValueError:
+            return None
+        if not record:
+            return None
+        country = record.get("country") or record.get("registered_country") or {}
+        return country.get("iso_code")
+
+    def lookup(self, ip: str) -> Optional[str]:
+        """查询单个 IP 的地区，不是 IP 或未收录时返回 None"""
+        key = parse_ip(ip)
+        if key is None:
+            return None
+        return self._lookup_int(*key) or self._lookup_mmdb(ip.strip("[]"))
+
+    def lookup_many(self, ips: List[str]) -> List[Optional[str]]:
+        """批量查询，结果与输入一一对应"""
+        keys = [parse_ip(ip) for ip in ips]
+        ret: List[Optional[str]] = [None] * len(keys)
+        done = set()
+        if self._np and len(self._np["starts"]):
+            v4 = [i for i, k in enumerate(keys) if k is not None and k[0] == 4]
+            values = np.array([keys[i][1] for i in v4], dtype=np.uint32)  # type: ignore
+            pos = np.searchsorted(self._np["starts"], values, side="right") - 1
+            hit = (pos >= 0) & (values <= self._np["ends"][np.maximum(pos, 0)])
+            pos[~hit] = -1
+            for i, region in zip(v4, self._np["regions"][pos]):
+                ret[i] = region or None
+            done = set(v4)
+        for i, key in enumerate(keys):
+            if key is None:
+                continue
+            if i not in done:
+                ret[i] = self._lookup_int(*key)
+            if ret[i] is None and self.reader is not None:
+                ret[i] = self._lookup_mmdb(ips[i].strip("[]"))
+        return ret
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    begin = time.perf_counter()
+    index = RegionIndex.load({"CN": sys.argv[1] if len(sys.argv) > 1 else "../mrs/cnIP.text"})
+    print(f"载入 {len(index)} 个区间，耗时 {(time.perf_counter() - begin) * 1000:.1f}ms")
+    for ip in sys.argv[2:]:
+        print(ip, index.lookup(ip))
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""GitHub API 客户端
+
+mrs/ghclient.py 是指向本文件的符号链接，两个工具都按同目录的模块导入，只需维护这一份。
+
+- 用 ETag / Last-Modified 发送条件请求，返回 304 时不消耗速率限制；
+- 响应缓存在本地，额度用完或请求失败时退回到缓存；
+- 根据 X-RateLimit-* 响应头记录剩余额度，并保存到缓存目录供下次运行使用；
+- 设置了 GITHUB_TOKEN 环境变量时带上令牌。
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple, Type
+
+import requests
+
+API_URL = "https://api.github.com"
+# 为其他用途保留的额度，剩余额度不高于此值时不再发出新请求
+RATE_RESERVE = 5
+REQUEST_TIMEOUT = 10.0
+REQUEST_ERRORS: Tuple[Type[BaseException], ...] = (requests.exceptions.RequestException,)
+
+
+class RateLimitExhausted(requests.exceptions.RequestException):
+    """额度已用完且没有可用的缓存，按一般的请求失败处理"""
+
+    def __init__(self, url: str, reset: float) -> None:
+        wait = max(int(reset - time.time()), 0)
+        super().__init__(f"GitHub API 额度已用完（{wait}s 后重置）：{url}")
+        self.url = url
+        self.reset = reset
+
+
+class GitHubClient:
+    def __init__(
+        self,
+        cache_dir: str,
+        session: Optional[requests.Session] = None,
+        token: Optional[str] = None,
+        api_url: str = API_URL,
+        reserve: int = RATE_RESERVE,
+        timeout: float = REQUEST_TIMEOUT,
+        warn: Callable[[str], Any] = print,
+        send: Optional[Callable[..., Any]] = None,
+        errors: Tuple[Type[BaseException], ...] = REQUEST_ERRORS,
+    ) -> None:
+        self.cache_dir = cache_dir
+        self.session = session or requests.Session()
+        # 发出请求的函数，调用方式同 session.get(url, headers=, timeout=)，
+        # 可以换成带重试和熔断的传输层；`errors` 是它在请求失败时抛出的异常
+        self.send: Callable[..., Any] = send or self.session.get
+        self.errors = errors
+        self.token = token if token is not None else os.environ.get("GITHUB_TOKEN", "")
+        self.api_url = api_url.rstrip("/")
+        self.reserve = reserve
+        self.timeout = timeout
+        self.warn = warn
+        self.lock = threading.Lock()
+        # 剩余额度为 None 表示还未收到过速率限制响应头
+        self.remaining: Optional[int] = None
+        self.reset = 0.0
+        self.inflight = 0
+        # 统计：实际请求数、304 数、额度不足或请求失败时使用缓存的次数，在 lock 内更新
+        self.requests = 0
+        self.not_modified = 0
+        self.degraded = 0
+        self._load_rate()
+
+    # 速率限制
+
+    def _rate_path(self) -> str:
+        return os.path.join(self.cache_dir, "rate.json")
+
+    def _load_rate(self) -> None:
+        try:
+            with open(self._rate_path(), encoding="utf-8") as f:
+                rate = json.load(f)
+            if rate["reset"] > time.time():
+                self.remaining = int(rate["remaining"])
+                self.reset = float(rate["reset"])
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def _save_rate(self) -> None:
+        self._write_json(
+            self._rate_path(), {"remaining": self.remaining, "reset": self.reset}
+        )
+
+    def _update_rate(self, headers: Any) -> None:
+        remaining = headers.get("X-RateLimit-Remaining")
+        if remaining is None:
+            return
+        try:
+            remaining = int(remaining)
+            reset = float(headers.get("X-RateLimit-Reset") or 0)
+        except ValueError:
+            return
+        with self.lock:
+            if reset != self.reset or self.remaining is None:
+                self.remaining = remaining
+            else:
+                # 并发请求的响应可能乱序到达
+                self.remaining = min(self.remaining, remaining)
+            self.reset = reset
+        self._save_rate()
+
+    def budget(self) -> Optional[int]:
+        """当前还能发出的请求数，None 表示未知"""
+        with self.lock:
+            if self.remaining is None:
+                return None
+            if self.reset and self.reset <= time.time():
+                self.remaining = None
+                return None
+            return max(self.remaining - self.inflight - self.reserve, 0)
+
+    def summary(self) -> str:
+        with self.lock:
+            text = (
+                f"GitHub API：请求 {self.requests} 次，未修改 {self.not_modified} 次，"
+                f"使用缓存 {self.degraded} 次"
+            )
+            if self.remaining is not None:
+                text += f"，剩余额度 {self.remaining}"
+        return text
+
+    def _acquire(self) -> bool:
+        with self.lock:
+            if self.remaining is not None and self.reset > time.time():
+                if self.remaining - self.inflight <= self.reserve:
+                    return False
+            self.inflight += 1
+            return True
+
+    def _release(self) -> None:
+        with self.lock:
+            self.inflight -= 1
+
+    # 缓存
+
+    def _cache_path(self, url: str) -> str:
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def _load(self, url: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._cache_path(url), encoding="utf-8") as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return cached if isinstance(cached, dict) and "body" in cached else None
+
+    def _write_json(self, path: str, data: Any) -> None:
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+    # 请求
+
+    def url(self, path: str) -> str:
+        if "://" in path:
+            return path
+        return self.api_url + "/" + path.lstrip("/")
+
+    def get_json(
+        self, path: str, max_age: float = 0, timeout: Optional[float] = None
+    ) -> Any:
+        """请求 API 并返回解析后的 JSON
+
+        缓存不超过 max_age 秒时不发请求；额度不足或请求失败时返回缓存，
+        没有缓存时分别抛出 RateLimitExhausted 或原来的异常。
+        """
+        url = self.url(path)
+        cached = self._load(url)
+        if cached and time.time() - cached.get("time", 0) < max_age:
+            return cached["body"]
+        if not self._acquire():
+            if cached is None:
+                raise RateLimitExhausted(url, self.reset)
+            with self.lock:
+                self.degraded += 1
+            self.warn(f"GitHub API 额度不足，使用缓存：{url}")
+            return cached["body"]
+
+        headers = {"Accept": "application/vnd.github+json"}
+        if self.token:
+            headers["Authorization"] = "Bearer " + self.token
+        if cached:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+        with self.lock:
+            self.requests += 1
+        try:
+            res = self.send(url, headers=headers, timeout=timeout or self.timeout)
+        except self.errors as e:
+            if cached is None:
+                raise
+            with self.lock:
+                self.degraded += 1
+            self.warn(f"GitHub API 请求失败（{type(e).__name__}），使用缓存：{url}")
+            return cached["body"]
+        finally:
+            self._release()
+        self._update_rate(res.headers)
+
+        if res.status_code == 304 and cached:
+            with self.lock:
+                self.not_modified += 1
+            cached["time"] = time.time()
+            self._write_json(self._cache_path(url), cached)
+            return cached["body"]
+        if res.status_code in (403, 429) and self._limited(res):
+            if cached is None:
+                raise RateLimitExhausted(url, self.reset)
+            with self.lock:
+                self.degraded += 1
+            self.warn(f"GitHub API 触发速率限制，使用缓存：{url}")
+            return cached["body"]
+        res.raise_for_status()
+        body = res.json()
+        self._write_json(
+            self._cache_path(url),
+            {
+                "time": time.time(),
+                "etag": res.headers.get("ETag", ""),
+                "last_modified": res.headers.get("Last-Modified", ""),
+                "body": body,
+            },
+        )
+        return body
+
+    def _limited(self, res: requests.Response) -> bool:
+        """判断 403/429 是否由速率限制引起，是则记下恢复时间"""
+        retry_after = res.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            with self.lock:
+                self.remaining = 0
+                self.reset = max(self.reset, time.time() + int(retry_after))
+            self._save_rate()
+            return True
+        return res.headers.get("X-RateLimit-Remaining") == "0"
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""为发布的文件写出预压缩的 .gz（以及安装了 zstandard 时的 .zst）副本
+
+压缩在线程池中并行进行（zlib 和 zstandard 压缩时都会释放 GIL）。清单文件记录每个文件的
+sha256，内容未变化且副本齐全时跳过；.gz 的 mtime 固定为 0，相同内容总是得到相同的文件。
+
+mrs/precompress.py 是指向本文件的符号链接，两个工具都按同目录的模块导入。
+"""
+import gzip
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # type: ignore
+
+GZIP_LEVEL = 9
+ZSTD_LEVEL = 19
+
+
+class Compressed(NamedTuple):
+    path: str
+    sha256: str
+    size: int
+    gz_size: int
+    zst_size: Optional[int]
+    seconds: float
+    # 内容未变化，沿用已有的副本
+    skipped: bool
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _compress(path: str, entry: Optional[Dict[str, Any]], level: int) -> Compressed:
+    start = time.perf_counter()
+    with open(path, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    variants_exist = os.path.exists(path + ".gz") and (
+        zstandard is None or os.path.exists(path + ".zst")
+    )
+    if entry and entry.get("sha256") == digest and variants_exist:
+        return Compressed(path, digest, len(data), entry["gz"], entry.get("zst"), 0.0, True)
+    gz = gzip.compress(data, compresslevel=level, mtime=0)
+    _write_atomic(path + ".gz", gz)
+    zst_size = None
+    if zstandard is not None:
+        zst = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+        _write_atomic(path + ".zst", zst)
+        zst_size = len(zst)
+    elapsed = time.perf_counter() - start
+    return Compressed(path, digest, len(data), len(gz), zst_size, elapsed, False)
+
+
+def precompress(
+    paths: Iterable[str],
+    manifest: str,
+    workers: Optional[int] = None,
+    level: int = GZIP_LEVEL,
+    warn: Callable[[str], Any] = print,
+) -> List[Compressed]:
+    """压缩 `paths` 中存在的文件，并更新清单；单个文件失败不影响其他文件"""
+    try:
+        with open(manifest, encoding="utf-8") as f:
+            entries: Dict[str, Dict[str, Any]] = json.load(f)
+    except (OSError, ValueError):
+        entries = {}
+    base = os.path.dirname(os.path.abspath(manifest))
+    paths = sorted({p for p in paths if os.path.isfile(p)})
+    keys = {p: os.path.relpath(os.path.abspath(p), base).replace(os.sep, "/") for p in paths}
+
+    results: List[Compressed] = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            (p, executor.submit(_compress, p, entries.get(keys[p]), level))
+            for p in paths
+        ]
+        for p, future in futures:
+            try:
+                results.append(future.result())
+            except OSError as e:
+                warn(f"压缩 {p} 失败：{e}")
+
+    for r in results:
+        if r.skipped:
+            continue
+        entries[keys[r.path]] = {
+            "sha256": r.sha256,
+            "size": r.size,
+            "gz": r.gz_size,
+            "zst": r.zst_size,
+            "seconds": round(r.seconds, 3),
+        }
+    with open(manifest, "w", encoding="utf-8") as f:
+        json.dump(entries, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write("\n")
+    return results
+
+
+def summary(results: List[Compressed]) -> str:
+    """一行概要：压缩的文件数、体积变化和耗时"""
+    done = [r for r in results if not r.skipped]
+    size = sum(r.size for r in results)
+    gz = sum(r.gz_size for r in results)
+    text = f"{len(done)} 个文件已压缩，{len(results) - len(done)} 个未变化"
+    if size:
+        text += f"；{size / 1048576:.2f} MiB -> gz {gz / 1048576:.2f} MiB（{gz / size:.1%}）"
+        zst = [r.zst_size for r in results if r.zst_size is not None]
+        if len(zst) == len(results):
+            text += f"，zst {sum(zst) / 1048576:.2f} MiB（{sum(zst) / size:.1%}）"
+    return text + f"，耗时 {sum(r.seconds for r in done):.2f}s"
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 3:
+        print(f"用法：{sys.argv[0]} 清单文件 文件...")
+        sys.exit(1)
+    print(summary(precompress(sys.argv[2:], sys.argv[1])))
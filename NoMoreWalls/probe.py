@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+import asyncio
+import ssl
+import time
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+# 单个节点的连接超时（秒）
+PROBE_TIMEOUT = 3.0
+# 同时进行的探测数
+PROBE_CONCURRENCY = 1000
+# 同一主机同时进行的探测数，以及同一主机两次探测开始的最小间隔（秒）
+PROBE_PER_HOST = 4
+PROBE_HOST_INTERVAL = 0.05
+# 整个探测阶段的截止时间（秒），到时未完成的节点视为未知
+PROBE_DEADLINE = 60.0
+
+# 基于 UDP 的协议无法用 TCP 探测
+UDP_TYPES = {"hysteria", "hysteria2", "tuic", "wireguard"}
+
+Target = Tuple[str, int, Optional[str]]
+Connector = Callable[..., Awaitable[Tuple[asyncio.StreamReader, asyncio.StreamWriter]]]
+
+
+class ProbeResult(NamedTuple):
+    # True 存活，False 无法连接，None 未探测或超过截止时间
+    alive: Optional[bool]
+    # TCP 连接（及 TLS 握手）耗时，毫秒
+    latency: Optional[float] = None
+    error: str = ""
+
+
+UNKNOWN = ProbeResult(None)
+
+
+def probe_target(data: Dict[str, Any]) -> Optional[Target]:
+    """从 Clash 格式的节点数据得到 (服务器, 端口, SNI)，SNI 为 None 表示只做 TCP 连接"""
+    if data.get("type") in UDP_TYPES:
+        return None
+    try:
+        server = str(data["server"]).strip("[]")
+        port = int(str(data["port"]))
+    except (KeyError, ValueError):
+        return None
+    if not server or not 0 < port < 65536:
+        return None
+    tls = data.get("type") == "trojan" or bool(data.get("tls"))
+    if not tls:
+        return server, port, None
+    sni = data.get("sni") or data.get("servername") or server
+    return server, port, str(sni)
+
+
+class Prober:
+    def __init__(
+        self,
+        timeout: float = PROBE_TIMEOUT,
+        concurrency: int = PROBE_CONCURRENCY,
+        per_host: int = PROBE_PER_HOST,
+        host_interval: float = PROBE_HOST_INTERVAL,
+        deadline: float = PROBE_DEADLINE,
+        connect: Optional[Connector] = None,
+    ) -> None:
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.host_interval = host_interval
+        self.deadline = deadline
+        self.connect: Connector = connect or asyncio.open_connection
+        # 节点多为自签证书，只关心握手能否完成
+        self.ssl_context = ssl.create_default_context()
+        self.ssl_context.check_hostname = False
+        self.ssl_context.verify_mode = ssl.CERT_NONE
+
+    async def _wait_host_slot(self, host: str, next_start: Dict[str, float]) -> None:
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        start = max(now, next_start.get(host, now))
+        next_start[host] = start + self.host_interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    async def _probe(
+        self,
+        target: Target,
+        limit: asyncio.Semaphore,
+        host_limits: Dict[str, asyncio.Semaphore],
+        next_start: Dict[str, float],
+    ) -> ProbeResult:
+        host, port, sni = target
+        host_limit = host_limits.setdefault(host, asyncio.Semaphore(self.per_host))
+        # 先排队等待主机的名额和间隔，再占用全局名额，等待同一主机的任务不占用全局名额
+        async with host_limit:
+            await self._wait_host_slot(host, next_start)
+            async with limit:
+                start = time.perf_counter()
+                try:
+                    if sni is None:
+                        coro = self.connect(host, port)
+                    else:
+                        coro = self.connect(
+                            host, port, ssl=self.ssl_context, server_hostname=sni
+                        )
+                    _, writer = await asyncio.wait_for(coro, self.timeout)
+                except asyncio.TimeoutError:
+                    return ProbeResult(False, error="timeout")
+                except (OSError, ssl.SSLError, EOFError) as e:
+                    return ProbeResult(False, error=type(e).__name__)
+                except ValueError as e:
+                    # 服务器或 SNI 无法按 IDNA 编码（UnicodeError）、SNI 以点开头等
+                    return ProbeResult(False, error=type(e).__name__)
+                latency = (time.perf_counter() - start) * 1000
+                writer.close()
+                try:
+                    await asyncio.wait_for(writer.wait_closed(), 1)
+                except (asyncio.TimeoutError, OSError, ssl.SSLError):
+                    pass
+                return ProbeResult(True, latency)
+
+    async def probe_targets(self, targets: List[Target]) -> Dict[Target, ProbeResult]:
+        """并发探测去重后的目标，超过截止时间的目标不出现在结果中"""
+        limit = asyncio.Semaphore(self.concurrency)
+        host_limits: Dict[str, asyncio.Semaphore] = {}
+        next_start: Dict[str, float] = {}
+        tasks = {
+            asyncio.ensure_future(self._probe(t, limit, host_limits, next_start)): t
+            for t in set(targets)
+        }
+        if not tasks:
+            return {}
+        done, pending = await asyncio.wait(tasks, timeout=self.deadline)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        results: Dict[Target, ProbeResult] = {}
+        for task in done:
+            if task.cancelled():
+                continue
+            e = task.exception()
+            # 单个目标的意外错误不应中断整个探测阶段
+            results[tasks[task]] = UNKNOWN._replace(error=repr(e)) if e else task.result()
+        return results
+
+    def probe(self, datas: List[Dict[str, Any]]) -> List[ProbeResult]:
+        """探测一组 Clash 格式的节点，结果与输入一一对应"""
+        targets = [probe_target(data) for data in datas]
+        results = asyncio.run(self.probe_targets([t for t in targets if t]))
+        return [results.get(t, UNKNOWN) if t else UNKNOWN for t in targets]
+
+
+if __name__ == "__main__":
+    import sys
+    import yaml
+
+    with open(sys.argv[1] if len(sys.argv) > 1 else "list.meta.yml", encoding="utf-8") as f:
+        proxies: List[Dict[str, Any]] = yaml.safe_load(f)["proxies"]
+    begin = time.perf_counter()
+    results = Prober().probe(proxies)
+    alive = [r for r in results if r.alive]
+    dead = [r for r in results if r.alive is False]
+    print(
+        f"共 {len(results)} 个节点，{len(alive)} 个存活，{len(dead)} 个无法连接，"
+        f"{len(results) - len(alive) - len(dead)} 个未知，耗时 {time.perf_counter() - begin:.1f}s"
+    )
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""把节点服务器的域名解析为 IP
+
+每个域名只解析一次：结果带有效期缓存在内存中，指定 cache_path 时也保存到磁盘，
+有效期内的下次运行直接使用。解析在 asyncio 中并发进行，并限制同时进行的数量。
+"""
+import asyncio
+import json
+import os
+import socket
+import time
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from geoip import parse_ip
+
+# 同时进行的解析数
+RESOLVE_CONCURRENCY = 64
+# 单个域名的解析超时，以及整个解析阶段的截止时间（秒）
+RESOLVE_TIMEOUT = 5.0
+RESOLVE_DEADLINE = 30.0
+# 解析结果的有效期（秒），解析失败的结果有效期较短
+RESOLVE_TTL = 3600.0
+RESOLVE_NEGATIVE_TTL = 300.0
+
+Lookup = Callable[[str], Awaitable[Optional[str]]]
+
+
+async def system_lookup(host: str) -> Optional[str]:
+    """用系统解析器取第一个地址"""
+    loop = asyncio.get_running_loop()
+    try:
+        infos = await loop.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+    except (OSError, UnicodeError):
+        return None
+    return str(infos[0][4][0]) if infos else None
+
+
+class Resolver:
+    def __init__(
+        self,
+        concurrency: int = RESOLVE_CONCURRENCY,
+        timeout: float = RESOLVE_TIMEOUT,
+        deadline: float = RESOLVE_DEADLINE,
+        ttl: float = RESOLVE_TTL,
+        negative_ttl: float = RESOLVE_NEGATIVE_TTL,
+        lookup: Optional[Lookup] = None,
+        cache_path: Optional[str] = None,
+    ) -> None:
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.deadline = deadline
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # 测试时可以换成查询本地桩服务的函数
+        self.lookup: Lookup = lookup or system_lookup
+        self.cache_path = cache_path
+        # 域名 -> (IP 或 None, 过期时间)
+        self.cache: Dict[str, Tuple[Optional[str], float]] = {}
+        # 统计：实际查询数、缓存命中数
+        self.queries = 0
+        self.hits = 0
+        self._load()
+
+    def _load(self) -> None:
+        if not self.cache_path:
+            return
+        try:
+            with open(self.cache_path, encoding="utf-8") as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        for host, (ip, expires) in cache.items():
+            if expires > now:
+                self.cache[host] = (ip, expires)
+
+    def save(self) -> None:
+        if not self.cache_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+            tmp = self.cache_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.cache, f)
+            os.replace(tmp, self.cache_path)
+        except OSError:
+            pass
+
+    def cached(self, host: str) -> Tuple[bool, Optional[str]]:
+        """返回 (是否命中, IP)；host 本身是 IP 时视为命中"""
+        host = host.strip("[]")
+        if parse_ip(host) is not None:
+            return True, host
+        entry = self.cache.get(host)
+        if entry and entry[1] > time.time():
+            return True, entry[0]
+        return False, None
+
+    async def _resolve(self, host: str, limit: asyncio.Semaphore) -> None:
+        async with limit:
+            self.queries += 1
+            try:
+                ip = await asyncio.wait_for(self.lookup(host), self.timeout)
+            except asyncio.TimeoutError:
+                ip = None
+            ttl = self.ttl if ip else self.negative_ttl
+            self.cache[host] = (ip, time.time() + ttl)
+
+    async def resolve_all(self, hosts: Iterable[str]) -> Dict[str, Optional[str]]:
+        """并发解析去重后的域名，超过截止时间未完成的结果为 None"""
+        hosts = {h for h in hosts if h}
+        pending = set()
+        for host in hosts:
+            hit, _ = self.cached(host)
+            if hit:
+                self.hits += 1
+            else:
+                pending.add(host.strip("[]"))
+        if pending:
+            limit = asyncio.Semaphore(self.concurrency)
+            tasks = [asyncio.ensure_future(self._resolve(h, limit)) for h in pending]
+            _, late = await asyncio.wait(tasks, timeout=self.deadline)
+            for task in late:
+                task.cancel()
+            if late:
+                await asyncio.gather(*late, return_exceptions=True)
+        return {host: self.cached(host)[1] for host in hosts}
+
+    def resolve_many(self, hosts: Iterable[str]) -> Dict[str, Optional[str]]:
+        return asyncio.run(self.resolve_all(hosts))
+
+    def resolve(self, host: str) -> Optional[str]:
+        return self.resolve_many([host]).get(host)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""合并后节点集的二进制快照
+
+fetch.py 在每次运行结束时写出快照，其中包括：
+- 合并、探测后，加上来源序号之前的节点状态（`state`），供 `fetch.py --render-only`
+  在修改 config.yml、snippets/_config.yml 或筛选规则后直接重新生成所有输出；
+- 最终写入 list.meta.yml 的节点（`proxies`），供 filter.py 等使用者代替解析 YAML。
+
+文件格式：MAGIC、快照版本和 marshal 版本（各两字节，小端），之后是 zlib 压缩的
+marshal 数据。marshal 格式可能随 Python 版本变化，版本不符时抛出 SnapshotError。
+"""
+import marshal
+import os
+import struct
+import time
+import zlib
+from typing import Any, Dict, List
+
+snapshot_file = "local_snapshot.bin"
+
+MAGIC = b"NMWSNAP"
+SNAPSHOT_VERSION = 1
+HEADER = struct.Struct("<HH")
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def dumps(data: Dict[str, Any], level: int = 6) -> bytes:
+    body = zlib.compress(marshal.dumps(data), level)
+    return MAGIC + HEADER.pack(SNAPSHOT_VERSION, marshal.version) + body
+
+
+def loads(raw: bytes) -> Dict[str, Any]:
+    if not raw.startswith(MAGIC):
+        raise SnapshotError("不是节点快照")
+    version, marshal_version = HEADER.unpack_from(raw, len(MAGIC))
+    if version != SNAPSHOT_VERSION:
+        raise SnapshotError(f"快照版本 {version} 与当前版本 {SNAPSHOT_VERSION} 不符")
+    if marshal_version != marshal.version:
+        raise SnapshotError(f"快照由另一版本的 Python 写出（marshal {marshal_version}）")
+    try:
+        return marshal.loads(zlib.decompress(raw[len(MAGIC) + HEADER.size :]))
+    except (zlib.error, ValueError, EOFError, TypeError) as e:
+        raise SnapshotError(f"快照已损坏：{e}") from e
+
+
+def save(path: str, state: Dict[str, Any], proxies: List[Dict[str, Any]]) -> int:
+    """写出快照，返回文件大小"""
+    raw = dumps({"created": time.time(), "state": state, "proxies": proxies})
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(raw)
+    os.replace(tmp, path)
+    return len(raw)
+
+
+def load(path: str = snapshot_file) -> Dict[str, Any]:
+    with open(path, "rb") as f:
+        return loads(f.read())
+
+
+def load_proxies(path: str = snapshot_file) -> List[Dict[str, Any]]:
+    """读取快照中写入 list.meta.yml 的节点"""
+    return load(path)["proxies"]
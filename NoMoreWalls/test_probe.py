@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+import asyncio
+import socket
+import unittest
+
+from probe import Prober
+
+
+class ProbeTest(unittest.TestCase):
+    def setUp(self) -> None:
+        # 只监听不 accept，TCP 连接由内核的积压队列完成
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(16)
+        self.port = self.listener.getsockname()[1]
+
+    def tearDown(self) -> None:
+        self.listener.close()
+
+    def test_malformed_hosts(self) -> None:
+        datas = [
+            {"type": "ss", "server": "127.0.0.1", "port": self.port},
+            # 标签超过 63 字节，IDNA 编码失败
+            {"type": "ss", "server": "a" * 70 + ".com", "port": self.port},
+            # SNI 以点开头，同样无法编码
+            {"type": "trojan", "server": "127.0.0.1", "port": self.port, "sni": ".bad"},
+        ]
+        results = Prober(timeout=2, deadline=5).probe(datas)
+        self.assertIs(results[0].alive, True)
+        for result in results[1:]:
+            self.assertIs(result.alive, False)
+            self.assertEqual(result.error, "UnicodeError")
+
+    def test_busy_host_does_not_block_others(self) -> None:
+        class Writer:
+            def close(self) -> None:
+                pass
+
+            async def wait_closed(self) -> None:
+                pass
+
+        async def connect(host, port, **kwargs):
+            await asyncio.sleep(0.2)
+            return None, Writer()
+
+        busy = [{"type": "ss", "server": "busy", "port": p} for p in range(1, 201)]
+        others = [{"type": "ss", "server": f"h{i}", "port": 1} for i in range(50)]
+        prober = Prober(concurrency=20, per_host=2, deadline=3, connect=connect)
+        results = prober.probe(busy + others)
+        # 同一主机排队的节点不占用全局名额，其他主机的节点都能在截止时间前完成
+        self.assertTrue(all(r.alive for r in results[len(busy) :]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""NoMoreWalls/fetch.py 与 mrs/start.py 热点函数的微基准测试和回归检查
+
+用固定种子生成的合成语料测量各函数，每项运行若干轮（每轮前的准备工作不计时），
+取最短耗时。各项轮流测量多次，每次的耗时除以紧随其后测得的校准项耗时，以抵消机器
+整体的快慢变化，再取各次的中位数与基准文件比较；任何一项比基准慢超过阈值时以状态码
+1 退出。两个工具的项目分别在单独的子进程中运行。例如：
+
+    python bench_micro.py                 # 与 bench_micro.baseline.json 比较
+    python bench_micro.py --update        # 在当前机器上重新记录基准
+    python bench_micro.py -k load_url -k DomainTree --threshold 0.8
+
+基准与机器有关，仓库中的基准文件只适用于记录它的机器。在 CI 中把它作为门禁前，
+须先在 CI 自己的运行器上对基准提交运行 `--update` 重新记录，再用同一运行器比较；
+运行器换了型号或 Python 版本时同样要重新记录。
+"""
+import argparse
+import base64
+import contextlib
+import gc
+import importlib.util
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import ModuleType, SimpleNamespace
+from typing import Any, Callable, Dict, List, NamedTuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+NMW_DIR = os.path.join(HERE, "NoMoreWalls")
+MRS_DIR = os.path.join(HERE, "mrs")
+BASELINE_FILE = os.path.join(HERE, "bench_micro.baseline.json")
+
+# 允许的变慢比例
+THRESHOLD = 0.5
+ROUNDS = 7
+MIN_TIME = 0.5
+MAX_ROUNDS = 50
+# 每项测量的次数，取各次换算后耗时的中位数
+RUNS = 5
+SEED = 20240601
+
+NODES_PER_SCHEME = 400
+DOMAINS = 20000
+RULE_LINES = 20000
+
+
+class Bench(NamedTuple):
+    name: str
+    # 每轮运行前调用，返回值传给 run，不计入耗时
+    setup: Callable[[], Any]
+    run: Callable[[Any], Any]
+
+
+def load_module(path: str, name: str) -> ModuleType:
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)  # type: ignore
+    sys.modules[name] = module
+    spec.loader.exec_module(module)  # type: ignore
+    return module
+
+
+def _domain(rng: random.Random) -> str:
+    labels = [
+        "".join(rng.choice("abcdefghijklmnopqrstuvwxyz0123456789") for _ in range(rng.randint(3, 10)))
+        for _ in range(rng.randint(1, 3))
+    ]
+    return ".".join(labels) + "." + rng.choice(("com", "net", "org", "cn", "io"))
+
+
+class FakeResponse:
+    """只实现 `iter_content` 的响应对象"""
+
+    def __init__(self, body: bytes) -> None:
+        self.body = body
+
+    def iter_content(self, chunk_size: int = 1):
+        view = memoryview(self.body)
+        for i in range(0, len(self.body), chunk_size):
+            yield bytes(view[i : i + chunk_size])
+
+
+def fetch_benches(workdir: str) -> List[Bench]:
+    # fetch.py 导入时读取当前目录下的 local_* 文件
+    sys.path.insert(0, NMW_DIR)
+    fetch = load_module(os.path.join(NMW_DIR, "fetch.py"), "fetch")
+    bench_fetch = load_module(os.path.join(NMW_DIR, "bench_fetch.py"), "bench_fetch")
+
+    links: Dict[str, List[str]] = {}
+    for i in range(NODES_PER_SCHEME * 6):
+        link, data = bench_fetch.make_node(SEED, i)
+        links.setdefault(data["type"], []).append(link)
+    all_links = [link for group in links.values() for link in group]
+    nodes = [fetch.Node(link) for link in all_links]
+
+    benches = [
+        Bench(f"fetch.Node.load_url[{scheme}]", lambda: None, lambda _, g=group: [fetch.Node(u) for u in g])
+        for scheme, group in sorted(links.items())
+    ]
+
+    def reset(attr: str) -> Callable[[], None]:
+        def setup() -> None:
+            for n in nodes:
+                setattr(n, attr, None)
+
+        return setup
+
+    benches += [
+        Bench("fetch.Node.__hash__", lambda: None, lambda _: [hash(n) for n in nodes]),
+        Bench("fetch.Node.url", reset("_url"), lambda _: [n.url for n in nodes]),
+        Bench("fetch.Node.clash_data", reset("_clash"), lambda _: [n.clash_data for n in nodes]),
+    ]
+
+    b64_body = base64.b64encode("\n".join(all_links * 4).encode("utf-8"))
+    spec = bench_fetch.SubSpec("clash-groups", list(range(NODES_PER_SCHEME * 6)), 0.0, 200, 0, 0.0)
+    yaml_body = bench_fetch.make_body(SEED, spec)
+
+    def download(body: bytes) -> Callable[[Any], Any]:
+        return lambda _: fetch.Source("bench://")._download(FakeResponse(body))
+
+    benches += [
+        Bench("fetch.Source._download[base64]", lambda: None, download(b64_body)),
+        Bench("fetch.Source._download[clash]", lambda: None, download(yaml_body)),
+    ]
+
+    rng = random.Random(SEED)
+    domains = [_domain(rng) for _ in range(DOMAINS)]
+    removed = rng.sample(domains, DOMAINS // 10)
+
+    def filled_tree() -> Any:
+        tree = fetch.DomainTree()
+        for d in domains:
+            tree.insert(d)
+        return tree
+
+    def insert(_: Any) -> None:
+        tree = fetch.DomainTree()
+        for d in domains:
+            tree.insert(d)
+
+    def remove(tree: Any) -> None:
+        for d in removed:
+            tree.remove(d)
+
+    benches += [
+        Bench("fetch.DomainTree.insert", lambda: None, insert),
+        Bench("fetch.DomainTree.remove", filled_tree, remove),
+        Bench("fetch.DomainTree.get", filled_tree, lambda tree: tree.get()),
+    ]
+
+    block_path = os.path.join(workdir, "adblock.txt")
+    white_path = os.path.join(workdir, "white.txt")
+    with open(block_path, "w", encoding="utf-8") as f:
+        f.write("! 合成的 Adblock 列表\n")
+        for i, d in enumerate(domains):
+            if i % 50 == 0:
+                f.write(f"@@||{d}^\n")
+            elif i % 40 == 0:
+                f.write(f"||{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}^\n")
+            elif i % 30 == 0:
+                f.write(f"||*{d.split('.')[0]}*^\n")
+            else:
+                f.write(f"||{d}^\n")
+    with open(white_path, "w", encoding="utf-8") as f:
+        f.writelines(f"||{d}^\n" for d in removed[:200])
+
+    def adblock(_: Any) -> None:
+        fetch.ABFURLS = ("file://" + block_path,)
+        fetch.ABFWHITE = ("file://" + white_path,)
+        with contextlib.redirect_stdout(io.StringIO()):
+            fetch.merge_adblock("REJECT", {})
+
+    benches.append(Bench("fetch.merge_adblock", lambda: None, adblock))
+    return benches
+
+
+def mrs_benches(workdir: str) -> List[Bench]:
+    sys.path.insert(0, MRS_DIR)
+    start = load_module(os.path.join(MRS_DIR, "start.py"), "start")
+    start.logger.remove()
+    RuleDecoder, RuleSet = start.RuleDecoder, start.RuleSet
+
+    rng = random.Random(SEED + 1)
+    domains = [_domain(rng) for _ in range(RULE_LINES)]
+    ips = [
+        f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.0/{rng.choice((16, 20, 24, 24, 28))}"
+        for _ in range(RULE_LINES)
+    ] + [f"2001:db8:{i:x}::/48" for i in range(RULE_LINES // 20)]
+    prefixes = ("", "+.", ".")
+    texts = {
+        "rule_text": "\n".join(prefixes[i % 3] + d for i, d in enumerate(domains)),
+        "clash_payload": "payload:\n" + "\n".join(f"  - '+.{d}'" for d in domains),
+        "plain_domain": "# 纯域名\n" + "\n".join(domains),
+        "hosts": "\n".join(f"0.0.0.0 {d}" for d in domains),
+        "adblock": "\n".join(f"||{d}^" for d in domains),
+        "cidr": "\n".join(ips),
+    }
+    benches = [
+        Bench(f"mrs.RuleDecoder.{name}", lambda: None, lambda _, n=name, t=text: getattr(RuleDecoder, n)(t))
+        for name, text in texts.items()
+    ]
+
+    domain_records = set(RuleDecoder.rule_text(texts["rule_text"]))
+    # 加入被后缀规则覆盖的子域名，走完去冗余的各条路径
+    domain_records.update("www." + r[2:] for r in sorted(domain_records)[::5] if r[:2] == "+.")
+    cidr_records = set(RuleDecoder.cidr(texts["cidr"]))
+    benches += [
+        Bench("mrs.RuleSet.minimize_domains", lambda: None, lambda _: RuleSet.minimize_domains(domain_records)),
+        Bench("mrs.RuleSet.minimize_cidrs", lambda: None, lambda _: RuleSet.minimize_cidrs(cidr_records)),
+        Bench("mrs.RuleSet.serialize", lambda: None, lambda _: RuleSet.serialize(domain_records, "yaml")),
+    ]
+
+    generator = SimpleNamespace(tracer=start.Tracer())
+    task = start.TaskConfig(type="domain", format="yaml", sources=[])
+    path = Path(workdir) / "processed.yaml"
+    benches.append(
+        Bench(
+            "mrs._write_processed_content",
+            lambda: None,
+            lambda _: start.RulesetGenerator._write_processed_content(generator, domain_records, path, task),
+        )
+    )
+    return benches
+
+
+def measure(bench: Bench, rounds: int, min_time: float = MIN_TIME) -> Dict[str, float]:
+    """运行至少 `rounds` 轮且累计至少 `min_time` 秒（最多 MAX_ROUNDS 轮）"""
+    times: List[float] = []
+    # 第一轮预热，不计入结果；计时期间关闭垃圾回收，减少其他项目留下的垃圾造成的波动
+    i = 0
+    while i <= rounds or (sum(times) < min_time and i <= MAX_ROUNDS):
+        i += 1
+        state = bench.setup()
+        gc.collect()
+        gc.disable()
+        try:
+            begin = time.perf_counter()
+            bench.run(state)
+            elapsed = time.perf_counter() - begin
+        finally:
+            gc.enable()
+        if i > 1:
+            times.append(elapsed)
+    return {"min": min(times), "median": statistics.median(times)}
+
+
+def _calibration(_: Any) -> None:
+    """固定的纯 Python 工作量：字符串拼接、切分和字典操作"""
+    counts: Dict[str, int] = {}
+    for i in range(20000):
+        for part in f"host{i % 997}.zone{i % 31}.example.com".split("."):
+            counts[part] = counts.get(part, 0) + 1
+
+
+# 各组的校准项（如 `fetch.calibration`）在每次测量后紧接着运行，各项的耗时除以它，
+# 得到以校准项为单位的耗时（`calibrated`），比较时使用这个值
+CALIBRATION = "calibration"
+
+GROUPS: Dict[str, Callable[[str], List[Bench]]] = {"fetch": fetch_benches, "mrs": mrs_benches}
+
+
+def machine() -> Dict[str, str]:
+    return {"python": platform.python_version(), "machine": platform.machine(), "system": platform.system()}
+
+
+def ratio(name: str, results: Dict[str, Dict[str, float]], base_results: Dict[str, Dict[str, float]]) -> float:
+    """相对基准的耗时比值，按校准项换算；没有基准时为 0"""
+    if name not in base_results:
+        return 0.0
+    current, base = results[name], base_results[name]
+    if "calibrated" in current and "calibrated" in base:
+        return current["calibrated"] / base["calibrated"]
+    return current["min"] / base["min"]
+
+
+def run_group(
+    group: str, args: argparse.Namespace, base_results: Dict[str, Dict[str, float]]
+) -> Dict[str, Dict[str, float]]:
+    """在临时目录中运行一组项目并逐项输出"""
+    cwd = os.getcwd()
+    results: Dict[str, Dict[str, float]] = {}
+    with tempfile.TemporaryDirectory(prefix="bench_micro_") as workdir:
+        os.chdir(workdir)
+        try:
+            benches = [
+                b
+                for b in GROUPS[group](workdir)
+                if not args.filters or any(k in b.name for k in args.filters)
+            ]
+            calibration = Bench(f"{group}.{CALIBRATION}", lambda: None, _calibration)
+            runs: Dict[str, List[Dict[str, float]]] = {b.name: [] for b in benches}
+            samples: List[float] = []
+            # 共享机器上的干扰常持续数秒：各项轮流测量，干扰只影响每项的少数几次，
+            # 取中位数时被排除
+            for _ in range(args.runs):
+                for bench in benches:
+                    result = measure(bench, args.rounds)
+                    cost = measure(calibration, 3, 0.0)["min"]
+                    result["calibrated"] = result["min"] / cost
+                    runs[bench.name].append(result)
+                    samples.append(cost)
+            for bench in benches:
+                results[bench.name] = {
+                    key: statistics.median(r[key] for r in runs[bench.name])
+                    for key in ("min", "median", "calibrated")
+                }
+            if samples:
+                results[calibration.name] = {"min": min(samples), "median": statistics.median(samples)}
+            for bench in benches:
+                result = results[bench.name]
+                line = f"{bench.name:<38}{result['min'] * 1000:>10.2f}ms{result['median'] * 1000:>10.2f}ms"
+                if bench.name in base_results:
+                    r = ratio(bench.name, results, base_results)
+                    line += f"{r:>8.2f}x"
+                    if r > 1 + args.threshold:
+                        line += "  变慢！"
+                else:
+                    line += "  无基准"
+                print(line, flush=True)
+        finally:
+            os.chdir(cwd)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-k", dest="filters", action="append", default=[], help="只运行名称包含该字符串的项目，可重复")
+    parser.add_argument("--rounds", type=int, default=ROUNDS, help="每项每次测量至少运行的轮数")
+    parser.add_argument("--runs", type=int, default=RUNS, help="每项测量的次数，取中位数")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="允许的变慢比例")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="基准文件")
+    parser.add_argument("--update", action="store_true", help="把本次结果写入基准文件")
+    parser.add_argument("--json", help="把本次结果写入 JSON 文件")
+    # 内部使用：在子进程中只运行一组
+    parser.add_argument("--group", choices=sorted(GROUPS), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    try:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline: Dict[str, Any] = json.load(f)
+    except (OSError, ValueError):
+        baseline = {}
+    base_results: Dict[str, Dict[str, float]] = baseline.get("results", {})
+
+    if args.group:
+        results = run_group(args.group, args, base_results)
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f)
+        return
+
+    if baseline and not args.update and baseline.get("machine") != machine():
+        print(f"警告：基准记录于 {baseline.get('machine')}，当前为 {machine()}，结果仅供参考", file=sys.stderr)
+    # 每组在单独的进程中运行，前一组留下的对象不会影响后一组的结果
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="bench_micro_") as tmp:
+        for group in GROUPS:
+            out = os.path.join(tmp, group + ".json")
+            cmd = [sys.executable, os.path.abspath(__file__), "--group", group, "--json", out]
+            cmd += ["--rounds", str(args.rounds), "--runs", str(args.runs), "--threshold", str(args.threshold)]
+            cmd += ["--baseline", args.baseline]
+            for k in args.filters:
+                cmd += ["-k", k]
+            subprocess.run(cmd, check=True)
+            with open(out, encoding="utf-8") as f:
+                results.update(json.load(f))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"machine": machine(), "results": results}, f, ensure_ascii=False, indent=2)
+    if args.update:
+        base_results.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"machine": machine(), "results": base_results}, f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"已更新基准：{args.baseline}")
+        return
+    for group in GROUPS:
+        key = f"{group}.{CALIBRATION}"
+        if key in results and key in base_results:
+            speed = results[key]["median"] / base_results[key]["median"]
+            print(f"{group} 组的校准项耗时为基准的 {speed:.2f}x，以上比值已按此换算")
+    regressions = [
+        name
+        for name in results
+        if not name.endswith("." + CALIBRATION)
+        and ratio(name, results, base_results) > 1 + args.threshold
+    ]
+    if regressions:
+        print(f"{len(regressions)} 项比基准慢超过 {args.threshold:.0%}：{', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
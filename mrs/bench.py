@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""规则集流水线基准测试
+
+在本地 HTTP 服务器上提供各解码器对应格式的合成规则源，用桩转换器端到端运行
+`RulesetGenerator.run`，输出吞吐量、峰值 RSS 和 Tracer 汇总的各阶段耗时到 JSON。
+
+每个规模在独立的子进程中运行，峰值 RSS 互不影响：
+
+    python bench.py --sizes 10000,100000,1000000,5000000 --output bench.json
+"""
+
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import click
+import yaml
+from loguru import logger # type: ignore
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+
+# 桩转换器：`-v` 输出版本，`convert-ruleset` 直接复制文件
+STUB_CONVERTER = """#!/bin/sh
+if [ "$1" = "-v" ]; then echo "Mihomo bench-stub"; exit 0; fi
+exec cp "$4" "$5"
+"""
+
+TLDS = ("com", "net", "org", "cn", "io")
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    """不输出访问日志的静态文件处理器"""
+
+    def log_message(self, format, *args):
+        pass
+
+class SourceGenerator:
+    """合成规则源生成器，相邻源之间有约 20% 的重复，用于覆盖去重路径"""
+
+    @staticmethod
+    def _domain(i: int) -> str:
+        return f"host{i:x}.zone{i % 997}.{TLDS[i % len(TLDS)]}"
+
+    @staticmethod
+    def _write(path: Path, lines, header: str = ""):
+        with open(path, 'w', encoding='utf-8') as f:
+            if header:
+                f.write(header)
+            for line in lines:
+                f.write(line)
+
+    @classmethod
+    def plain_domains(cls, path: Path, start: int, size: int):
+        cls._write(path, (f"{cls._domain(i)}\n" for i in range(start, start + size)),
+                   header="# plain domains\n\n")
+
+    @classmethod
+    def suffix_text(cls, path: Path, start: int, size: int):
+        cls._write(path, (f"+.{cls._domain(i)}\n" if i % 3 else f".{cls._domain(i)}\n"
+                          for i in range(start, start + size)))
+
+    @classmethod
+    def pihole(cls, path: Path, start: int, size: int):
+        cls._write(path, (f"{cls._domain(i)}\n" for i in range(start, start + size)),
+                   header="# pihole\n")
+
+    @classmethod
+    def clash_payload(cls, path: Path, start: int, size: int):
+        cls._write(path, (f"  - '+.{cls._domain(i)}'\n" for i in range(start, start + size)),
+                   header="# clash\npayload:\n")
+
+    @classmethod
+    def adblock(cls, path: Path, start: int, size: int):
+        cls._write(path, (f"||{cls._domain(i)}^\n" for i in range(start, start + size)),
+                   header="! adblock\n[Adblock Plus]\n")
+
+    @classmethod
+    def cidr(cls, path: Path, start: int, size: int):
+        cls._write(path, (f"{(i >> 16) % 224 + 1}.{(i >> 8) & 255}.{i & 255}.0/24\n"
+                          for i in range(start, start + size)))
+
+def build_fixture(root: Path, size: int, base_url: str) -> Path:
+    """生成合成源、桩转换器和配置文件，返回配置文件路径"""
+    srv = root / "srv"
+    srv.mkdir(parents=True, exist_ok=True)
+    overlap = size // 5
+    layout = {
+        "ad": ("domain", "yaml", [
+            ("ad_clash.yaml", SourceGenerator.clash_payload, {"format_override": "clash"}),
+            ("ad_plain.txt", SourceGenerator.plain_domains, {"format_override": "domain"}),
+            ("ad_pihole.txt", SourceGenerator.pihole, {"format_override": "pihole"}),
+            ("ad_adblock.txt", SourceGenerator.adblock, {"format_override": "adblock"}),
+        ]),
+        "cn": ("domain", "text", [
+            ("cn_suffix.list", SourceGenerator.suffix_text, {}),
+            ("cn_plain.list", SourceGenerator.plain_domains, {"format_override": "text"}),
+        ]),
+        "cnIP": ("ipcidr", "text", [
+            ("cnip.list", SourceGenerator.cidr, {}),
+        ]),
+    }
+
+    tasks = {}
+    for name, (rule_type, fmt, sources) in layout.items():
+        task_sources = []
+        for i, (filename, generate, options) in enumerate(sources):
+            generate(srv / filename, i * (size - overlap), size)
+            task_sources.append({"url": f"{base_url}/{filename}", **options})
+        tasks[name] = {"type": rule_type, "format": fmt, "sources": task_sources}
+
+    converter = root / "mihomo-stub"
+    converter.write_text(STUB_CONVERTER, encoding='utf-8')
+    converter.chmod(0o755)
+
+    config = {
+        "base": {
+            "work_dir": str(root / "work"),
+            "repo_dir": str(root),
+            "output_dir": str(root / "out"),
+            # 预压缩不属于流水线本身，计入会夸大耗时和输出大小
+            "precompress": False,
+        },
+        "mihomo": {
+            "api_url": f"{base_url}/releases",
+            "binary_pattern": "mihomo",
+            "file_extension": ".gz",
+            "cache_dir": str(root / "cache"),
+            "binary_path": str(converter),
+        },
+        "git": {
+            "user_email": "bench@localhost",
+            "user_name": "bench",
+            "branch": "main",
+            "timezone": "Asia/Shanghai",
+        },
+        "tasks": tasks,
+    }
+    config_path = root / "config.yaml"
+    config_path.write_text(yaml.safe_dump(config, allow_unicode=True), encoding='utf-8')
+    return config_path
+
+def run_case(size: int) -> dict:
+    """在当前进程中运行一个规模的基准测试"""
+    sys.path.insert(0, str(SCRIPT_DIR))
+    from start import RulesetGenerator # type: ignore
+
+    with tempfile.TemporaryDirectory(prefix="mrs-bench-") as tmp:
+        root = Path(tmp)
+        (root / "srv").mkdir()
+        server = ThreadingHTTPServer(("127.0.0.1", 0),
+                                     partial(QuietHandler, directory=str(root / "srv")))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            base_url = f"http://127.0.0.1:{server.server_address[1]}"
+            start = time.perf_counter()
+            config_path = build_fixture(root, size, base_url)
+            generate_seconds = time.perf_counter() - start
+
+            input_bytes = sum(p.stat().st_size for p in (root / "srv").iterdir())
+            input_lines = 0
+            for p in (root / "srv").iterdir():
+                with open(p, 'rb') as f:
+                    input_lines += sum(1 for _ in f)
+
+            generator = RulesetGenerator(config_path, trace_path=root / "trace.json")
+
+            start = time.perf_counter()
+            generator.run(commit=False)
+            wall = time.perf_counter() - start
+
+            output_bytes = sum(p.stat().st_size for p in (root / "out").iterdir())
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    return {
+        "size": size,
+        "input_lines": input_lines,
+        "input_bytes": input_bytes,
+        "output_bytes": output_bytes,
+        "fixture_seconds": round(generate_seconds, 4),
+        "wall_seconds": round(wall, 4),
+        "lines_per_second": round(input_lines / wall, 1),
+        "mib_per_second": round(input_bytes / wall / 1024 / 1024, 3),
+        # Linux 上 ru_maxrss 的单位是 KiB
+        "peak_rss_mib": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "stages": {
+            row.pop("stage"): {k: round(v, 4) if isinstance(v, float) else v for k, v in row.items()}
+            for row in generator.tracer.summary()
+        },
+    }
+
+@click.command()
+@click.option('--sizes', '-s',
+              default='10000,100000,1000000,5000000',
+              help='每个源的行数，逗号分隔')
+@click.option('--output', '-o',
+              default='bench.json',
+              help='结果 JSON 文件路径',
+              type=click.Path())
+@click.option('--case',
+              type=int,
+              hidden=True,
+              help='在当前进程中只运行一个规模，并把结果输出到标准输出')
+def main(sizes, output, case):
+    """MRS 规则集流水线基准测试"""
+    logger.remove()
+
+    if case is not None:
+        logger.add(sys.stderr, level="WARNING")
+        json.dump(run_case(case), sys.stdout)
+        return
+
+    logger.add(sys.stderr, level="INFO", format="<green>{time:HH:mm:ss}</green> | <level>{message}</level>")
+    results = []
+    for size in (int(_) for _ in sizes.split(',') if _.strip()):
+        logger.info(f"运行规模 {size} ...")
+        proc = subprocess.run([sys.executable, __file__, "--case", str(size)],
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            logger.error(f"规模 {size} 运行失败:\n{proc.stderr}")
+            results.append({"size": size, "error": proc.stderr.strip().splitlines()[-1:]})
+            continue
+        result = json.loads(proc.stdout)
+        results.append(result)
+        stages = ", ".join(f"{k} {v['total_seconds']:.2f}s" for k, v in result["stages"].items())
+        logger.info(f"  {result['wall_seconds']:.2f}s，{result['lines_per_second']:.0f} 行/秒，"
+                    f"峰值 RSS {result['peak_rss_mib']} MiB（{stages}）")
+
+    report = {
+        "python": sys.version.split()[0],
+        "time": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "results": results,
+    }
+    Path(output).write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding='utf-8')
+    logger.info(f"结果已写入 {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+../NoMoreWalls/ghclient.py
\ No newline at end of file
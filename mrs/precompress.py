@@ -0,0 +1 @@
+../NoMoreWalls/precompress.py
\ No newline at end of file
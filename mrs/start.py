@@ -1,16 +1,27 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import gzip
+import hashlib
+import ipaddress
+import json
+import os
+import random
 import shutil
 import subprocess
 import sys
+import threading
+import time
+import zlib
 from pathlib import Path
+from collections import Counter
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from functools import partial
 from datetime import datetime
+from urllib.parse import urlsplit
 from zoneinfo import ZoneInfo
-from typing import Dict, List, Optional, Tuple
-from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple, TypeVar
+from dataclasses import dataclass, field
 from pydantic import BaseModel, Field, ValidationError
 
 import yaml
@@ -20,8 +31,22 @@ from loguru import logger # type: ignore
 
 # 新增 HTTP 重试依赖导入
 from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-from tenacity import retry, stop_after_attempt, wait_exponential # type: ignore
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+
+from ghclient import GitHubClient
+from precompress import precompress, summary as precompress_summary
+
+# 可选的 HTTP/2 支持
+try:
+    import httpx
+    import h2  # noqa: F401  # type: ignore
+except ImportError:
+    httpx = None
+
+# 可重试的传输层异常
+TRANSPORT_ERRORS: Tuple[type, ...] = (requests.RequestException,)
+if httpx is not None:
+    TRANSPORT_ERRORS += (httpx.HTTPError,)
 
 @dataclass
 class SourceConfig:
@@ -36,6 +61,7 @@ class TaskConfig:
     type: str
     format: str
     sources: List[SourceConfig]
+    minimize: bool = True
 
 # Pydantic 配置模型定义
 class BaseConfigModel(BaseModel):
@@ -46,11 +72,24 @@ class BaseConfigModel(BaseModel):
     max_concurrent_tasks: int = Field(3)
     max_retries: int = Field(3)
     request_timeout: int = Field(30)
+    retry_backoff: float = Field(0.5)
+    retry_backoff_max: float = Field(10.0)
+    run_deadline: int = Field(900)
+    breaker_threshold: int = Field(3)
+    breaker_cooldown: int = Field(60)
+    allow_partial_sources: bool = Field(False)
+    http2: bool = Field(True)
+    precompress: bool = Field(True)
+    pool_maxsize: Dict[str, int] = Field(default_factory=dict)
 
 class MihomoConfigModel(BaseModel):
     api_url: str
     binary_pattern: str
     file_extension: str
+    release_tag: str = Field("Prerelease-Alpha")
+    cache_dir: str = Field("../../tmp/tool-cache/mihomo")
+    offline: bool = Field(False)
+    binary_path: Optional[str] = None
 
 class GitConfigModel(BaseModel):
     user_email: str
@@ -64,36 +103,617 @@ class ConfigModel(BaseModel):
     git: GitConfigModel
     tasks: Dict[str, TaskConfig]
 
-class TextProcessor:
-    """文本处理器类"""
+# 下载 Mihomo 时的分块大小
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+# 这些主机上的链接会被重定向到对应的主机，连接池需要一并按源数量放大
+REDIRECT_HOSTS = {
+    "github.com": ("raw.githubusercontent.com",
+                   "objects.githubusercontent.com",
+                   "release-assets.githubusercontent.com"),
+}
+
+# 视为暂时性故障、可以重试的 HTTP 状态码
+RETRY_STATUS = frozenset({429, 500, 502, 503, 504})
+
+class FetchError(Exception):
+    """请求在重试策略内最终失败"""
+
+class TransientFetchError(FetchError):
+    """单次请求遇到暂时性故障（传输错误或可重试的状态码），可以重试"""
+
+T = TypeVar("T")
+
+@dataclass
+class SourceResult:
+    """单个源的下载处理结果"""
+    index: int
+    url: str
+    records: List[str] = field(default_factory=list)
+    error: Optional[str] = None
+    elapsed: float = 0.0
+    
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+class Tracer:
+    """记录各阶段的耗时区间，可导出为 Chrome trace 并汇总
+    
+    每个区间记录名称、线程和 bytes_in/bytes_out/lines_in/lines_out 等参数，
+    名称中冒号前的部分作为汇总时的类别。
+    """
+    
+    COUNTERS = ("bytes_in", "bytes_out", "lines_in", "lines_out")
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter_ns()
+        self.events: List[dict] = []
+        self.threads: Dict[int, str] = {}
+    
+    @contextmanager
+    def span(self, name: str, **args) -> Iterator[dict]:
+        """记录一个区间，产出的字典可在区间内补充参数"""
+        tid = threading.get_native_id()
+        start = time.perf_counter_ns()
+        try:
+            yield args
+        finally:
+            end = time.perf_counter_ns()
+            event = {
+                "name": name,
+                "cat": name.split(":", 1)[0],
+                "ph": "X",
+                "ts": (start - self._origin) / 1000,
+                "dur": (end - start) / 1000,
+                "pid": os.getpid(),
+                "tid": tid,
+                "args": args,
+            }
+            with self._lock:
+                self.events.append(event)
+                self.threads.setdefault(tid, threading.current_thread().name)
+    
+    def export_chrome(self, path: Path):
+        """导出为 chrome://tracing / Perfetto 可读取的 JSON"""
+        metadata = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid,
+                     "args": {"name": thread_name}}
+                    for tid, thread_name in self.threads.items()]
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps({"traceEvents": metadata + self.events,
+                                    "displayTimeUnit": "ms"}, ensure_ascii=False),
+                        encoding='utf-8')
+    
+    def summary(self) -> List[dict]:
+        """按类别汇总调用次数、累计和最长耗时以及各计数器"""
+        rows: Dict[str, dict] = {}
+        for event in self.events:
+            row = rows.setdefault(event["cat"], {"stage": event["cat"], "calls": 0,
+                                                 "total_seconds": 0.0, "max_seconds": 0.0,
+                                                 **{k: 0 for k in self.COUNTERS}})
+            seconds = event["dur"] / 1e6
+            row["calls"] += 1
+            row["total_seconds"] += seconds
+            row["max_seconds"] = max(row["max_seconds"], seconds)
+            for key in self.COUNTERS:
+                row[key] += event["args"].get(key, 0)
+        return sorted(rows.values(), key=lambda r: -r["total_seconds"])
+    
+    def log_summary(self):
+        """以表格形式输出汇总"""
+        header = (f"{'stage':<20}{'calls':>7}{'total(s)':>10}{'max(s)':>10}"
+                  f"{'bytes_in':>14}{'bytes_out':>14}{'lines_in':>12}{'lines_out':>12}")
+        lines = [header]
+        for row in self.summary():
+            lines.append(f"{row['stage']:<20}{row['calls']:>7}{row['total_seconds']:>10.3f}"
+                         f"{row['max_seconds']:>10.3f}{row['bytes_in']:>14}{row['bytes_out']:>14}"
+                         f"{row['lines_in']:>12}{row['lines_out']:>12}")
+        logger.info("阶段耗时汇总:\n" + "\n".join(lines))
+
+class RetryPolicy:
+    """统一的重试策略：带抖动的指数退避，并受整次运行的截止时间约束"""
+    
+    def __init__(self, max_retries: int, backoff: float, backoff_max: float, deadline: float):
+        self.attempts = max_retries + 1
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.deadline = deadline
+        self.deadline_at = time.monotonic() + deadline
+    
+    def start(self):
+        """从现在开始计算截止时间"""
+        self.deadline_at = time.monotonic() + self.deadline
+    
+    def remaining(self) -> float:
+        return self.deadline_at - time.monotonic()
+    
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """第 attempt 次失败后的等待时间（full jitter）"""
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff * (2 ** attempt)))
+
+class CircuitBreaker:
+    """按主机（含端口）熔断：连续失败的不同 URL 数达到阈值后，冷却期内该主机上的请求直接失败
+    
+    同一 URL 的重试只算一次，单个源失效不会拖累同一主机上的其他源。
+    """
+    
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures: Dict[str, Set[str]] = {}
+        self._open_until: Dict[str, float] = {}
+    
+    def allow(self, host: str) -> bool:
+        """冷却期结束后放行请求（半开状态），再次失败会立即重新熔断"""
+        with self._lock:
+            return time.monotonic() >= self._open_until.get(host, 0.0)
+    
+    def record_success(self, host: str):
+        with self._lock:
+            self._failures.pop(host, None)
+            self._open_until.pop(host, None)
+    
+    def record_failure(self, host: str, url: str):
+        with self._lock:
+            failing = self._failures.setdefault(host, set())
+            failing.add(url)
+            if len(failing) >= self.threshold:
+                self._open_until[host] = time.monotonic() + self.cooldown
+                logger.warning(f"主机 {host} 上连续有 {len(failing)} 个地址请求失败，"
+                               f"熔断 {self.cooldown} 秒")
+
+class TransportStats:
+    """传输层统计：新建连接（即握手）次数、请求数、字节数和下载耗时"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.handshakes: Counter = Counter()
+        self.requests: Counter = Counter()
+        self.bytes_in = 0
+        self.download_seconds = 0.0
+    
+    def record_handshake(self, host: str):
+        with self._lock:
+            self.handshakes[host] += 1
+    
+    def record_request(self, host: str, nbytes: int, seconds: float):
+        with self._lock:
+            self.requests[host] += 1
+            self.bytes_in += nbytes
+            self.download_seconds += seconds
+
+def _counting_pool(base: type, stats: TransportStats) -> type:
+    """生成在新建连接时计数的连接池类"""
+    class CountingPool(base):
+        def _new_conn(self):
+            stats.record_handshake(self.host)
+            return super()._new_conn()
+    return CountingPool
+
+class CountingHTTPAdapter(HTTPAdapter):
+    """统计握手次数的 HTTPAdapter"""
+    
+    def __init__(self, stats: TransportStats, **kwargs):
+        self.stats = stats
+        super().__init__(**kwargs)
+    
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool(HTTPConnectionPool, self.stats),
+            "https": _counting_pool(HTTPSConnectionPool, self.stats),
+        }
+
+class HttpTransport:
+    """所有任务与 Mihomo 下载共享的 HTTP 传输层
+    
+    有 httpx 和 h2 时使用 HTTP/2 多路复用，否则使用按主机划分连接池的 requests Session。
+    """
+    
+    def __init__(self, base_config: dict, pool_sizes: Dict[str, int]):
+        self.stats = TransportStats()
+        self.policy = RetryPolicy(base_config['max_retries'],
+                                  base_config['retry_backoff'],
+                                  base_config['retry_backoff_max'],
+                                  base_config['run_deadline'])
+        self.breaker = CircuitBreaker(base_config['breaker_threshold'],
+                                      base_config['breaker_cooldown'])
+        self.timeout = base_config['request_timeout']
+        self.http2 = bool(base_config.get('http2', True) and httpx is not None)
+        default_size = max(pool_sizes.values(), default=base_config['max_concurrent_downloads'])
+        
+        if self.http2:
+            self.client = httpx.Client(
+                http2=True,
+                follow_redirects=True,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=sum(pool_sizes.values()) or default_size,
+                                    max_keepalive_connections=sum(pool_sizes.values()) or default_size),
+            )
+            return
+        
+        # 重试由 RetryPolicy 统一负责，适配器本身不重试
+        self.client = requests.Session()
+        adapter = CountingHTTPAdapter(self.stats,
+                                      pool_connections=max(len(pool_sizes), 1),
+                                      pool_maxsize=default_size)
+        self.client.mount("http://", adapter)
+        self.client.mount("https://", adapter)
+        for host, size in pool_sizes.items():
+            host_adapter = CountingHTTPAdapter(self.stats, pool_connections=1, pool_maxsize=size)
+            self.client.mount(f"https://{host}/", host_adapter)
+            self.client.mount(f"http://{host}/", host_adapter)
+    
+    def _trace(self, host: str):
+        """httpx 的 trace 回调：在新建 TCP 连接时计数"""
+        def trace(event_name: str, info: dict):
+            if event_name == "connection.connect_tcp.complete":
+                self.stats.record_handshake(host)
+        return trace
+    
+    def _timeout(self, timeout: Optional[float]) -> float:
+        """单次请求的超时，不超过剩余的运行时间"""
+        remaining = self.policy.remaining()
+        if remaining <= 0:
+            raise FetchError("已超过本次运行的截止时间")
+        return min(timeout or self.timeout, remaining)
+    
+    def _get_once(self, url: str, host: str, timeout: float, headers: Optional[dict] = None):
+        start = time.perf_counter()
+        if self.http2:
+            response = self.client.get(url, headers=headers, timeout=timeout,
+                                       extensions={"trace": self._trace(host)})
+        else:
+            response = self.client.get(url, headers=headers, timeout=timeout)
+        self.stats.record_request(host, len(response.content), time.perf_counter() - start)
+        return response
+    
+    def get(self, url: str, timeout: Optional[float] = None, headers: Optional[dict] = None,
+            passthrough: frozenset = frozenset()):
+        """完整读取响应体的 GET 请求，按重试策略和熔断状态重试
+        
+        成功时返回 2xx/3xx 响应，passthrough 中的状态码不重试、直接返回给调用方处理，
+        否则抛出 FetchError。
+        """
+        parts = urlsplit(url)
+        host, endpoint = parts.hostname or "", parts.netloc
+        policy = self.policy
+        last_error = ""
+        for attempt in range(policy.attempts):
+            if not self.breaker.allow(endpoint):
+                raise FetchError(f"主机 {endpoint} 已熔断" + (f"，上次错误: {last_error}" if last_error else ""))
+            retry_after = None
+            try:
+                response = self._get_once(url, host, self._timeout(timeout), headers)
+            except TRANSPORT_ERRORS as e:
+                last_error = f"{type(e).__name__}: {e}"
+            else:
+                if response.status_code < 400 or response.status_code in passthrough:
+                    self.breaker.record_success(endpoint)
+                    return response
+                if response.status_code not in RETRY_STATUS:
+                    # 主机可用，只是资源本身有问题，重试没有意义
+                    self.breaker.record_success(endpoint)
+                    raise FetchError(f"HTTP {response.status_code}")
+                last_error = f"HTTP {response.status_code}"
+                header = response.headers.get("Retry-After", "")
+                retry_after = float(header) if header.isdigit() else None
+            
+            self.breaker.record_failure(endpoint, url)
+            if attempt + 1 < policy.attempts:
+                delay = policy.delay(attempt, retry_after)
+                if delay >= policy.remaining():
+                    break
+                logger.debug(f"{url} 第 {attempt + 1} 次请求失败 ({last_error})，{delay:.2f} 秒后重试")
+                time.sleep(delay)
+        raise FetchError(last_error or "请求失败")
+    
+    @contextmanager
+    def stream(self, url: str, chunk_size: int, timeout: Optional[float] = None) -> Iterator[Iterator[bytes]]:
+        """流式 GET 请求，产出响应体分块的迭代器
+        
+        只请求一次，结果记入熔断器：传输错误和可重试的状态码抛出 TransientFetchError，
+        其他错误状态码抛出 FetchError。需要重试时使用 download。
+        """
+        parts = urlsplit(url)
+        host, endpoint = parts.hostname or "", parts.netloc
+        if not self.breaker.allow(endpoint):
+            raise FetchError(f"主机 {endpoint} 已熔断")
+        timeout = self._timeout(timeout)
+        start = time.perf_counter()
+        received = 0
+        
+        def counted(chunks: Iterator[bytes]) -> Iterator[bytes]:
+            nonlocal received
+            for chunk in chunks:
+                received += len(chunk)
+                yield chunk
+        
+        try:
+            if self.http2:
+                response = self.client.stream("GET", url, timeout=timeout,
+                                              extensions={"trace": self._trace(host)})
+            else:
+                response = self.client.get(url, stream=True, timeout=timeout)
+            with response as r:
+                if r.status_code >= 400:
+                    if r.status_code in RETRY_STATUS:
+                        self.breaker.record_failure(endpoint, url)
+                        raise TransientFetchError(f"HTTP {r.status_code}")
+                    # 主机可用，只是资源本身有问题
+                    self.breaker.record_success(endpoint)
+                    raise FetchError(f"HTTP {r.status_code}")
+                if self.http2:
+                    yield counted(r.iter_bytes(chunk_size))
+                else:
+                    yield counted(r.iter_content(chunk_size=chunk_size))
+        except TRANSPORT_ERRORS as e:
+            self.breaker.record_failure(endpoint, url)
+            raise TransientFetchError(f"{type(e).__name__}: {e}") from e
+        else:
+            self.breaker.record_success(endpoint)
+        finally:
+            self.stats.record_request(host, received, time.perf_counter() - start)
+    
+    def download(self, url: str, chunk_size: int, consume: Callable[[Iterator[bytes]], T],
+                 timeout: Optional[float] = None) -> T:
+        """按重试策略流式下载，由 consume 逐块处理响应体并返回结果
+        
+        每次重试都重新下载整个文件，consume 需要在每次调用时重置自身状态。
+        consume 抛出 ValueError（数据不完整、校验不符等）时同样重新下载。
+        """
+        policy = self.policy
+        last_error = ""
+        for attempt in range(policy.attempts):
+            try:
+                with self.stream(url, chunk_size, timeout) as chunks:
+                    return consume(chunks)
+            except (TransientFetchError, ValueError) as e:
+                last_error = str(e)
+            
+            if attempt + 1 < policy.attempts:
+                delay = policy.delay(attempt)
+                if delay >= policy.remaining():
+                    break
+                logger.warning(f"{url} 第 {attempt + 1} 次下载失败 ({last_error})，{delay:.2f} 秒后重试")
+                time.sleep(delay)
+        raise FetchError(last_error or "下载失败")
+    
+    def report(self):
+        """输出本次运行的握手次数与下载耗时"""
+        stats = self.stats
+        protocol = "HTTP/2" if self.http2 else "HTTP/1.1"
+        logger.info(f"传输统计 ({protocol}): 请求 {sum(stats.requests.values())} 次，"
+                    f"握手 {sum(stats.handshakes.values())} 次，"
+                    f"下载 {stats.bytes_in / 1024 / 1024:.2f} MiB，"
+                    f"累计下载耗时 {stats.download_seconds:.2f} 秒")
+        for host in sorted(stats.requests):
+            logger.debug(f"  {host}: 请求 {stats.requests[host]} 次，握手 {stats.handshakes[host]} 次")
+    
+    def close(self):
+        self.client.close()
+
+# 旧配置中的格式名到解码器的映射
+DECODER_ALIASES = {
+    "yaml": "clash",
+    "list": "text",
+}
+
+# classical 规则类型到紧凑记录前缀的映射
+CLASSICAL_PREFIXES = {
+    "DOMAIN": "",
+    "DOMAIN-SUFFIX": "+.",
+    "IP-CIDR": "",
+    "IP-CIDR6": "",
+}
+
+class RuleDecoder:
+    """规则源解码器类
+    
+    每个解码器把源文本解析为紧凑的规范记录：域名规则使用 Mihomo text 格式
+    （`a.com`、`+.a.com`、`.a.com`），IP 规则使用规范化的 CIDR。
+    YAML 列表的前后缀只在输出时添加。
+    """
+    
+    @staticmethod
+    def _lines(text: str) -> Iterator[str]:
+        """去掉空行和注释后的行"""
+        for line in text.splitlines():
+            line = line.strip()
+            if line and line[0] != '#':
+                yield line
+    
+    @staticmethod
+    def _rule(value: str) -> Optional[str]:
+        """把单条规则值规范化为记录，无法表示时返回 None"""
+        if ',' in value:
+            rule_type, _, value = value.partition(',')
+            prefix = CLASSICAL_PREFIXES.get(rule_type.strip().upper())
+            if prefix is None:
+                return None
+            value = prefix + value.split(',', 1)[0].strip()
+        value = value.lower().rstrip('.')
+        if not value or ' ' in value or '\t' in value:
+            return None
+        return value
+    
+    @staticmethod
+    def rule_text(text: str) -> List[str]:
+        """Mihomo text 格式：每行一条，可带 `+.`/`.` 前缀"""
+        rule = RuleDecoder._rule
+        return [r for r in map(rule, RuleDecoder._lines(text)) if r]
+    
+    @staticmethod
+    def clash_payload(text: str) -> List[str]:
+        """Clash rule-provider YAML：`payload:` 下的列表项"""
+        rule = RuleDecoder._rule
+        records = []
+        for line in RuleDecoder._lines(text):
+            if line[:2] != '- ':
+                continue
+            r = rule(line[2:].strip().strip('\'"'))
+            if r:
+                records.append(r)
+        return records
+    
+    @staticmethod
+    def plain_domain(text: str) -> List[str]:
+        """纯域名列表，只匹配域名本身"""
+        rule = RuleDecoder._rule
+        return [r for r in map(rule, RuleDecoder._lines(text)) if r and r[0] not in '+.*']
+    
+    @staticmethod
+    def hosts(text: str) -> List[str]:
+        """hosts / pihole 格式：`0.0.0.0 a.com` 或 `a.com`，匹配域名及其子域名"""
+        records = []
+        for line in RuleDecoder._lines(text):
+            fields = line.split('#', 1)[0].split()
+            if not fields:
+                continue
+            domain = fields[-1].lower().rstrip('.')
+            if domain in ("localhost", "localhost.localdomain", "0.0.0.0") or '/' in domain:
+                continue
+            records.append("+." + domain)
+        return records
     
     @staticmethod
-    def remove_comments_and_empty(text: str) -> str:
-        """移除注释和空行"""
-        lines = [line for line in text.splitlines() 
-                if line.strip() and not line.strip().startswith('#')]
-        return "\n".join(lines)
+    def adblock(text: str) -> List[str]:
+        """Adblock 格式：只取 `||a.com^` 形式的整域名拦截规则"""
+        records = []
+        for line in RuleDecoder._lines(text):
+            if line[:2] != '||':
+                continue
+            domain, sep, options = line[2:].partition('^')
+            if not sep or (options and options not in ("$all", "$important")):
+                continue
+            if '/' in domain or '*' in domain or not domain:
+                continue
+            records.append("+." + domain.lower().rstrip('.'))
+        return records
     
     @staticmethod
-    def add_prefix_suffix(text: str, prefix: str, suffix: str) -> str:
-        """添加前缀和后缀"""
-        lines = [f"{prefix}{line}{suffix}" for line in text.splitlines()]
-        return "\n".join(lines)
+    def _ipv4_network(value: str) -> Optional[Tuple[int, int]]:
+        """解析 IPv4 网段为 (网络地址, 前缀长度)，不是 IPv4 时返回 None"""
+        addr, _, prefix = value.partition('/')
+        octets = addr.split('.')
+        if len(octets) != 4:
+            return None
+        try:
+            a, b, c, d = map(int, octets)
+            bits = int(prefix) if prefix else 32
+        except ValueError:
+            return None
+        if not (0 <= a <= 255 and 0 <= b <= 255 and 0 <= c <= 255 and 0 <= d <= 255 and 0 <= bits <= 32):
+            return None
+        mask = (0xFFFFFFFF << (32 - bits)) & 0xFFFFFFFF
+        return ((a << 24) | (b << 16) | (c << 8) | d) & mask, bits
     
     @staticmethod
-    def format_pihole(text: str) -> str:
-        """格式化为pihole格式"""
-        return TextProcessor.add_prefix_suffix(text, "  - '+.", "'")
+    def cidr(text: str) -> List[str]:
+        """CIDR 列表，单个 IP 视为 /32 或 /128"""
+        ipv4_network = RuleDecoder._ipv4_network
+        records = []
+        for line in RuleDecoder._lines(text):
+            value = line
+            if ',' in value:
+                value = RuleDecoder._rule(value) or ""
+            network = ipv4_network(value)
+            if network is not None:
+                records.append(f"{_ipv4_str(network[0])}/{network[1]}")
+                continue
+            try:
+                records.append(ipaddress.ip_network(value, strict=False).compressed)
+            except ValueError:
+                continue
+        return records
+
+def _ipv4_str(ip: int) -> str:
+    return f"{ip >> 24}.{(ip >> 16) & 255}.{(ip >> 8) & 255}.{ip & 255}"
+
+class RuleSet:
+    """对规范记录去冗余并序列化"""
     
     @staticmethod
-    def format_yaml_list(text: str) -> str:
-        """格式化为YAML列表格式"""
-        return TextProcessor.add_prefix_suffix(text, "  - '", "'")
+    def minimize_domains(records: Set[str]) -> Set[str]:
+        """去掉已被 `+.`/`.` 后缀规则覆盖的记录"""
+        covers_self = {r[2:] for r in records if r[:2] == '+.'}
+        covers_subdomains = covers_self | {r[1:] for r in records if r[:1] == '.'}
+        
+        def covered(record: str) -> bool:
+            if record[:1] == '*':
+                return False
+            if record[:2] == '+.':
+                domain = record[2:]
+            elif record[:1] == '.':
+                domain = record[1:]
+                if domain in covers_self:
+                    return True
+            else:
+                domain = record
+                if domain in covers_self:
+                    return True
+            # 检查真正的上级域名
+            pos = domain.find('.')
+            while pos != -1:
+                if domain[pos + 1:] in covers_subdomains:
+                    return True
+                pos = domain.find('.', pos + 1)
+            return False
+        
+        return {r for r in records if not covered(r)}
+    
+    @staticmethod
+    def minimize_cidrs(records: Set[str]) -> Set[str]:
+        """合并相邻和包含关系的网段
+        
+        IPv4 按整数区间合并后重新拆分为最少的网段，IPv6 交给 ipaddress。
+        """
+        ranges: List[Tuple[int, int]] = []
+        ipv6 = []
+        for record in records:
+            network = RuleDecoder._ipv4_network(record)
+            if network is None:
+                ipv6.append(ipaddress.ip_network(record))
+            else:
+                start, bits = network
+                ranges.append((start, start + (1 << (32 - bits)) - 1))
+        
+        collapsed: Set[str] = set()
+        ranges.sort()
+        merged: List[List[int]] = []
+        for start, end in ranges:
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        for start, end in merged:
+            while start <= end:
+                # 起点对齐且不超出区间的最大块
+                size = (start & -start).bit_length() - 1 if start else 32
+                size = min(size, (end - start + 1).bit_length() - 1)
+                collapsed.add(f"{_ipv4_str(start)}/{32 - size}")
+                start += 1 << size
+        
+        collapsed.update(n.compressed for n in ipaddress.collapse_addresses(ipv6))
+        return collapsed
+    
+    @staticmethod
+    def serialize(records: Set[str], format_type: str) -> str:
+        """按输出格式排序并添加前后缀"""
+        body = sorted(records)
+        if format_type == "yaml":
+            return "payload:\n" + "\n".join(f"  - '{r}'" for r in body)
+        return "\n".join(body)
 
 class RulesetGenerator:
     """规则集生成器主类"""
     
-    def __init__(self, config_path: Path):
+    def __init__(self, config_path: Path, offline: bool = False,
+                 trace_path: Optional[Path] = None):
         # 先加载原始配置
         raw_config = self._load_config(config_path)
         try:
@@ -104,20 +724,23 @@ class RulesetGenerator:
             sys.exit(1)
         
         self.script_dir = Path(__file__).resolve().parent
+        self.offline = offline or self.config['mihomo']['offline']
+        self.mihomo_path: Optional[Path] = None
+        self.mihomo_version = ""
+        self.tracer = Tracer()
         self._setup_paths()
-        self._setup_processors()
-        
-        # 初始化带重试的 HTTP Session
-        self.session = requests.Session()
-        retry_strategy = Retry(
-            total=self.config['base'].get('max_retries', 3),
-            backoff_factor=0.5,
-            status_forcelist=[429, 500, 502, 503, 504],
-            allowed_methods=["GET"],
-        )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        self.session.mount("http://", adapter)
-        self.session.mount("https://", adapter)
+        self.trace_path = trace_path or self.work_dir / "trace.json"
+        self._setup_decoders()
+        
+        # 初始化共享的 HTTP 传输层
+        self.transport = HttpTransport(self.config['base'], self._pool_sizes())
+        # 发布信息带 ETag 缓存，额度不足时使用缓存；请求经共享传输层重试和熔断，
+        # 403 由 GitHubClient 判断是否为速率限制
+        self.github = GitHubClient(str(self.cache_dir.parent / "github"),
+                                   timeout=self.config['base']['request_timeout'],
+                                   warn=logger.warning,
+                                   send=partial(self.transport.get, passthrough=frozenset({403})),
+                                   errors=(FetchError,))
     
     def _load_config(self, config_path: Path) -> dict:
         """加载配置文件"""
@@ -134,139 +757,323 @@ class RulesetGenerator:
         self.work_dir = (self.script_dir / base_config['work_dir']).resolve()
         self.repo_dir = (self.script_dir / base_config['repo_dir']).resolve()
         self.output_dir = (self.script_dir / base_config['output_dir']).resolve()
+        cache_dir = Path(self.config['mihomo']['cache_dir']).expanduser()
+        self.cache_dir = (self.script_dir / cache_dir).resolve()
         
         logger.info(f"工作目录: {self.work_dir}")
         logger.info(f"仓库目录: {self.repo_dir}")
         logger.info(f"输出目录: {self.output_dir}")
+        logger.info(f"工具缓存: {self.cache_dir}")
+    
+    def _pool_sizes(self) -> Dict[str, int]:
+        """按每个主机上可能同时进行的下载数确定连接池大小"""
+        base_config = self.config['base']
+        per_task = base_config['max_concurrent_downloads']
+        ceiling = per_task * base_config['max_concurrent_tasks']
+        
+        counts: Counter = Counter()
+        for task in self.config['tasks'].values():
+            task_hosts = Counter(urlsplit(src['url']).hostname for src in task['sources'])
+            for host, count in task_hosts.items():
+                counts[host] += min(count, per_task)
+                for target in REDIRECT_HOSTS.get(host, ()):
+                    counts[target] += min(count, per_task)
+        # Mihomo 的发布接口和下载
+        for host in ("api.github.com", "github.com", *REDIRECT_HOSTS["github.com"]):
+            counts[host] += 1
+        
+        sizes = {host: min(count, ceiling) for host, count in counts.items() if host}
+        sizes.update(base_config.get('pool_maxsize') or {})
+        return sizes
     
-    def _setup_processors(self):
-        """设置处理器映射"""
-        self.processors = {
-            "remove_comments_and_empty": TextProcessor.remove_comments_and_empty,
-            "format_pihole": TextProcessor.format_pihole,
-            "format_yaml_list": TextProcessor.format_yaml_list,
+    def _setup_decoders(self):
+        """设置解码器映射，并检查每个源的格式"""
+        self.decoders = {
+            "clash": RuleDecoder.clash_payload,
+            "text": RuleDecoder.rule_text,
+            "domain": RuleDecoder.plain_domain,
+            "hosts": RuleDecoder.hosts,
+            "pihole": RuleDecoder.hosts,
+            "adblock": RuleDecoder.adblock,
+            "cidr": RuleDecoder.cidr,
         }
+        for name, task in self.config['tasks'].items():
+            for src in task['sources']:
+                decoder = self._decoder_name(SourceConfig(**src), task['type'])
+                if decoder not in self.decoders:
+                    logger.error(f"任务 {name} 的源 {src['url']} 使用了未知格式: {decoder}")
+                    sys.exit(1)
+    
+    @staticmethod
+    def _decoder_name(source: SourceConfig, rule_type: str) -> str:
+        """确定源使用的解码器，兼容旧的 format_override/processors 写法"""
+        fmt = source.format_override
+        if not fmt:
+            return "cidr" if rule_type == "ipcidr" else "text"
+        if fmt == "text" and "format_pihole" in (source.processors or []):
+            return "pihole"
+        return DECODER_ALIASES.get(fmt, fmt)
     
     def init_env(self):
         """初始化环境"""
         logger.info("正在初始化环境...")
         self.output_dir.mkdir(parents=True, exist_ok=True)
         self.work_dir.mkdir(parents=True, exist_ok=True)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
         
-        mihomo_path = self.work_dir / "mihomo"
-        if mihomo_path.exists():
-            logger.info("Mihomo 工具已存在，跳过下载")
-            return
-        
-        self._download_mihomo(mihomo_path)
+        self.mihomo_path = self._ensure_mihomo()
+        self.mihomo_version = self._record_mihomo_version(self.mihomo_path)
         logger.info("环境初始化完成")
     
-    def _download_mihomo(self, mihomo_path: Path):
-        """下载Mihomo工具"""
+    def _ensure_mihomo(self) -> Path:
+        """从缓存中取得Mihomo，缓存未命中时下载"""
+        binary_path = self.config['mihomo']['binary_path']
+        if binary_path:
+            logger.info(f"使用指定的Mihomo: {binary_path}")
+            return (self.script_dir / Path(binary_path).expanduser()).resolve()
+        
+        if self.offline:
+            logger.info("离线模式，使用缓存中最新的Mihomo")
+        else:
+            try:
+                tag, asset = self._find_release_asset(self._fetch_releases())
+            except Exception as e:
+                logger.warning(f"查询Mihomo发布信息失败，尝试使用本地缓存: {e}")
+            else:
+                entry = self.cache_dir / tag / self._asset_key(asset)
+                if self._verify_cache_entry(entry):
+                    logger.info(f"命中Mihomo缓存: {entry}")
+                    return entry / "mihomo"
+                return self._download_mihomo(tag, asset, entry)
+        
+        cached = self._newest_cached_mihomo()
+        if cached is None:
+            logger.error(f"缓存目录 {self.cache_dir} 中没有可用的Mihomo")
+            sys.exit(1)
+        logger.info(f"使用缓存的Mihomo: {cached}")
+        return cached
+    
+    def _fetch_releases(self) -> list:
+        """获取发布列表；剩余额度只够保留部分时直接使用缓存的发布信息"""
+        budget = self.github.budget()
+        if budget == 0:
+            logger.info("GitHub API 剩余额度不足，使用缓存的发布信息")
+            return self.github.get_json(self.config['mihomo']['api_url'], max_age=float("inf"))
+        return self.github.get_json(self.config['mihomo']['api_url'])
+    
+    def _find_release_asset(self, releases: list) -> Tuple[str, dict]:
+        """查找匹配的发布标签和资源"""
+        mihomo_config = self.config['mihomo']
+        for release in releases:
+            tag = release.get("tag_name", "")
+            if mihomo_config['release_tag'] in tag:
+                for asset in release.get("assets", []):
+                    name = asset.get("name", "")
+                    if (mihomo_config['binary_pattern'] in name and 
+                        name.endswith(mihomo_config['file_extension'])):
+                        return tag, asset
+        raise ValueError("无法找到Mihomo下载链接")
+    
+    @staticmethod
+    def _asset_sha256(asset: dict) -> str:
+        """返回发布资源声明的 sha256，没有时返回空串"""
+        digest = asset.get("digest") or ""
+        if digest.startswith("sha256:"):
+            return digest[len("sha256:"):]
+        return ""
+    
+    def _asset_key(self, asset: dict) -> str:
+        """缓存键：优先使用资源的 sha256，否则由资源元数据派生"""
+        sha256 = self._asset_sha256(asset)
+        if sha256:
+            return sha256
+        ident = f"{asset.get('id')}:{asset.get('updated_at')}:{asset.get('size')}"
+        return "meta-" + hashlib.sha256(ident.encode('utf-8')).hexdigest()
+    
+    @staticmethod
+    def _file_sha256(path: Path) -> str:
+        """计算文件的 sha256"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+    
+    def _verify_cache_entry(self, entry: Path) -> bool:
+        """校验缓存条目中的二进制文件是否完整"""
+        binary, meta_path = entry / "mihomo", entry / "meta.json"
+        if not (binary.exists() and meta_path.exists()):
+            return False
         try:
-            mihomo_config = self.config['mihomo']
-            response = requests.get(mihomo_config['api_url'], 
-                                  timeout=self.config['base']['request_timeout'])
-            response.raise_for_status()
-            
-            releases = response.json()
-            download_url = self._find_download_url(releases, mihomo_config)
+            meta = json.loads(meta_path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return False
+        if self._file_sha256(binary) != meta.get("binary_sha256"):
+            logger.warning(f"缓存的Mihomo校验失败，重新下载: {entry}")
+            return False
+        return True
+    
+    def _newest_cached_mihomo(self) -> Optional[Path]:
+        """返回缓存中最新且完整的Mihomo"""
+        entries = []
+        for meta_path in self.cache_dir.glob("*/*/meta.json"):
+            try:
+                meta = json.loads(meta_path.read_text(encoding='utf-8'))
+            except (OSError, ValueError):
+                continue
+            entries.append((meta.get("fetched_at", ""), meta_path.parent))
+        for _, entry in sorted(entries, reverse=True):
+            if self._verify_cache_entry(entry):
+                return entry / "mihomo"
+        return None
+    
+    def _download_mihomo(self, tag: str, asset: dict, entry: Path) -> Path:
+        """流式下载并解压Mihomo到缓存条目"""
+        try:
+            download_url = asset["browser_download_url"]
+            expected_sha256 = self._asset_sha256(asset)
+            logger.info(f"从 {download_url} 下载Mihomo...")
             
-            if not download_url:
-                raise ValueError("无法找到Mihomo下载链接")
+            entry.mkdir(parents=True, exist_ok=True)
+            part_path = entry / "mihomo.part"
             
-            logger.info(f"从 {download_url} 下载Mihomo...")
-            gz_path = self.work_dir / "mihomo.gz"
+            def consume(chunks: Iterator[bytes]) -> Tuple[str, str]:
+                # 每次重试都从头解压并重新计算摘要
+                asset_digest = hashlib.sha256()
+                binary_digest = hashlib.sha256()
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                with open(part_path, 'wb') as f:
+                    for chunk in chunks:
+                        asset_digest.update(chunk)
+                        data = decompressor.decompress(chunk)
+                        binary_digest.update(data)
+                        f.write(data)
+                    data = decompressor.flush()
+                    binary_digest.update(data)
+                    f.write(data)
+                
+                if not decompressor.eof:
+                    raise ValueError("gzip 数据不完整")
+                if expected_sha256 and asset_digest.hexdigest() != expected_sha256:
+                    raise ValueError(f"sha256 不匹配: 期望 {expected_sha256}，"
+                                     f"实际 {asset_digest.hexdigest()}")
+                return asset_digest.hexdigest(), binary_digest.hexdigest()
             
-            with requests.get(download_url, stream=True, 
-                            timeout=self.config['base']['request_timeout'] * 2) as r:
-                r.raise_for_status()
-                with open(gz_path, 'wb') as f:
-                    for chunk in r.iter_content(chunk_size=8192):
-                        f.write(chunk)
+            asset_sha256, binary_sha256 = self.transport.download(
+                download_url, DOWNLOAD_CHUNK_SIZE, consume,
+                timeout=self.config['base']['request_timeout'] * 2)
             
-            with gzip.open(gz_path, 'rb') as f_in:
-                with open(mihomo_path, 'wb') as f_out:
-                    shutil.copyfileobj(f_in, f_out)
+            part_path.chmod(0o755)
+            mihomo_path = entry / "mihomo"
+            part_path.replace(mihomo_path)
             
-            gz_path.unlink()
-            mihomo_path.chmod(0o755)
+            meta = {
+                "tag": tag,
+                "asset": asset.get("name", ""),
+                "asset_sha256": asset_sha256,
+                "binary_sha256": binary_sha256,
+                "url": download_url,
+                "fetched_at": datetime.now().astimezone().isoformat(),
+            }
+            (entry / "meta.json").write_text(json.dumps(meta, indent=2), encoding='utf-8')
+            return mihomo_path
             
         except Exception as e:
             logger.error(f"下载Mihomo失败: {e}")
             sys.exit(1)
     
-    def _find_download_url(self, releases: list, mihomo_config: dict) -> str:
-        """查找下载链接"""
-        for release in releases:
-            if "Prerelease-Alpha" in release.get("tag_name", ""):
-                for asset in release.get("assets", []):
-                    name = asset.get("name", "")
-                    if (mihomo_config['binary_pattern'] in name and 
-                        name.endswith(mihomo_config['file_extension'])):
-                        return asset.get("browser_download_url")
-        return ""
+    def _record_mihomo_version(self, mihomo_path: Path) -> str:
+        """记录 `mihomo -v` 的输出，供构建缓存作为键使用"""
+        try:
+            result = subprocess.run([str(mihomo_path), "-v"], check=True,
+                                    capture_output=True, text=True, timeout=30)
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.warning(f"获取Mihomo版本失败: {e}")
+            return ""
+        
+        version = result.stdout.strip().splitlines()[0] if result.stdout.strip() else ""
+        (self.work_dir / "mihomo.version").write_text(version + "\n", encoding='utf-8')
+        logger.info(f"Mihomo版本: {version}")
+        return version
     
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, max=10))
-    def _download_and_process_source(self, source: SourceConfig, index: int) -> Tuple[int, str]:
-        """下载并处理单个源，失败时重试"""
+    def _download_and_process_source(self, source: SourceConfig, index: int,
+                                     rule_type: str) -> SourceResult:
+        """下载并解码单个源，失败时返回带错误信息的结果"""
+        result = SourceResult(index=index, url=source.url)
+        start = time.perf_counter()
         try:
             logger.info(f"下载: {source.url}")
-            response = self.session.get(source.url,
-                                        timeout=self.config['base']['request_timeout'])
-            response.raise_for_status()
-            content = response.text
-            
-            # 应用处理器
-            processors = source.processors or ["remove_comments_and_empty"]
-            for processor_name in processors:
-                if processor_name in self.processors:
-                    content = self.processors[processor_name](content)
+            with self.tracer.span("download", url=source.url) as span:
+                response = self.transport.get(source.url)
+                span["bytes_in"] = len(response.content)
+                content = response.text
             
-            # 确保以换行结束
-            if not content.endswith('\n'):
-                content += '\n'
+            decoder = self._decoder_name(source, rule_type)
+            with self.tracer.span(f"decode:{decoder}", url=source.url) as span:
+                span["lines_in"] = content.count("\n") + 1
+                result.records = self.decoders[decoder](content)
+                span["lines_out"] = len(result.records)
+            logger.debug(f"{source.url} ({decoder}): {len(content)} 字符，"
+                         f"{len(result.records)} 条记录")
             
-            file_size = len(content.encode('utf-8'))
-            logger.debug(f"处理后内容大小: {file_size} 字节")
-            
-            if file_size == 0:
+            if not result.records:
                 logger.warning(f"从 {source.url} 获取的内容为空")
-            
-            return index, content
-            
+        except FetchError as e:
+            result.error = f"下载失败: {e}"
         except Exception as e:
-            logger.warning(f"处理源 {source.url} 时出错: {e}")
-            return index, ""
+            result.error = f"处理失败: {type(e).__name__}: {e}"
+        
+        result.elapsed = time.perf_counter() - start
+        if not result.ok:
+            logger.warning(f"源 {source.url} {result.error}")
+        return result
     
     def process_task(self, name: str, task_config: TaskConfig) -> Optional[List[Path]]:
         """处理单个任务"""
+        with self.tracer.span(f"task:{name}"):
+            return self._process_task(name, task_config)
+    
+    def _process_task(self, name: str, task_config: TaskConfig) -> Optional[List[Path]]:
         logger.info(f"处理 {name} 规则集...")
         
         # 并行下载和处理源
         sources = [SourceConfig(**src) if isinstance(src, dict) else src 
                   for src in task_config.sources]
         
-        results = {}
+        results: Dict[int, SourceResult] = {}
         max_workers = self.config['base']['max_concurrent_downloads']
         
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = {executor.submit(self._download_and_process_source, src, i): i 
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-dl") as executor:
+            futures = {executor.submit(self._download_and_process_source, src, i, task_config.type): i 
                       for i, src in enumerate(sources)}
             
             for future in as_completed(futures):
-                index, content = future.result()
-                results[index] = content
+                result = future.result()
+                results[result.index] = result
         
-        # 合并内容
-        combined_content = "".join(results[i] for i in sorted(results.keys()))
+        failed = [r for r in results.values() if not r.ok]
+        if failed:
+            for r in failed:
+                logger.error(f"{name}: {r.url} {r.error}")
+            if not self.config['base']['allow_partial_sources']:
+                logger.error(f"{name} 有 {len(failed)}/{len(results)} 个源失败，放弃生成该规则集")
+                return None
+            logger.warning(f"{name} 有 {len(failed)}/{len(results)} 个源失败，使用其余源继续生成")
+        
+        # 合并记录
+        records: Set[str] = set()
+        with self.tracer.span(f"merge:{name}") as span:
+            for i in sorted(results.keys()):
+                records.update(results[i].records)
+                span["lines_in"] = span.get("lines_in", 0) + len(results[i].records)
+            span["lines_out"] = len(records)
         
         # 处理文件格式
         temp_source_path = self.work_dir / f"{name}.{task_config.format}"
         final_source_path = self.output_dir / f"{name}.{task_config.format}"
         final_mrs_path = self.output_dir / f"{name}.mrs"
         
-        self._write_processed_content(combined_content, temp_source_path, task_config.format)
+        self._write_processed_content(records, temp_source_path, task_config)
         
         # 转换为MRS格式
         if self._convert_to_mrs(name, task_config.type, task_config.format, 
@@ -276,27 +1083,29 @@ class RulesetGenerator:
         
         return None
     
-    def _write_processed_content(self, content: str, temp_path: Path, format_type: str):
-        """写入处理后的内容"""
-        lines = content.splitlines()
-        if not lines:
+    def _write_processed_content(self, records: Set[str], temp_path: Path, task_config: TaskConfig):
+        """去冗余并写入记录"""
+        if not records:
             raise ValueError("内容为空")
         
-        if format_type == "yaml":
-            header = lines[0]
-            body_lines = sorted(list(set(filter(None, lines[1:]))))
-            final_content = header + "\n" + "\n".join(body_lines)
-        else:
-            unique_sorted_lines = sorted(list(set(filter(None, lines))))
-            final_content = "\n".join(unique_sorted_lines)
-        
-        temp_path.write_text(final_content, encoding='utf-8')
+        with self.tracer.span(f"dedup_write:{temp_path.stem}", lines_in=len(records)) as span:
+            if task_config.minimize:
+                if task_config.type == "ipcidr":
+                    records = RuleSet.minimize_cidrs(records)
+                else:
+                    records = RuleSet.minimize_domains(records)
+                logger.debug(f"{temp_path.name}: 去冗余 {span['lines_in']} -> {len(records)} 条")
+            
+            data = RuleSet.serialize(records, task_config.format).encode('utf-8')
+            temp_path.write_bytes(data)
+            span["lines_out"] = len(records)
+            span["bytes_out"] = len(data)
     
     def _convert_to_mrs(self, name: str, rule_type: str, format_type: str,
                        temp_path: Path, final_source_path: Path, final_mrs_path: Path) -> bool:
         """转换为MRS格式"""
         try:
-            mihomo_executable = self.work_dir / "mihomo"
+            mihomo_executable = self.mihomo_path
             temp_mrs_path = self.work_dir / f"{name}.mrs"
             
             logger.debug(f"转换 {temp_path} 到MRS格式...")
@@ -304,7 +1113,9 @@ class RulesetGenerator:
             cmd = [str(mihomo_executable), "convert-ruleset", rule_type, 
                    format_type, str(temp_path), str(temp_mrs_path)]
             
-            result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+            with self.tracer.span(f"convert:{name}", bytes_in=temp_path.stat().st_size) as span:
+                result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+                span["bytes_out"] = temp_mrs_path.stat().st_size
             
             shutil.move(str(temp_path), str(final_source_path))
             shutil.move(str(temp_mrs_path), str(final_mrs_path))
@@ -354,16 +1165,26 @@ class RulesetGenerator:
         except Exception as e:
             logger.error(f"提交时发生错误: {e}")
     
-    def run(self):
+    def run(self, commit: bool = True):
         """运行主流程"""
-        self.init_env()
+        self.transport.policy.start()
+        try:
+            self._run(commit)
+        finally:
+            self.tracer.export_chrome(self.trace_path)
+            logger.info(f"Trace 已写入 {self.trace_path}")
+            self.tracer.log_summary()
+    
+    def _run(self, commit: bool):
+        with self.tracer.span("init_env"):
+            self.init_env()
         
         tasks = self.config['tasks']
         all_generated_files = []
         max_workers = self.config['base']['max_concurrent_tasks']
         
         # 并行处理任务
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="task") as executor:
             task_configs = {name: TaskConfig(**config) for name, config in tasks.items()}
             futures = {executor.submit(self.process_task, name, config): name 
                       for name, config in task_configs.items()}
@@ -376,16 +1197,36 @@ class RulesetGenerator:
                 else:
                     logger.warning(f"任务 {task_name} 未能成功生成文件")
         
+        self.transport.report()
+        logger.info(self.github.summary())
+        self.transport.close()
+        
         # 文件检查
         if self._validate_generated_files(all_generated_files):
             logger.info("所有文件均已正确生成")
-            self.commit_changes()
+            if self.config['base']['precompress']:
+                with self.tracer.span("precompress"):
+                    self._precompress(all_generated_files)
+            if commit:
+                with self.tracer.span("commit_changes"):
+                    self.commit_changes()
         else:
             logger.error("文件检查失败，跳过Git提交")
             sys.exit(1)
         
         logger.info("所有操作已完成，喵~")
     
+    def _precompress(self, files: List[Path]):
+        """为文本格式的规则集写出 .gz / .zst 副本，MRS 本身已经压缩，不再处理"""
+        texts = [str(path) for path in files if path.suffix != ".mrs"]
+        try:
+            results = precompress(texts, str(self.output_dir / "precompress.json"),
+                                  warn=logger.warning)
+        except OSError as e:
+            logger.error(f"预压缩失败: {e}")
+            return
+        logger.info(f"预压缩: {precompress_summary(results)}")
+    
     def _validate_generated_files(self, files: List[Path]) -> bool:
         """验证生成的文件"""
         if not files:
@@ -411,7 +1252,17 @@ class RulesetGenerator:
               default='INFO',
               help='日志级别',
               type=click.Choice(['DEBUG', 'INFO', 'WARNING', 'ERROR']))
-def main(config, log_level):
+@click.option('--offline',
+              is_flag=True,
+              help='离线模式，直接使用缓存中最新的Mihomo')
+@click.option('--no-commit',
+              is_flag=True,
+              help='只生成文件，不提交到Git')
+@click.option('--trace',
+              default=None,
+              help='Chrome trace 输出路径，默认为工作目录下的 trace.json',
+              type=click.Path())
+def main(config, log_level, offline, no_commit, trace):
     """MRS规则集生成器"""
     # 配置日志
     logger.remove()
@@ -427,8 +1278,9 @@ def main(config, log_level):
         logger.error(f"配置文件不存在: {config_path}")
         sys.exit(1)
     
-    generator = RulesetGenerator(config_path)
-    generator.run()
+    generator = RulesetGenerator(config_path, offline=offline,
+                                  trace_path=Path(trace).resolve() if trace else None)
+    generator.run(commit=not no_commit)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file